@@ -6,6 +6,7 @@ import {manifoldReducer, enhanceReduxMiddleware} from '@mlvis/manifold';
 import {Client as Styletron} from 'styletron-engine-atomic';
 import {Provider as StyletronProvider} from 'styletron-react';
 import Manifold from './manifold';
+import {KERNEL_MODE, kernelReducer} from './kernel';
 import Controls from './controls';
 import {window} from 'global';
 
@@ -13,8 +14,15 @@ import {window} from 'global';
 const composeEnhancer = window.__REDUX_DEVTOOLS_EXTENSION_COMPOSE__ || compose;
 
 export default props => {
+  const isKernelMode = props.mode === KERNEL_MODE;
+  // in the kernel mode the selectors read the results sent by the kernel, in the format of the API responses
+  const initialState = {
+    ...manifoldReducer(undefined, {type: '@@INIT'}),
+    _env: {isKernelMode},
+  };
   const store = createStore(
-    manifoldReducer,
+    isKernelMode ? kernelReducer : manifoldReducer,
+    initialState,
     composeEnhancer(applyMiddleware(...enhanceReduxMiddleware([thunk])))
   );
   const engine = new Styletron();
@@ -22,10 +30,13 @@ export default props => {
     <Provider store={store}>
       <StyletronProvider value={engine}>
         <React.Fragment>
-          <Controls
-            widgetModel={props.widgetModel}
-            widgetView={props.widgetView}
-          />
+          {/* data ids of segments stay in the kernel, there is nothing to export */}
+          {!isKernelMode && (
+            <Controls
+              widgetModel={props.widgetModel}
+              widgetView={props.widgetView}
+            />
+          )}
           <Manifold {...props} />
         </React.Fragment>
       </StyletronProvider>
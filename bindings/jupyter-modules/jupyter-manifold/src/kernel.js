@@ -0,0 +1,57 @@
+import {createAction} from 'redux-actions';
+import {manifoldReducer, UPDATE_SEGMENT_GROUPS} from '@mlvis/manifold';
+
+// rows stay in the kernel, which sends the results of python-compute instead
+export const KERNEL_MODE = 'kernel';
+
+// segmentation computed in the kernel, see `update_segmentation` of the widget
+export const UPDATE_KERNEL_SEGMENTATION = 'UPDATE_KERNEL_SEGMENTATION';
+export const updateKernelSegmentation = createAction(
+  UPDATE_KERNEL_SEGMENTATION
+);
+
+// same as the default segment groups of manifold
+const defaultSegmentGroups = nSegments => {
+  const nTreatment = nSegments < 4 ? 1 : 2;
+  const rangeArr = Array.from(Array(nSegments).keys());
+  return [
+    rangeArr.slice(nSegments - nTreatment),
+    rangeArr.slice(0, nSegments - nTreatment),
+  ];
+};
+
+const isValidSegmentGroups = (segmentGroups, nSegments) =>
+  segmentGroups.length === 2 &&
+  segmentGroups.every(
+    (group, i) =>
+      group.length &&
+      group.every(
+        s => s >= 0 && s < nSegments && !segmentGroups[1 - i].includes(s)
+      )
+  );
+
+/*
+ * Reducer of the kernel mode. The front end has no rows to validate slicing
+ * states against, as manifoldReducer does: segment groups are set as they are,
+ * and segments are the ones of the kernel, numbered from 0 in either
+ * segmentation method.
+ */
+export const kernelReducer = (state, action) => {
+  switch (action.type) {
+    case UPDATE_SEGMENT_GROUPS:
+      return {...state, segmentGroups: action.payload};
+    case UPDATE_KERNEL_SEGMENTATION: {
+      const {nSegments} = action.payload;
+      return {
+        ...state,
+        isManualSegmentation: false,
+        nClusters: nSegments,
+        segmentGroups: isValidSegmentGroups(state.segmentGroups, nSegments)
+          ? state.segmentGroups
+          : defaultSegmentGroups(nSegments),
+      };
+    }
+    default:
+      return manifoldReducer(state, action);
+  }
+};
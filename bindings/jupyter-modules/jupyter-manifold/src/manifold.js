@@ -3,10 +3,26 @@ import Manifold, {
   THEME,
   loadProcessedData,
   validateInputData,
+  fetchBackendDataSuccess,
+  fetchModelsSuccess,
+  fetchFeaturesStart,
+  fetchFeaturesSuccess,
+  updateSegmentGroups,
 } from '@mlvis/manifold';
 import {connect} from 'react-redux';
+import {KERNEL_MODE, updateKernelSegmentation} from './kernel';
 
 const manifoldGetState = state => state;
+const mapStateToProps = state => ({segmentGroups: state.segmentGroups});
+// traits of the widget model holding the results computed in the kernel mode, and their actions
+const KERNEL_RESULTS = {
+  meta_data: fetchBackendDataSuccess,
+  segmentation: updateKernelSegmentation,
+  models_performance: fetchModelsSuccess,
+  features_distribution: fetchFeaturesSuccess,
+};
+// custom message of the kernel once it answered a request of segment groups, see widget_ext/Manifold.py
+const FEATURES_DISTRIBUTION_METHOD = 'features_distribution';
 
 class ManifoldApp extends PureComponent {
   static defaultProps = {
@@ -15,16 +31,82 @@ class ManifoldApp extends PureComponent {
   };
 
   componentDidMount() {
-    const {data} = this.props;
+    const {data, mode, widgetModel} = this.props;
+    if (mode === KERNEL_MODE) {
+      Object.keys(KERNEL_RESULTS).forEach(name => {
+        this._updateKernelResult(name);
+        widgetModel.on(
+          `change:${name}`,
+          () => this._updateKernelResult(name),
+          this
+        );
+      });
+      // segment groups set in the kernel, e.g. with `update_segment_groups`
+      this._updateKernelSegmentGroups();
+      widgetModel.on('change:segments', this._updateKernelSegmentGroups, this);
+      widgetModel.on('msg:custom', this._onCustomMessage, this);
+      return;
+    }
     validateInputData(data);
     this.props.dispatch(loadProcessedData(data));
   }
 
+  componentDidUpdate(prevProps) {
+    const {mode, segmentGroups, widgetModel} = this.props;
+    // the kernel compares the features of the segment groups as they change, and sends them back
+    if (
+      mode === KERNEL_MODE &&
+      widgetModel &&
+      segmentGroups !== prevProps.segmentGroups
+    ) {
+      const segments = JSON.stringify(segmentGroups);
+      if (segments !== widgetModel.get('segments')) {
+        this.props.dispatch(fetchFeaturesStart());
+        widgetModel.set('segments', segments);
+        widgetModel.save_changes();
+      }
+    }
+  }
+
+  componentWillUnmount() {
+    const {widgetModel} = this.props;
+    if (widgetModel) {
+      widgetModel.off(null, null, this);
+    }
+  }
+
+  _updateKernelResult = name => {
+    const result = this.props.widgetModel.get(name);
+    if (result && Object.keys(result).length) {
+      this.props.dispatch(KERNEL_RESULTS[name](result));
+    }
+  };
+
+  _updateKernelSegmentGroups = () => {
+    const segments = this.props.widgetModel.get('segments');
+    if (segments && segments !== JSON.stringify(this.props.segmentGroups)) {
+      const segmentGroups = JSON.parse(segments);
+      if (segmentGroups.length === 2) {
+        this.props.dispatch(updateSegmentGroups(segmentGroups));
+      }
+    }
+  };
+
+  // the kernel answers every request, even when the feature distributions are unchanged and so aren't synced
+  _onCustomMessage = msg => {
+    if (msg.method === FEATURES_DISTRIBUTION_METHOD) {
+      const result = this.props.widgetModel.get('features_distribution');
+      this.props.dispatch(fetchFeaturesSuccess(result));
+    }
+  };
+
   render() {
-    const {data, width, height, mapboxAccessToken} = this.props;
-    const [valid] = validateInputData(data, true);
-    if (!data || !valid) {
-      return <div />;
+    const {data, mode, width, height, mapboxAccessToken} = this.props;
+    if (mode !== KERNEL_MODE) {
+      const [valid] = validateInputData(data, true);
+      if (!data || !valid) {
+        return <div />;
+      }
     }
     return (
       <Manifold
@@ -38,4 +120,4 @@ class ManifoldApp extends PureComponent {
   }
 }
 
-export default connect()(ManifoldApp);
+export default connect(mapStateToProps)(ManifoldApp);
@@ -0,0 +1,104 @@
+// Decoding of the columnar tables sent by mlvis/columnar.py, one binary buffer per column
+const TYPED_ARRAYS = {
+  int8: Int8Array,
+  uint8: Uint8Array,
+  int16: Int16Array,
+  uint16: Uint16Array,
+  int32: Int32Array,
+  uint32: Uint32Array,
+  float32: Float32Array,
+  float64: Float64Array,
+  // booleans and category codes are decoded from their storage type
+  bool: Uint8Array,
+  category: Int32Array,
+};
+
+/**
+ * View the buffer of a column as a typed array, without copying it when it is aligned
+ * @param {DataView} view - binary buffer of the column
+ * @param {String} dtype - dtype of the column
+ * @return {TypedArray}
+ */
+export function toTypedArray(view, dtype) {
+  const TypedArray = TYPED_ARRAYS[dtype];
+  if (!TypedArray) {
+    throw new Error(`Unsupported column dtype ${dtype}`);
+  }
+  let {buffer, byteOffset, byteLength} = view;
+  if (byteOffset % TypedArray.BYTES_PER_ELEMENT !== 0) {
+    buffer = buffer.slice(byteOffset, byteOffset + byteLength);
+    byteOffset = 0;
+  }
+  return new TypedArray(
+    buffer,
+    byteOffset,
+    byteLength / TypedArray.BYTES_PER_ELEMENT
+  );
+}
+
+/**
+ * @param {Object} column - {name, dtype, data: DataView, categories}
+ * @return {Function} value of the column at an index
+ */
+function columnGetter(column) {
+  const values = toTypedArray(column.data, column.dtype);
+  if (column.dtype === 'category') {
+    const {categories} = column;
+    return i => (values[i] < 0 ? null : categories[values[i]]);
+  }
+  if (column.dtype === 'bool') {
+    return i => values[i] === 1;
+  }
+  return i => values[i];
+}
+
+/**
+ * Build the array of row objects of a table, e.g. the `x` of manifold data
+ * @param {Object} table - {length, columns: [{name, dtype, data: DataView, categories}]}
+ * @return {Array<Object>}
+ */
+export function tableToRows(table) {
+  const getters = table.columns.map(columnGetter);
+  const names = table.columns.map(column => column.name);
+  const rows = new Array(table.length);
+  for (let i = 0; i < table.length; i++) {
+    const row = {};
+    for (let j = 0; j < names.length; j++) {
+      row[names[j]] = getters[j](i);
+    }
+    rows[i] = row;
+  }
+  return rows;
+}
+
+/**
+ * Build the array of the values of the first column of a table, e.g. the `yTrue` of manifold data
+ * @param {Object} table - {length, columns: [{name, dtype, data: DataView, categories}]}
+ * @return {Array}
+ */
+export function tableToArray(table) {
+  const getter = columnGetter(table.columns[0]);
+  const values = new Array(table.length);
+  for (let i = 0; i < table.length; i++) {
+    values[i] = getter(i);
+  }
+  return values;
+}
+
+/**
+ * Widget model serializer of the `data` trait of the Manifold widget
+ * @param {Object} data - {x: table, yPred: Array<table>, yTrue: table}
+ * @return {Object} - {x: Array<Object>, yPred: Array<Array<Object>>, yTrue: Array}
+ */
+export const manifoldDataSerializer = {
+  deserialize: data => {
+    if (!data || !data.x) {
+      return null;
+    }
+    return {
+      x: tableToRows(data.x),
+      yPred: data.yPred.map(tableToRows),
+      yTrue: tableToArray(data.yTrue),
+    };
+  },
+};
@@ -1,5 +1,6 @@
 const Jupyter = require('base/js/namespace');
 const widgetBuilder = require('./react-widget-builder').default;
+const {manifoldDataSerializer} = require('./columnar');
 const req = require('../../../mlvis/jrequirements.json');
 
 // Specify the widget customization of the corresponding components,
@@ -12,7 +13,9 @@ const reqExt = {
       'change:segments',
       () => {
         const segments = this.model.get('segments');
-        if (segments) {
+        const {mode} = JSON.parse(this.model.get('props') || '{}');
+        // in the kernel mode segments are the segment groups selected in the widget, handled by the kernel
+        if (segments && mode !== 'kernel') {
           const msgId = Jupyter.notebook.kernel.last_msg_id;
           const cell = Jupyter.notebook.get_msg_cell(msgId);
           const cellIndex = Jupyter.notebook.find_cell_index(cell);
@@ -27,11 +30,21 @@ const reqExt = {
   },
 };
 
+// Deserializers of the traits of the corresponding components sent as binary buffers
+const reqSerializers = {
+  Manifold: {data: manifoldDataSerializer},
+};
+
 // TODO: Implement dynamic import of components
 for (const name of Object.keys(req)) {
   const Component = require('../components')[name];
   const callback = reqExt[name] || function() {};
-  const widgets = widgetBuilder(Component, name, callback);
+  const widgets = widgetBuilder(
+    Component,
+    name,
+    callback,
+    reqSerializers[name]
+  );
 
   module.exports[name + 'WidgetView'] = widgets[name + 'WidgetView'];
   module.exports[name + 'WidgetModel'] = widgets[name + 'WidgetModel'];
@@ -2,19 +2,68 @@ import React from 'react';
 import ReactDom from 'react-dom';
 import {DOMWidgetModel, DOMWidgetView} from '@jupyter-widgets/base';
 
-export default (Component, name, renderCallback = function() {}) => {
+// custom message of the json patch of props, see mlvis/widget.py
+const PATCH_PROPS_METHOD = 'patch_props';
+
+const unescapePointer = token => token.replace(/~1/g, '/').replace(/~0/g, '~');
+
+/**
+ * Apply a json patch (RFC 6902) of top level props
+ * @param {Object} props
+ * @param {Array<Object>} patch - [{op, path, value}]
+ * @return {Object} - the patched props, a new object
+ */
+export function applyPropsPatch(props, patch) {
+  const patched = {...props};
+  // the kernel only adds and replaces props
+  patch.forEach(({path, value}) => {
+    patched[unescapePointer(path.slice(1))] = value;
+  });
+  return patched;
+}
+
+export default (
+  Component,
+  name,
+  renderCallback = function() {},
+  serializers = {}
+) => {
   const classes = {
-    [name + 'WidgetModel']: class extends DOMWidgetModel {},
+    [name + 'WidgetModel']: class extends DOMWidgetModel {
+      static serializers = {...DOMWidgetModel.serializers, ...serializers};
+
+      initialize(attributes, options) {
+        super.initialize(attributes, options);
+        this.on('msg:custom', this._onCustomMessage, this);
+      }
+
+      // props changed in the kernel are sent as a patch, applied to the props of every view of the model
+      _onCustomMessage(msg) {
+        if (msg.method === PATCH_PROPS_METHOD) {
+          const props = JSON.parse(this.get('props') || '{}');
+          // set as state of the kernel, which already has these props, so that it isn't sent back
+          this.set_state({
+            props: JSON.stringify(applyPropsPatch(props, msg.patch)),
+          });
+        }
+      }
+    },
     [name + 'WidgetView']: class extends DOMWidgetView {
       render = () => {
         super.render(this);
         this._update();
         this.listenTo(this.model, 'change:props', this._update, this);
+        this.listenTo(this.model, 'change:data', this._update, this);
         renderCallback.apply(this);
       };
 
       _update = () => {
         const props = JSON.parse(this.model.get('props') || '{}');
+        // data synced through its own, binary, trait
+        const data = this.model.get('data');
+        if (data) {
+          props.data = data;
+        }
         props.widgetModel = this.model;
         props.widgetView = this;
         const component = React.createElement(Component, props);
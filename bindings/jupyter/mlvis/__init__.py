@@ -1,4 +1,4 @@
-from .widget_builder import *
+import sys, importlib, importlib.util
 
 
 def _jupyter_nbextension_paths():
@@ -8,3 +8,19 @@ def _jupyter_nbextension_paths():
         'dest': 'mlvis',
         'require': 'mlvis/extension'
     }]
+
+
+# Components, and everything else of widget_builder, are looked up there on first access (PEP 562),
+# so that importing mlvis doesn't import ipywidgets, pandas, or create the component classes.
+# Submodules, e.g. mlvis.widget_ext, are imported on first access as well
+def __getattr__(name):
+    if name.startswith('__') and name != '__all__':
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    if importlib.util.find_spec('.' + name, __name__) is not None:
+        return importlib.import_module('.' + name, __name__)
+    return getattr(importlib.import_module('.widget_builder', __name__), name)
+
+
+# no module __getattr__ before python 3.7
+if sys.version_info < (3, 7):
+    from .widget_builder import *
@@ -0,0 +1,73 @@
+# Columnar binary transport of data frames to the front end, one ipywidgets binary buffer per column
+import numpy as np
+import pandas as pd
+
+
+# numpy dtypes sent as they are, the JS side maps them to typed arrays (e.g. float64 -> Float64Array)
+TYPED_ARRAY_DTYPES = ['int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'float32', 'float64']
+
+
+def to_frame(data):
+    """
+    :param data: A DataFrame, an ndarray or a list of dicts/lists/values
+    :return: A DataFrame with string column names
+    """
+    if isinstance(data, np.ndarray) and data.ndim == 1:
+        # e.g. an object array of row dicts
+        data = list(data)
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    if any(not isinstance(c, str) for c in df.columns):
+        df = df.rename(columns=str)
+    return df
+
+
+def to_buffer(values, dtype):
+    # buffers are little endian, the byte order of typed arrays on all platforms browsers run on
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return memoryview(values).cast('B')
+
+
+def encode_column(col):
+    """
+    Encode a column into a binary buffer and the schema the front end decodes it with
+    :param col: A Series
+    :return: A dict of the column name, its dtype, its data buffer and, for categorical columns, its categories
+    """
+    name = str(col.name)
+    dtype = col.dtype
+    # extension dtypes, e.g. pandas categoricals, are encoded as categories
+    if not isinstance(dtype, np.dtype):
+        dtype = np.dtype(object)
+    if dtype == np.bool_:
+        return {'name': name, 'dtype': 'bool', 'data': to_buffer(col.values, 'uint8')}
+    if dtype.name in TYPED_ARRAY_DTYPES:
+        return {'name': name, 'dtype': dtype.name, 'data': to_buffer(col.values, dtype)}
+    if np.issubdtype(dtype, np.integer):
+        # 64 bit integers have no typed array but BigInt ones, which the front end doesn't compute on
+        fits = len(col) == 0 or (col.min() >= np.iinfo(np.int32).min and col.max() <= np.iinfo(np.int32).max)
+        target = 'int32' if fits else 'float64'
+        return {'name': name, 'dtype': target, 'data': to_buffer(col.values, target)}
+    if np.issubdtype(dtype, np.floating):
+        return {'name': name, 'dtype': 'float64', 'data': to_buffer(col.values, 'float64')}
+
+    # strings and other objects are sent as int32 codes into a list of categories, missing values are coded -1
+    codes, categories = pd.factorize(col, sort=False)
+    return {
+        'name': name,
+        'dtype': 'category',
+        'categories': [c if isinstance(c, (str, bool, int, float)) else str(c) for c in categories.tolist()],
+        'data': to_buffer(codes, 'int32')
+    }
+
+
+def encode_table(data):
+    """
+    :param data: A DataFrame, an ndarray or a list of dicts/lists/values
+    :return: A dict of the number of rows and the encoded columns, buffers are memoryviews ipywidgets
+        sends as binary buffers rather than in the json state
+    """
+    df = to_frame(data)
+    return {
+        'length': len(df),
+        'columns': [encode_column(df.iloc[:, i]) for i in range(df.shape[1])]
+    }
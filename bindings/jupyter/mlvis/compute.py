@@ -0,0 +1,248 @@
+# Kernel side computation of the Manifold widget, with the python-compute package
+import json
+import logging
+import threading
+import importlib
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+import numpy as np
+import pandas as pd
+from tornado.ioloop import IOLoop
+from mlvis.columnar import to_frame
+
+
+# python-compute is an optional dependency, imported by the name of its directory, e.g. with bindings/ on sys.path
+COMPUTE_PACKAGE = 'python-compute'
+# seconds without a new request of segment groups before their features are compared, so that the requests
+# fired while e.g. dragging segments from one group to the other are coalesced into the last one
+DEBOUNCE_SECONDS = 0.3
+# number of segment group pairs whose feature distributions are kept, for the current segmentation
+MAX_CACHED_GROUPS = 64
+
+logger = logging.getLogger(__name__)
+
+
+def import_compute(module):
+    """
+    :param module: name of a module of python-compute, e.g. 'main'
+    :return: the module
+    """
+    try:
+        return importlib.import_module('{}.{}'.format(COMPUTE_PACKAGE, module))
+    except ImportError as e:
+        raise ImportError('Kernel mode requires the {} package on the python path: {}'.format(COMPUTE_PACKAGE, e))
+
+
+def to_datasets(x, y_pred, y_true):
+    """
+    Convert manifold data into the feature and prediction datasets python-compute reads
+    :param x: An ndarray/list/dataframe for the feature list
+    :param y_pred: A list of dataframes/lists, the predictions of every model, one column per class
+        or a single column for regression
+    :param y_true: An ndarray/list/dataframe for the ground truth, class labels for classification
+    :return: A (feature dataframe, list of prediction dataframes, list of the columns added to the features) tuple
+    """
+    dm = import_compute('data_manager')
+
+    feature_df = to_frame(x)
+    added_cols = []
+    if dm.UUID_COL not in feature_df.columns:
+        # python-compute identifies rows by a uuid column
+        feature_df = feature_df.copy()
+        feature_df.insert(0, dm.UUID_COL, np.arange(len(feature_df)))
+        added_cols.append(dm.UUID_COL)
+
+    if isinstance(y_true, pd.DataFrame):
+        y_true = y_true.iloc[:, 0]
+    y_true = pd.Series(y_true).values
+
+    pred_dfs = []
+    for i, y in enumerate(y_pred):
+        df = to_frame(y)
+        if df.shape[1] == 1:
+            pred_df = pd.DataFrame({dm.PRED_COL_IN: df.iloc[:, 0].values.astype(np.float64)})
+            target = y_true
+        else:
+            pred_df = pd.DataFrame(df.values.astype(np.float64), columns=[dm.PRED_PREFIX + c for c in df.columns])
+            # python-compute targets are class indices, manifold ones are class labels
+            target = pd.Index(df.columns).get_indexer(pd.Series(y_true).astype(str))
+            if (target < 0).any():
+                raise ValueError('yTrue has class labels which are not columns of yPred[{}].'.format(i))
+        # models share the target of the first one
+        if i == 0:
+            pred_df[dm.TARGET_COL_IN] = target
+        pred_dfs.append(pred_df)
+    return feature_df, pred_dfs, added_cols
+
+
+def segment_groups_key(segment_group_0, segment_group_1, top_k=None):
+    # groups are sets of segments, in whatever order they are listed
+    return json.dumps([sorted(segment_group_0), sorted(segment_group_1), top_k])
+
+
+class KernelSession(object):
+    """
+    python-compute session of a widget in the kernel mode. Jobs run on a worker thread, one after another,
+    see python-compute AsyncServiceSession. Feature distributions of segment groups are memoized per
+    segmentation, and those requested by the front end are debounced: only the last of rapid requests is
+    computed, and a computation is cancelled once a newer request supersedes it. Their results are handed back
+    on the IO loop of the thread which created the session, i.e. the kernel's, as widgets sync traits from it.
+    """
+
+    def __init__(self, x, y_pred, y_true, debounce_seconds=DEBOUNCE_SECONDS, max_cached_groups=MAX_CACHED_GROUPS):
+        service_session = import_compute('main').ServiceSession()
+        self.session = import_compute('jobs').AsyncServiceSession(service_session)
+        self.data_ids_encoding = import_compute('constants').DATA_IDS_ENCODING['NONE']
+        self.debounce_seconds = debounce_seconds
+        self.max_cached_groups = max_cached_groups
+        self.io_loop = IOLoop.current()
+        self.lock = threading.Lock()
+        self.timer = None
+        # key of the segment groups last requested, results of other ones are stale
+        self.requested_key = None
+        # number of segmentations so far, results computed on previous ones are stale
+        self.segmentation = 0
+        # future of the last computation of requested segment groups
+        self.future = None
+        # <segment groups key -> feature distributions> of the current segmentation, least recently used first
+        self.cache = OrderedDict()
+
+        feature_df, pred_dfs, added_cols = to_datasets(x, y_pred, y_true)
+        # columns which aren't features of the data, left out of the results
+        self.hidden_features = set(added_cols)
+        self.session.load_frames(feature_df, pred_dfs).result()
+
+
+    def get_meta_data(self):
+        meta_data = self.session.get_meta_data().result()
+        meta_data['featuresMeta'] = [f for f in meta_data['featuresMeta'] if f['name'] not in self.hidden_features]
+        return meta_data
+
+
+    # top_k of python-compute, so that top_k features are left once hidden ones are
+    def compute_top_k(self, top_k):
+        return None if top_k is None else top_k + len(self.hidden_features)
+
+
+    def visible_features(self, features_distribution, top_k):
+        if features_distribution is None:
+            return None
+        return [f for f in features_distribution if f['name'] not in self.hidden_features][:top_k]
+
+
+    def get_models_performance(self, n_clusters, metric, base_models, segment_filters):
+        with self.lock:
+            self.cancel_requested()
+            self.requested_key = None
+            self.segmentation += 1
+            # distributions are those of the segments of the previous segmentation
+            self.cache.clear()
+        # segment membership stays in the kernel
+        return self.session.get_models_performance_by_segment(
+            n_clusters, metric, base_models, segment_filters, data_ids_encoding=self.data_ids_encoding).result()
+
+
+    def get_features_distribution(self, segment_group_0, segment_group_1, top_k=None):
+        key = segment_groups_key(segment_group_0, segment_group_1, top_k)
+        with self.lock:
+            self.cancel_requested()
+            self.requested_key = key
+            segmentation = self.segmentation
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        future = self.session.get_features_distribution_by_segment_group(
+            segment_group_0, segment_group_1, top_k=self.compute_top_k(top_k))
+        result = self.visible_features(future.result(), top_k)
+        self.add_to_cache(key, segmentation, result)
+        return result
+
+
+    def request_features_distribution(self, segment_group_0, segment_group_1, callback, top_k=None):
+        """
+        Debounced get_features_distribution, e.g. on changes of the segment groups in the front end
+        :param callback: function called on the IO loop of the session with the feature distributions, or with
+            None if their computation failed; it isn't called for requests superseded by newer ones
+        """
+        key = segment_groups_key(segment_group_0, segment_group_1, top_k)
+        with self.lock:
+            if key == self.requested_key and self.future is not None and not self.future.done():
+                # being computed already
+                return
+            self.cancel_requested()
+            self.requested_key = key
+            segmentation = self.segmentation
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+            else:
+                self.timer = threading.Timer(self.debounce_seconds, self.submit_features_distribution,
+                                             args=(key, segmentation, segment_group_0, segment_group_1,
+                                                   callback, top_k))
+                self.timer.daemon = True
+                self.timer.start()
+        if result is not None:
+            self.io_loop.add_callback(self.deliver, key, segmentation, callback, result)
+
+
+    def submit_features_distribution(self, key, segmentation, segment_group_0, segment_group_1, callback, top_k):
+        with self.lock:
+            if key != self.requested_key or segmentation != self.segmentation:
+                return
+            self.timer = None
+            self.future = self.session.get_features_distribution_by_segment_group(
+                segment_group_0, segment_group_1, top_k=self.compute_top_k(top_k))
+            future = self.future
+        future.add_done_callback(lambda f: self.on_features_distribution(key, segmentation, f, callback, top_k))
+
+
+    def on_features_distribution(self, key, segmentation, future, callback, top_k):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if isinstance(error, CancelledError):
+            return
+        if error is not None:
+            logger.error('Comparison of the features of segment groups %s failed', key, exc_info=error)
+            result = None
+        else:
+            result = self.visible_features(future.result(), top_k)
+            self.add_to_cache(key, segmentation, result)
+        # from the thread of the job queue
+        self.io_loop.add_callback(self.deliver, key, segmentation, callback, result)
+
+
+    # runs on the IO loop; results of requests superseded in the meantime are dropped
+    def deliver(self, key, segmentation, callback, result):
+        with self.lock:
+            is_stale = key != self.requested_key or segmentation != self.segmentation
+        if not is_stale:
+            callback(result)
+
+
+    def add_to_cache(self, key, segmentation, result):
+        with self.lock:
+            # segments aren't computed yet, or were recomputed since
+            if result is None or segmentation != self.segmentation:
+                return
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached_groups:
+                self.cache.popitem(last=False)
+
+
+    # cancels the pending request of segment groups, or stops its computation if it is running
+    def cancel_requested(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.future is not None and not self.future.done() and not self.future.cancel():
+            self.session.cancel_features()
+        self.future = None
+
+
+    def close(self):
+        with self.lock:
+            self.cancel_requested()
+            self.requested_key = None
+        self.session.shutdown(wait=False)
@@ -0,0 +1,74 @@
+"""
+Import time of mlvis, each statement timed in fresh interpreters as imports are cached within one.
+Usage:
+    python -m mlvis.import_benchmark [--runs 10] [--path path/of/another/mlvis/parent]
+e.g. compare with a previous version:
+    git archive <rev> bindings/jupyter | tar -x -C /tmp/mlvis-rev
+    python -m mlvis.import_benchmark --path /tmp/mlvis-rev/bindings/jupyter
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+STATEMENTS = [
+    'import mlvis',
+    'from mlvis import StackedCalendar',
+    'from mlvis import Manifold'
+]
+DEFAULT_RUNS = 10
+
+TIMER = '''
+import time
+start = time.perf_counter()
+{}
+print(time.perf_counter() - start)
+'''
+
+
+def time_statement(statement, path, python=sys.executable):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([path] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    # run from path, as the working directory comes first on the path of `python -c`
+    output = subprocess.check_output([python, '-c', TIMER.format(statement)], env=env, cwd=path)
+    return float(output.decode('utf8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.
+
+
+def run_benchmark(path, runs=DEFAULT_RUNS, statements=STATEMENTS):
+    """
+    :param path: directory mlvis is imported from
+    :return: A list of dicts of the statement and its median and min seconds over the runs
+    """
+    results = []
+    for statement in statements:
+        seconds = [time_statement(statement, path) for _ in range(runs)]
+        results.append({'statement': statement, 'median': median(seconds), 'min': min(seconds)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time of mlvis')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--path', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='directory mlvis is imported from, this checkout by default')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.path, runs=args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print('{:<36} median {:.3f}s  min {:.3f}s'.format(r['statement'], r['median'], r['min']))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,37 @@ from __future__ import unicode_literals
 
 import json
 import ipywidgets as widgets
-from traitlets import Unicode
+from traitlets import Unicode, Any
 
 MODULE_NAME = 'mlviswidget'
 VERSION = '0.0.1'
+# props synced through their own trait rather than the json props, so that updating the other props,
+# e.g. a color, doesn't send them again
+DATA_PROPS = ['data']
+# custom message of the json patch of props
+PATCH_PROPS_METHOD = 'patch_props'
+
+
+def escape_pointer(key):
+    # json pointer token of a key, RFC 6901
+    return key.replace('~', '~0').replace('/', '~1')
+
+
+def props_patch(props, changes):
+    """
+    Compute the json patch (RFC 6902) of props updated with changes, covering the changed keys only
+    :param props: A dict of the current props
+    :param changes: A dict of the props to update
+    :return: A list of patch operations, empty if nothing changes
+    """
+    patch = []
+    for key, value in changes.items():
+        if key not in props:
+            patch.append({'op': 'add', 'path': '/' + escape_pointer(key), 'value': value})
+        elif props[key] != value:
+            patch.append({'op': 'replace', 'path': '/' + escape_pointer(key), 'value': value})
+    return patch
+
 
 class Widget(widgets.DOMWidget):
     _model_module = Unicode(MODULE_NAME).tag(sync=True)
@@ -15,10 +42,51 @@ class Widget(widgets.DOMWidget):
     _view_name = Unicode('WidgetView').tag(sync=True)
     _view_module_version = Unicode(VERSION).tag(sync=True)
     props = Unicode('{}').tag(sync=True)
+    data = Any(None).tag(sync=True)
 
 
 class CommonComponent(Widget):
     def __init__(self, props={}, **kwargs):
         super(CommonComponent, self).__init__()
+        self.current_props = {k: v for k, v in props.items() if k not in DATA_PROPS}
         # TODO: make explicit exception message for the json input is invalid
-        self.props = json.dumps(props)
+        self.props = json.dumps(self.current_props)
+        if 'data' in props:
+            self.set_data(props['data'])
+
+
+    def set_data(self, data):
+        """
+        Set the data prop, synced on its own
+        """
+        self.data = data
+
+
+    def set_prop(self, key, value):
+        """
+        Set one prop, e.g. widget.set_prop('width', 800)
+        """
+        self.update_props({key: value})
+
+
+    def update_props(self, props):
+        """
+        Update some props. Only the changed ones are sent to the front end, as a json patch of the props
+        :param props: A dict of the props to update
+        """
+        changes = {}
+        for key, value in props.items():
+            if key in DATA_PROPS:
+                self.set_data(value)
+            else:
+                changes[key] = value
+        patch = props_patch(self.current_props, changes)
+        if not patch:
+            return
+
+        self.current_props = dict(self.current_props, **changes)
+        props_json = json.dumps(self.current_props)
+        # the trait is kept up to date for new views without being sent, the front end applies the patch
+        with self._lock_property(props=props_json):
+            self.props = props_json
+        self.send({'method': PATCH_PROPS_METHOD, 'patch': patch})
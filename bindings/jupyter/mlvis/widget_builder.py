@@ -1,20 +1,37 @@
 # Dynamically build component wrappers utilizing the ipywidget
-import os, sys, json, re, importlib
-from pkg_resources import resource_string
-from ast import literal_eval
+import sys, json, importlib, threading
 from traitlets import Unicode
 from .widget import CommonComponent
-from .widget_ext import Manifold
 
+try:
+    from importlib.resources import read_text
+except ImportError:
+    read_text = None
 
-extensions = {'Manifold': Manifold}
+
+# components whose wrappers extend a class of widget_ext, imported when the component is first used
+extensions = ['Manifold']
 
 
 current_module = sys.modules[__name__]
+# held while a class is created, so that every component has a single class
+create_lock = threading.Lock()
+
+
+# <name -> parsed jrequirements.json> of the package, parsed once
+jrequirements_cache = {}
 
 
 def load_jrequirements():
-    return literal_eval(resource_string('mlvis', 'jrequirements.json').decode('utf8'))
+    if 'mlvis' not in jrequirements_cache:
+        if read_text is not None:
+            text = read_text('mlvis', 'jrequirements.json')
+        else:
+            # no importlib.resources before python 3.7
+            from pkg_resources import resource_string
+            text = resource_string('mlvis', 'jrequirements.json').decode('utf8')
+        jrequirements_cache['mlvis'] = json.loads(text)
+    return jrequirements_cache['mlvis']
 
 
 # Extract the Python component wrapper names from the jrequirements
@@ -31,15 +48,44 @@ def init(self, props={}):
         parent.__init__(self, props=props)
 
 
-# Dynamically create module classes
-for component in components:
-    deps = (extensions[component], ) if component in extensions else (CommonComponent, )
-    setattr(current_module,
-            component,
-            type(component,
-                 deps,
-                 {
-                     '_model_name': Unicode(component + 'WidgetModel').tag(sync=True),
-                     '_view_name': Unicode(component + 'WidgetView').tag(sync=True),
-                     '__init__': init
-                 }))
+def create_component(component):
+    """
+    Create the wrapper class of a component, once; it is then an attribute of this module
+    :param component: A component name of the jrequirements
+    :return: The wrapper class
+    """
+    with create_lock:
+        if component in current_module.__dict__:
+            return current_module.__dict__[component]
+        if component in extensions:
+            deps = (getattr(importlib.import_module('.widget_ext', __package__), component), )
+        else:
+            deps = (CommonComponent, )
+        cls = type(component,
+                   deps,
+                   {
+                       '_model_name': Unicode(component + 'WidgetModel').tag(sync=True),
+                       '_view_name': Unicode(component + 'WidgetView').tag(sync=True),
+                       '__init__': init
+                   })
+        setattr(current_module, component, cls)
+        return cls
+
+
+# Module classes are created on first access (PEP 562), e.g. widget_builder.Manifold
+def __getattr__(name):
+    if name == '__all__':
+        return components
+    if name in components:
+        return create_component(name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(current_module.__dict__) | set(components))
+
+
+# no module __getattr__ before python 3.7, classes are created on import
+if sys.version_info < (3, 7):
+    for component in components:
+        create_component(component)
@@ -1,19 +1,76 @@
 from mlvis.widget import CommonComponent
-from traitlets import Unicode, observe
+from mlvis.columnar import encode_table
+from mlvis.compute import KernelSession
+from traitlets import Unicode, Dict, List, observe
+import json
 import warnings
 import pandas as pd
 import numpy as np
 
+
+# where segments, performance histograms and feature distributions are computed, the `mode` prop
+MODE = {
+    # rows are sent to the front end, which computes everything
+    'BROWSER': 'browser',
+    # rows stay in the kernel, which computes with python-compute; only the results are sent
+    'KERNEL': 'kernel'
+}
+# initial segmentation of the kernel mode, the defaults of the front end
+DEFAULT_N_CLUSTERS = 4
+DEFAULT_METRIC = 'performance'
+# custom message of the kernel mode once a request of segment groups is answered, so that the front end stops
+# waiting for it even if their feature distributions are unchanged, and so not synced
+FEATURES_DISTRIBUTION_METHOD = 'features_distribution'
+
+
+def default_segment_groups(n_segments):
+    # same as the default segment groups of the front end, e.g. [[2, 3], [0, 1]] for 4 segments
+    n_treatment = 1 if n_segments < 4 else 2
+    segments = list(range(n_segments))
+    return [segments[n_segments - n_treatment:], segments[:n_segments - n_treatment]]
+
+
+def is_valid_segment_groups(segment_groups, n_segments):
+    if not isinstance(segment_groups, list) or len(segment_groups) != 2:
+        return False
+    group_0, group_1 = segment_groups
+    return len(group_0) > 0 and len(group_1) > 0 and not set(group_0) & set(group_1) and \
+        all(isinstance(s, int) and 0 <= s < n_segments for s in group_0 + group_1)
+
+
 class Manifold(CommonComponent):
+    # data ids of the segment groups exported by the front end; in the kernel mode, segment ids of the
+    # segment groups selected in the front end, whose features are compared as they change
     segments = Unicode('[]').tag(sync=True)
+    # x, yPred and yTrue as columnar tables, their columns are sent as binary buffers rather than json
+    data = Dict().tag(sync=True)
+    # results of the kernel mode, in the format of the python-compute service responses
+    meta_data = Dict().tag(sync=True)
+    # parameters of the segmentation of the kernel mode and its number of segments, offered by the front end
+    segmentation = Dict().tag(sync=True)
+    models_performance = List().tag(sync=True)
+    features_distribution = List().tag(sync=True)
 
 
     def __init__(self, props={}):
         if 'data' not in props:
             raise Exception('data must be specified')
 
-        data = props['data']
+        self.mode = props.get('mode', MODE['BROWSER'])
+        if self.mode not in MODE.values():
+            raise Exception('mode must be one of ' + ', '.join(MODE.values()) + '.')
+        self.session = None
+        # number of features of the comparisons of segment groups in the kernel mode, all of them if None
+        self.top_k = None
+        # data is synced through its own trait, the json props only hold the configuration, see set_data
+        super(Manifold, self).__init__(props)
 
+
+    def set_data(self, data):
+        """
+        Set the data, e.g. manifold.set_prop('data', data); other props are kept
+        :param data: A dict of x, yPred and yTrue
+        """
         valid, exception = self.validate_data(data, give_exception=True)
         if not valid:
             if isinstance(exception, Warning):
@@ -21,19 +78,103 @@ class Manifold(CommonComponent):
             else:
                 raise exception
 
-        # make a shallow copy of the props,
-        # props are shared with the manifold instance, clone to prevent unexpected changes
-        processed_props = props.copy()
-        processed_props['data']['x'] = self.process_x(data['x'])
-        processed_props['data']['yPred'] = self.process_y_pred(data['yPred'])
-        processed_props['data']['yTrue'] = self.process_y_true(data['yTrue'])
-        super(Manifold, self).__init__(processed_props)
+        if self.mode == MODE['KERNEL']:
+            if self.session is not None:
+                self.session.close()
+            self.init_kernel_mode(data)
+            return
+
+        self.data = {
+            'x': self.process_x(data['x']),
+            'yPred': self.process_y_pred(data['yPred']),
+            'yTrue': self.process_y_true(data['yTrue'])
+        }
+
+
+    def init_kernel_mode(self, data):
+        self.session = KernelSession(data['x'], data['yPred'], data['yTrue'])
+        self.meta_data = self.session.get_meta_data()
+        self.update_segmentation()
+
+
+    def update_segmentation(self, n_clusters=DEFAULT_N_CLUSTERS, metric=DEFAULT_METRIC, base_models=None,
+                            segment_filters=None):
+        """
+        Segment the data in the kernel, and sync the performance of the models on every segment. The features of
+        the segment groups are compared again, on the new segments; groups the new segments don't have are reset
+        to the default ones.
+        :param n_clusters: number of segments of the automatic segmentation
+        :param metric: 'performance' to segment on the losses of the models, 'absolute' on their predictions
+        :param base_models: ids of the models the segmentation is based on, all of them if None
+        :param segment_filters: filters of the manual segmentation, one list of filters per segment
+        """
+        self.check_kernel_mode()
+        base_models = base_models or []
+        segment_filters = segment_filters or []
+        self.models_performance = self.session.get_models_performance(
+            n_clusters, metric, base_models, segment_filters)
+        n_segments = len(self.models_performance)
+        self.segmentation = {
+            'nClusters': n_clusters,
+            'metric': metric,
+            'baseModels': base_models,
+            'segmentFilters': segment_filters,
+            'nSegments': n_segments
+        }
+
+        segment_groups = json.loads(self.segments)
+        if not is_valid_segment_groups(segment_groups, n_segments):
+            segment_groups = default_segment_groups(n_segments)
+        self.update_segment_groups(segment_groups[0], segment_groups[1], top_k=self.top_k)
+
+
+    def update_segment_groups(self, segment_group_0, segment_group_1, top_k=None):
+        """
+        Compare the features of two groups of segments in the kernel, and sync their distributions
+        :param segment_group_0: A list of segment ids
+        :param segment_group_1: A list of segment ids
+        :param top_k: only sync the k most differentiating features, all of them if None; segment groups selected
+            in the front end afterwards are compared on as many features
+        """
+        self.check_kernel_mode()
+        self.top_k = top_k
+        self.features_distribution = self.session.get_features_distribution(
+            segment_group_0, segment_group_1, top_k=top_k)
+        # selected in the front end too; its request has the same top_k, and is answered from the cache
+        segment_groups = [[int(s) for s in segment_group_0], [int(s) for s in segment_group_1]]
+        self.segments = json.dumps(segment_groups, separators=(',', ':'))
+
+
+    def check_kernel_mode(self):
+        if self.session is None:
+            raise Exception('Only available in the ' + MODE['KERNEL'] + ' mode.')
 
 
     @observe('segments')
     def _observe_bar(self, change):
-        print(change['old'])
-        print(change['new'])
+        if self.session is None:
+            print(change['old'])
+            print(change['new'])
+            return
+        segment_groups = json.loads(change['new'])
+        if isinstance(segment_groups, list) and len(segment_groups) == 2:
+            self.session.request_features_distribution(segment_groups[0], segment_groups[1],
+                                                       self._set_features_distribution, top_k=self.top_k)
+
+
+    def _set_features_distribution(self, features_distribution):
+        # None if the comparison failed, the error is logged
+        if features_distribution is not None:
+            self.features_distribution = features_distribution
+        self.send({'method': FEATURES_DISTRIBUTION_METHOD})
+
+
+    def close(self):
+        # also called on garbage collection, after an explicit close
+        if getattr(self, 'session', None) is not None:
+            self.session.close()
+            self.session = None
+        super(Manifold, self).close()
 
 
     def validate_data(self, data, give_exception=False):
@@ -69,15 +210,10 @@ class Manifold(CommonComponent):
     def process_x(self, x):
         """
         Convert the x data frame into the format manifold recognizes
-        :param x: An ndarray/list for the feature list
-        :return: A list for the x attribute of the data that with the manifold data format
+        :param x: An ndarray/list/dataframe for the feature list
+        :return: A columnar table for the x attribute of the data, see columnar.encode_table
         """
-        if isinstance(x, pd.DataFrame):
-            return x.to_dict('records')
-        elif isinstance(x, np.ndarray):
-            return x.tolist()
-        else:
-            return x
+        return encode_table(x)
 
 
     def process_y_pred(self, y_pred):
@@ -85,23 +221,17 @@ class Manifold(CommonComponent):
         Convert y pred feature -- the predictions of each features for each model into the manifold recognized informat
         :param y_pred: A ndarray/list of data frames. Each data frame is the predict probability of one model,
             which each column being the predicted probability for one class
-        :return: A list for the y_pred attribute with the manifold data format
+        :return: A list of columnar tables for the y_pred attribute, one per model
         """
-        if isinstance(y_pred, np.ndarray):
-            return [y.to_dict('records') if isinstance(y, pd.DataFrame) else y for y in np.nditer(y_pred)]
-        else:
-            return [y.to_dict('records') if isinstance(y, pd.DataFrame) else y for y in y_pred]
+        return [encode_table(y) for y in y_pred]
 
 
     def process_y_true(self, y_true):
         """
         Convert y true feature into the format manifold recognizes
         :param y_true: An ndarray/list for the ground truth
-        :return: A list of the ground truths with the manifold data format
+        :return: A columnar table of one column for the ground truths
         """
         if isinstance(y_true, pd.DataFrame):
-            return y_true.iloc[:, 0].tolist()
-        elif isinstance(y_true, np.ndarray):
-            return y_true.tolist()
-        else:
-            return y_true
+            y_true = y_true.iloc[:, 0]
+        return encode_table(y_true if isinstance(y_true, pd.Series) else pd.Series(y_true))
@@ -0,0 +1,107 @@
+# Debouncing, superseding and caching of the feature distributions of KernelSession
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+# python-compute is imported from the bindings directory, as in the kernel mode
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mlvis.compute import KernelSession
+
+
+DEBOUNCE_SECONDS = 0.05
+N_ROWS = 200
+
+
+def create_session():
+    random_state = np.random.RandomState(0)
+    x = pd.DataFrame({'a': random_state.rand(N_ROWS), 'b': random_state.randint(0, 3, N_ROWS)})
+    y_pred = [pd.DataFrame({'no': p, 'yes': 1 - p}) for p in random_state.rand(2, N_ROWS)]
+    y_true = np.where(random_state.rand(N_ROWS) > 0.5, 'yes', 'no')
+    session = KernelSession(x, y_pred, y_true, debounce_seconds=DEBOUNCE_SECONDS)
+    session.get_models_performance(4, 'performance', [], [])
+
+    # segment groups of the computations
+    computed = []
+    service_session = session.session.service_session
+    compute = service_session.get_features_distribution_by_segment_group
+
+    def counted_compute(segment_group_0, segment_group_1, **kwargs):
+        computed.append([segment_group_0, segment_group_1])
+        return compute(segment_group_0, segment_group_1, **kwargs)
+
+    service_session.get_features_distribution_by_segment_group = counted_compute
+    return session, computed
+
+
+def run(test):
+    IOLoop().run_sync(test, timeout=30)
+
+
+def test_rapid_requests_are_debounced():
+    @gen.coroutine
+    def test():
+        session, computed = create_session()
+        results = []
+        for groups in [[[0], [1]], [[0], [1, 2]], [[0, 1], [2, 3]]]:
+            session.request_features_distribution(groups[0], groups[1], results.append)
+        yield gen.sleep(DEBOUNCE_SECONDS * 20)
+        session.close()
+        assert computed == [[[0, 1], [2, 3]]]
+        assert len(results) == 1 and len(results[0]) > 0
+
+    run(test)
+
+
+def test_superseded_computation_is_dropped():
+    @gen.coroutine
+    def test():
+        session, computed = create_session()
+        # holds the worker of the session, so that the first computation is still pending when superseded
+        release = threading.Event()
+        session.session.job_queue.submit('data_ids', release.wait, supersede=False)
+        results = []
+        session.request_features_distribution([0], [1], lambda r: results.append(('first', r)))
+        yield gen.sleep(DEBOUNCE_SECONDS * 4)
+        session.request_features_distribution([2], [3], lambda r: results.append(('second', r)))
+        yield gen.sleep(DEBOUNCE_SECONDS * 4)
+        release.set()
+        yield gen.sleep(DEBOUNCE_SECONDS * 20)
+        session.close()
+        assert computed == [[[2], [3]]]
+        assert [name for name, _ in results] == ['second']
+
+    run(test)
+
+
+def test_cached_groups_are_not_computed_again():
+    @gen.coroutine
+    def test():
+        session, computed = create_session()
+        threads = []
+        results = []
+
+        def callback(result):
+            threads.append(threading.current_thread())
+            results.append(result)
+
+        session.request_features_distribution([0, 1], [2], callback)
+        yield gen.sleep(DEBOUNCE_SECONDS * 20)
+        # the same groups, listed in another order
+        session.request_features_distribution([1, 0], [2], callback)
+        yield gen.sleep(DEBOUNCE_SECONDS * 4)
+        # a new segmentation clears the cache
+        session.get_models_performance(3, 'performance', [], [])
+        session.request_features_distribution([0, 1], [2], callback)
+        yield gen.sleep(DEBOUNCE_SECONDS * 20)
+        session.close()
+        assert len(computed) == 2
+        assert len(results) == 3 and results[0] == results[1]
+        # results are handed back on the IO loop, i.e. the thread of the kernel
+        assert threads == [threading.current_thread()] * 3
+
+    run(test)
@@ -0,0 +1,73 @@
+# Superseding and shutdown of AsyncServiceSession jobs over streamed datasets
+import importlib
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from concurrent.futures import CancelledError
+
+# python-compute is imported from the bindings directory, as in the kernel mode
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+jobs = importlib.import_module('python-compute.jobs')
+main = importlib.import_module('python-compute.main')
+
+
+N_ROWS = 500
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    random_state = np.random.RandomState(0)
+    target = random_state.randint(0, 2, N_ROWS)
+    pred_datasets = []
+    for m in range(2):
+        p = random_state.rand(N_ROWS)
+        pred_dataset = str(tmp_path / 'pred_{}.csv'.format(m))
+        pd.DataFrame({'@prediction:no': p, '@prediction:yes': 1 - p, '@prediction:target': target}) \
+            .to_csv(pred_dataset, index=False)
+        pred_datasets.append(pred_dataset)
+    feature_dataset = str(tmp_path / 'feature.csv')
+    pd.DataFrame({'uuid': np.arange(N_ROWS), 'a': random_state.rand(N_ROWS),
+                  'b': random_state.choice(['x', 'y', 'z'], N_ROWS)}).to_csv(feature_dataset, index=False)
+    return feature_dataset, pred_datasets
+
+
+def create_session(datasets):
+    session = jobs.AsyncServiceSession(main.ServiceSession(streaming=True))
+    session.load_data(*datasets)
+    session.get_models_performance_by_segment(4, 'performance', None, None).result()
+    return session
+
+
+def test_streaming_session_shutdown(datasets):
+    session = create_session(datasets)
+    assert len(session.get_features_distribution_by_segment_group([0], [1]).result()) > 0
+    session.shutdown()
+    assert session.service_session.data_manager is None
+
+
+def test_streaming_running_features_job_is_superseded(datasets):
+    session = create_session(datasets)
+    feature_differentiation = session.service_session.feature_differentiation
+    compute_split_kde = feature_differentiation.compute_split_kde
+    # holds the first computation on its first feature, until it is superseded
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked_compute_split_kde(feature_name):
+        if not started.is_set():
+            started.set()
+            release.wait(10)
+        return compute_split_kde(feature_name)
+
+    feature_differentiation.compute_split_kde = blocked_compute_split_kde
+    first = session.get_features_distribution_by_segment_group([0], [1])
+    assert started.wait(10)
+    second = session.get_features_distribution_by_segment_group([2], [3])
+    release.set()
+    with pytest.raises(CancelledError):
+        first.result()
+    assert len(second.result()) > 0
+    session.shutdown()
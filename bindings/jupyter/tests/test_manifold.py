@@ -0,0 +1,42 @@
+# Segment groups of the Manifold widget in the kernel mode
+import os
+import sys
+import numpy as np
+import pandas as pd
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+# python-compute is imported from the bindings directory, as in the kernel mode
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mlvis import Manifold
+from mlvis.compute import DEBOUNCE_SECONDS
+
+
+N_ROWS = 200
+
+
+def create_manifold():
+    random_state = np.random.RandomState(0)
+    x = pd.DataFrame({'a': random_state.rand(N_ROWS), 'b': random_state.rand(N_ROWS),
+                      'c': random_state.randint(0, 3, N_ROWS)})
+    y_pred = [pd.DataFrame({'no': p, 'yes': 1 - p}) for p in random_state.rand(2, N_ROWS)]
+    y_true = np.where(random_state.rand(N_ROWS) > 0.5, 'yes', 'no')
+    return Manifold(props={'mode': 'kernel', 'data': {'x': x, 'yPred': y_pred, 'yTrue': y_true}})
+
+
+def test_top_k_of_segment_groups_is_kept():
+    @gen.coroutine
+    def test():
+        manifold = create_manifold()
+        assert len(manifold.features_distribution) > 1
+        manifold.update_segment_groups([0], [1, 2], top_k=1)
+        # the request of the front end, as the segments change, has the same top_k
+        yield gen.sleep(DEBOUNCE_SECONDS * 3)
+        assert len(manifold.features_distribution) == 1
+        manifold.segments = '[[1],[2]]'
+        yield gen.sleep(DEBOUNCE_SECONDS * 3)
+        assert len(manifold.features_distribution) == 1
+        manifold.close()
+
+    IOLoop().run_sync(test, timeout=30)
@@ -1,3 +1,4 @@
 from .main import ServiceSession
+from .jobs import AsyncServiceSession
 
-service_session = ServiceSession()
\ No newline at end of file
+service_session = ServiceSession()
@@ -0,0 +1,290 @@
+"""
+Benchmarks of the stages of the python-compute pipeline, on synthetic datasets.
+
+From the bindings directory:
+    python -m python-compute.benchmark --rows 1000000 --output results.json
+and to compare the results of two commits, exiting with status 1 on regressions:
+    python -m python-compute.benchmark --compare base.json results.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from .data_manager import DataManager, PRED_PREFIX, TARGET_COL_IN, PRED_COL_IN, UUID_COL, \
+    compute_models_meta_data, compute_pred_df, compute_target_df, compute_loss_df
+from .performance_comparison import PerformanceComparison
+from .feature_differentiation import FeatureDifferentiation
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+STAGES = ['read', 'loss', 'filter', 'cluster', 'segment_stats', 'feature_ranking']
+# a stage is reported as a regression if it is this much slower than the base results
+DEFAULT_REGRESSION_RATIO = 1.2
+
+
+def generate_datasets(out_dir, n_rows=100000, n_models=2, n_classes=2, n_numerical=20, n_categorical=5,
+                      cardinality=10, file_format='csv', seed=0):
+    """
+    Synthetic feature and prediction datasets, following the column conventions of the datasets of manifold:
+    prediction datasets have one '@prediction:<class>' probability column per class (or '@prediction:predict'
+    for regression, n_classes=1) and a '@prediction:target' column; the feature dataset has a uuid column,
+    numerical and categorical features. Models are noisy versions of a common score, so that they differ
+    by segment, and categorical features have the given number of categories.
+    :param file_format: 'csv' or 'parquet'
+    :return: (feature dataset path, list of prediction dataset paths)
+    """
+    random_state = np.random.RandomState(seed)
+    numerical = random_state.normal(size=(n_rows, n_numerical))
+    weights = random_state.normal(size=(n_numerical, max(n_classes, 1)))
+    logits = numerical.dot(weights) / np.sqrt(max(n_numerical, 1))
+
+    if n_classes > 1:
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        cum_probs = probs.cumsum(axis=1)
+        target = (random_state.rand(n_rows, 1) > cum_probs[:, :-1]).sum(axis=1)
+    else:
+        # positive, as the default regression loss is the squared log error
+        target = np.exp(logits[:, 0] + random_state.normal(scale=.5, size=n_rows))
+
+    feature_df = pd.DataFrame(numerical, columns=['num_{}'.format(i) for i in range(n_numerical)])
+    for i in range(n_categorical):
+        feature_df['cat_{}'.format(i)] = random_state.randint(cardinality, size=n_rows).astype(str)
+    feature_df.insert(0, UUID_COL, np.arange(n_rows))
+
+    pred_dfs = []
+    for m in range(n_models):
+        noisy = logits + random_state.normal(scale=.5 * (m + 1), size=logits.shape)
+        if n_classes > 1:
+            pred = np.exp(noisy - noisy.max(axis=1, keepdims=True))
+            pred /= pred.sum(axis=1, keepdims=True)
+            pred_df = pd.DataFrame(pred, columns=[PRED_PREFIX + str(c) for c in range(n_classes)])
+        else:
+            pred_df = pd.DataFrame({PRED_COL_IN: np.exp(noisy[:, 0])})
+        pred_df[TARGET_COL_IN] = target
+        pred_dfs.append(pred_df)
+
+    def write(df, name):
+        path = os.path.join(out_dir, '{}.{}'.format(name, file_format))
+        if file_format == 'csv':
+            df.to_csv(path, index=False)
+        else:
+            df.to_parquet(path, index=False)
+        return path
+
+    feature_dataset = write(feature_df, 'features')
+    pred_datasets = [write(df, 'predictions_{}'.format(m)) for m, df in enumerate(pred_dfs)]
+    return feature_dataset, pred_datasets
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # kilobytes on linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageTimer(object):
+    """
+    Wall time and peak traced memory of the stages of a benchmark run, one entry per stage.
+    Tracing memory slows down python code, stages can be timed without it.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+
+    def run(self, stage, func, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            self.stages[stage] = {'seconds': seconds, 'peakBytes': peak}
+
+
+def run_pipeline(feature_dataset, pred_datasets, n_clusters=4, data_filter=None, top_k=None, n_workers=None,
+                 trace_memory=True):
+    """
+    Runs the stages of a ServiceSession on datasets, timing each of them
+    :param data_filter: filters applied in the filter stage, by default rows with the first numerical
+        feature above its median
+    :return: StageTimer of the stages
+    """
+    timer = StageTimer(trace_memory=trace_memory)
+    pred_dfs, feature_df = timer.run('read', DataManager.read_datasets, feature_dataset, pred_datasets)
+
+    def compute_loss():
+        models_meta = compute_models_meta_data(pred_dfs)
+        n_models, n_classes, class_labels = models_meta
+        pred_df = compute_pred_df(pred_dfs, n_models, n_classes, class_labels)
+        target_df = compute_target_df(pred_dfs, n_models)
+        return models_meta, pred_df, target_df, compute_loss_df(pred_df, target_df, n_models, n_classes)
+    models_meta, pred_df, target_df, loss_df = timer.run('loss', compute_loss)
+    del pred_dfs
+    data_manager = DataManager.from_frames(pred_df, target_df, loss_df, feature_df, models_meta)
+
+    if data_filter is None:
+        num_cols = [c for c in feature_df.columns if c.startswith('num_')]
+        data_filter = [{'key': num_cols[0], 'type': 'range', 'value': [float(feature_df[num_cols[0]].median()), None]}] \
+            if num_cols else []
+    timer.run('filter', data_manager.set_filters, data_filter)
+
+    feature_df = data_manager.get_feature_df()
+    n_models = len(loss_df.columns)
+    performance_comparison = PerformanceComparison(
+        data_manager.get_pred_df(), data_manager.get_loss_df(), feature_df, uuid=feature_df[UUID_COL].values,
+        model_meta={'model_' + str(i): 'model_' + str(i) for i in range(n_models)})
+    timer.run('cluster', performance_comparison.set_params, n_clusters=n_clusters, metric='performance')
+    timer.run('segment_stats', performance_comparison.get_models_performance_by_segment)
+
+    feature_differentiation = FeatureDifferentiation(feature_df, n_workers=n_workers)
+    feature_differentiation.set_params([0], list(range(1, n_clusters)), performance_comparison.get_segment_ids())
+    timer.run('feature_ranking', feature_differentiation.get_features_distribution_by_segment_group, top_k=top_k)
+    return timer
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(n_rows=100000, n_models=2, n_classes=2, n_numerical=20, n_categorical=5, cardinality=10,
+                  file_format='csv', n_clusters=4, top_k=None, n_workers=None, repeat=1, trace_memory=True, seed=0):
+    """
+    Generates datasets and runs the pipeline on them repeat times
+    :return: results dict, with the parameters, the environment, and the time (best of the runs)
+        and peak memory of every stage
+    """
+    params = {
+        'rows': n_rows, 'models': n_models, 'classes': n_classes, 'numericalFeatures': n_numerical,
+        'categoricalFeatures': n_categorical, 'cardinality': cardinality, 'fileFormat': file_format,
+        'clusters': n_clusters, 'topK': top_k, 'workers': n_workers, 'repeat': repeat, 'seed': seed
+    }
+    runs = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        feature_dataset, pred_datasets = generate_datasets(
+            out_dir, n_rows=n_rows, n_models=n_models, n_classes=n_classes, n_numerical=n_numerical,
+            n_categorical=n_categorical, cardinality=cardinality, file_format=file_format, seed=seed)
+        for _ in range(repeat):
+            runs.append(run_pipeline(feature_dataset, pred_datasets, n_clusters=n_clusters, top_k=top_k,
+                                     n_workers=n_workers, trace_memory=trace_memory).stages)
+
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {
+            'seconds': min(r[stage]['seconds'] for r in runs),
+            'allSeconds': [r[stage]['seconds'] for r in runs],
+            'peakBytes': max(r[stage]['peakBytes'] for r in runs) if trace_memory else None
+        }
+    return {
+        'params': params,
+        'environment': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'stages': stages,
+        'totalSeconds': sum(s['seconds'] for s in stages.values()),
+        'peakRssBytes': peak_rss_bytes()
+    }
+
+
+def compare_results(base, new, regression_ratio=DEFAULT_REGRESSION_RATIO):
+    """
+    Time ratios of the stages of two results of run_benchmark, e.g. of two commits
+    :return: list of dicts per stage, with 'regression' set when new is slower than base by more than the ratio
+    """
+    comparison = []
+    for stage in STAGES:
+        if stage not in base['stages'] or stage not in new['stages']:
+            continue
+        base_seconds, new_seconds = base['stages'][stage]['seconds'], new['stages'][stage]['seconds']
+        ratio = new_seconds / base_seconds if base_seconds > 0 else float('inf')
+        comparison.append({
+            'stage': stage,
+            'baseSeconds': base_seconds,
+            'newSeconds': new_seconds,
+            'ratio': ratio,
+            'basePeakBytes': base['stages'][stage]['peakBytes'],
+            'newPeakBytes': new['stages'][stage]['peakBytes'],
+            'regression': ratio > regression_ratio
+        })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the python-compute pipeline')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--models', type=int, default=2)
+    parser.add_argument('--classes', type=int, default=2, help='1 for regression')
+    parser.add_argument('--numerical', type=int, default=20, help='number of numerical features')
+    parser.add_argument('--categorical', type=int, default=5, help='number of categorical features')
+    parser.add_argument('--cardinality', type=int, default=10, help='number of categories of categorical features')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'])
+    parser.add_argument('--clusters', type=int, default=4)
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="don't trace memory, which slows down python code")
+    parser.add_argument('--output', help='json file results are written to, stdout if not set')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two result files instead of running the benchmark')
+    parser.add_argument('--regression-ratio', type=float, default=DEFAULT_REGRESSION_RATIO)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        comparison = compare_results(base, new, regression_ratio=args.regression_ratio)
+        for c in comparison:
+            print('{:<16} {:>9.3f}s {:>9.3f}s {:>6.2f}x{}'.format(
+                c['stage'], c['baseSeconds'], c['newSeconds'], c['ratio'], '  REGRESSION' if c['regression'] else ''))
+        # non-zero exit status on regressions, e.g. to fail a CI job
+        return 1 if any(c['regression'] for c in comparison) else 0
+
+    results = run_benchmark(
+        n_rows=args.rows, n_models=args.models, n_classes=args.classes, n_numerical=args.numerical,
+        n_categorical=args.categorical, cardinality=args.cardinality, file_format=args.format,
+        n_clusters=args.clusters, top_k=args.top_k, n_workers=args.workers, repeat=args.repeat,
+        trace_memory=not args.no_memory, seed=args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
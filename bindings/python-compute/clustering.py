@@ -0,0 +1,221 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial import cKDTree
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+
+CLUSTERING_METHOD = {
+    'KMEANS': 'kmeans',
+    'MINI_BATCH_KMEANS': 'mini_batch_kmeans',
+    'SAMPLE_KMEANS': 'sample_kmeans',
+    'WARD_TREE': 'ward_tree'
+}
+
+# ready-made time/accuracy tradeoffs, from full KMeans on every row to KMeans on a sample of rows;
+# the default ClusteringConfig is KMeans on a sample of rows, warm started
+CLUSTERING_PRESETS = {
+    'exact': {'method': CLUSTERING_METHOD['KMEANS'], 'n_init': 10},
+    'balanced': {'method': CLUSTERING_METHOD['MINI_BATCH_KMEANS'], 'n_init': 1, 'max_iter': 10,
+                 'batch_size': 65536, 'warm_start': True},
+    'fast': {'method': CLUSTERING_METHOD['SAMPLE_KMEANS'], 'n_init': 1, 'sample_size': 50000, 'warm_start': True},
+    'hierarchical': {'method': CLUSTERING_METHOD['WARD_TREE']},
+}
+
+
+class ClusteringConfig(object):
+    """
+    :param method: one of CLUSTERING_METHOD, or the name of a backend added with register_clustering_backend
+    :param n_init: number of initializations of cold starts; warm starts use the seeded centroids only
+    :param max_iter: maximum number of iterations of a single run (epochs over the data for mini_batch_kmeans)
+    :param batch_size: size of the mini batches of mini_batch_kmeans
+    :param sample_size: number of rows sample_kmeans is fit on; every row is then assigned to its nearest centroid
+    :param warm_start: seed clustering with the centroids of the previous clustering on the same metric,
+        when only the number of clusters or the base models change; centroids are computed on sample_size rows
+    :param tree_sample_size: number of rows the ward_tree merge tree is built on (memory is quadratic in it)
+    :param n_leaf_clusters: number of clusters of the finest cut of the ward_tree, i.e. the maximum n_clusters
+    """
+
+    def __init__(self, method=CLUSTERING_METHOD['SAMPLE_KMEANS'], n_init=3, max_iter=300, batch_size=4096,
+                 sample_size=100000, warm_start=True, tree_sample_size=5000, n_leaf_clusters=200,
+                 random_state=0):
+        self.method = method
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.warm_start = warm_start
+        self.tree_sample_size = tree_sample_size
+        self.n_leaf_clusters = n_leaf_clusters
+        self.random_state = random_state
+
+
+    @classmethod
+    def from_preset(cls, preset, **kwargs):
+        params = dict(CLUSTERING_PRESETS[preset])
+        params.update(kwargs)
+        return cls(**params)
+
+
+# registry of clustering backends, <method name -> function>
+# every function takes (X, n_clusters, config, init_centers) and returns (labels, centers);
+# init_centers is a (n_clusters x n_columns) array to seed from, or None for a cold start
+CLUSTERING_BACKENDS = {}
+
+
+def register_clustering_backend(name, func):
+    CLUSTERING_BACKENDS[name] = func
+    return func
+
+
+def get_clustering_backend(name):
+    try:
+        return CLUSTERING_BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown clustering method "{}", available ones are: {}'.format(
+            name, ', '.join(sorted(CLUSTERING_BACKENDS))))
+
+
+def init_params(config, init_centers):
+    if init_centers is None:
+        return {'init': 'k-means++', 'n_init': config.n_init}
+    return {'init': init_centers, 'n_init': 1}
+
+
+def fit_kmeans(X, n_clusters, config, init_centers=None):
+    model = KMeans(n_clusters=n_clusters, max_iter=config.max_iter, random_state=config.random_state,
+                   **init_params(config, init_centers))
+    labels = model.fit_predict(X)
+    return labels, model.cluster_centers_
+
+
+def fit_mini_batch_kmeans(X, n_clusters, config, init_centers=None):
+    model = MiniBatchKMeans(n_clusters=n_clusters, max_iter=config.max_iter, batch_size=config.batch_size,
+                            random_state=config.random_state, **init_params(config, init_centers))
+    labels = model.fit_predict(X)
+    return labels, model.cluster_centers_
+
+
+def sample_rows(n_rows, sample_size, random_state):
+    """
+    Sorted indices of sample_size distinct rows out of n_rows, drawn uniformly. choice without replacement
+    permutes all the rows, which costs as much as a fit on a sample of a large dataset; when the sample is a small
+    part of the rows, draws with replacement are repeated instead until there are enough distinct rows.
+    """
+    if sample_size * 2 > n_rows:
+        return np.sort(random_state.choice(n_rows, sample_size, replace=False))
+    rows = np.unique(random_state.randint(0, n_rows, sample_size))
+    while len(rows) < sample_size:
+        rows = np.unique(np.concatenate([rows, random_state.randint(0, n_rows, sample_size - len(rows))]))
+    return rows
+
+
+def fit_sample_kmeans(X, n_clusters, config, init_centers=None):
+    if len(X) <= config.sample_size:
+        return fit_kmeans(X, n_clusters, config, init_centers)
+    # the rows warm start centroids are computed on, see compute_clusters
+    sample = X[sample_rows(len(X), config.sample_size, np.random.RandomState(config.random_state))]
+    _, centers = fit_kmeans(sample, n_clusters, config, init_centers)
+    return assign_nearest_center(X, centers), centers
+
+
+register_clustering_backend(CLUSTERING_METHOD['KMEANS'], fit_kmeans)
+register_clustering_backend(CLUSTERING_METHOD['MINI_BATCH_KMEANS'], fit_mini_batch_kmeans)
+register_clustering_backend(CLUSTERING_METHOD['SAMPLE_KMEANS'], fit_sample_kmeans)
+
+
+# index of the nearest center of every row
+def assign_nearest_center(X, centers, block_size=2 ** 22):
+    # a k-d tree pays off for many centers; for a few, distances to all of them are computed in blocks of rows
+    if len(centers) > 32:
+        _, labels = cKDTree(centers).query(X, k=1)
+        return labels.astype(np.int32)
+
+    labels = np.empty(len(X), dtype=np.int32)
+    block_rows = max(block_size // len(centers), 1)
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(X), block_rows):
+        block = X[start: start + block_rows]
+        # squared distances up to the per-row constant |x|^2, which doesn't change the argmin
+        distances = center_norms[np.newaxis, :] - 2 * block.dot(centers.T)
+        labels[start: start + block_rows] = distances.argmin(axis=1)
+    return labels
+
+
+def compute_centers(X, labels, n_clusters):
+    sizes = np.bincount(labels, minlength=n_clusters)
+    sums = np.column_stack([np.bincount(labels, weights=X[:, j], minlength=n_clusters) for j in range(X.shape[1])])
+    return sums / np.maximum(sizes, 1)[:, np.newaxis], sizes
+
+
+def compute_warm_start_centers(X, n_clusters, prev_labels, config):
+    """
+    Seed centroids from a previous clustering of the same rows, or of a sample of them, possibly on other columns:
+    centroids of the previous clusters in the current columns, the largest clusters first;
+    random rows are added as seeds if more clusters are asked for than there were.
+    """
+    prev_labels = np.asarray(prev_labels)
+    centers, sizes = compute_centers(X, prev_labels, prev_labels.max() + 1)
+    non_empty = np.where(sizes > 0)[0]
+    centers = centers[non_empty][np.argsort(-sizes[non_empty], kind='stable')]
+
+    if len(centers) >= n_clusters:
+        return centers[:n_clusters]
+    random_state = np.random.RandomState(config.random_state)
+    extra = X[random_state.choice(len(X), n_clusters - len(centers), replace=False)]
+    return np.vstack([centers, extra])
+
+
+def compute_clusters(X, n_clusters, config, prev_labels=None):
+    """
+    :param X: (rows x columns) array of the values to cluster
+    :param prev_labels: labels of a previous clustering of the same rows, to warm start from
+    :return: (labels, centers)
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    init_centers = None
+    if config.warm_start and prev_labels is not None:
+        # centroids of a sample of rows are close enough to seed from; it is the sample sample_kmeans is fit on
+        prev_labels = np.asarray(prev_labels)
+        if len(X) > config.sample_size:
+            rows = sample_rows(len(X), config.sample_size, np.random.RandomState(config.random_state))
+            init_centers = compute_warm_start_centers(X[rows], n_clusters, prev_labels[rows], config)
+        else:
+            init_centers = compute_warm_start_centers(X, n_clusters, prev_labels, config)
+    return get_clustering_backend(config.method)(X, n_clusters, config, init_centers)
+
+
+class HierarchicalClustering(object):
+    """
+    Ward merge tree of a sample of rows, computed once, from which a clustering for any number of clusters
+    is read off without refitting. Every row is assigned once to its nearest leaf cluster (the finest cut
+    of the tree); as cuts of a tree are nested, each leaf cluster belongs to exactly one cluster of any
+    coarser cut, so labels for n clusters are a lookup over the leaf ids of all rows.
+    """
+
+    def __init__(self, X, config):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if len(X) > config.tree_sample_size:
+            sample = X[sample_rows(len(X), config.tree_sample_size, np.random.RandomState(config.random_state))]
+        else:
+            sample = X
+        self.linkage = linkage(sample, method='ward')
+        # the cut has fewer leaves than asked for if rows are tied; leaves are numbered from 0 without gaps,
+        # so that every leaf has a center and rows are only assigned to leaves of the tree
+        leaves, self.sample_leaf_ids = np.unique(self.cut(min(config.n_leaf_clusters, len(sample))),
+                                                 return_inverse=True)
+        self.n_leaves = len(leaves)
+        leaf_centers, _ = compute_centers(sample, self.sample_leaf_ids, self.n_leaves)
+        self.leaf_ids = assign_nearest_center(X, leaf_centers)
+
+
+    def cut(self, n_clusters):
+        # zero based cluster ids of the sample rows
+        return fcluster(self.linkage, n_clusters, criterion='maxclust') - 1
+
+
+    def get_labels(self, n_clusters):
+        if n_clusters > self.n_leaves:
+            raise ValueError('At most {} clusters can be read off the merge tree'.format(self.n_leaves))
+        leaf_to_cluster = np.zeros(self.n_leaves, dtype=np.int32)
+        leaf_to_cluster[self.sample_leaf_ids] = self.cut(n_clusters)
+        return leaf_to_cluster[self.leaf_ids]
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# build a DataFrame on top of existing column arrays, without copying them
+def frame_from_columns(columns):
+    return pd.DataFrame(columns, columns=list(columns.keys()), copy=False)
+
+
+# column-wise concatenation of frames with the same rows, sharing the memory of their columns
+def join_frames(frames):
+    columns = OrderedDict()
+    for df in frames:
+        for c in df.columns:
+            columns[c] = df[c].values
+    return frame_from_columns(columns)
+
+
+class ColumnStore(object):
+    """
+    Typed column arrays of all the data of a DataManager, organized in named groups of columns
+    (e.g. 'pred', 'loss', 'feature'). Columns of the same dtype in a group share a single contiguous
+    (columns x rows) block; memory mapped columns, e.g. from the session cache, are kept as they are.
+    Frames returned by the store are views on these arrays, or masked selections of them.
+    """
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.columns = OrderedDict()
+        self.groups = OrderedDict()
+
+
+    def add_frame(self, group, df):
+        if len(df) != self.n_rows:
+            raise ValueError('Expected {} rows in group {}, got {}'.format(self.n_rows, group, len(df)))
+        arrays = [(c, df[c].values) for c in df.columns]
+
+        # pack columns of each numpy dtype in a contiguous block, unless they are memory mapped already
+        by_dtype = OrderedDict()
+        for c, values in arrays:
+            if isinstance(values, np.ndarray) and not isinstance(values.base, np.memmap) \
+                    and not isinstance(values, np.memmap):
+                by_dtype.setdefault(values.dtype, []).append(c)
+        packed = {}
+        for dtype, names in by_dtype.items():
+            block = np.empty((len(names), self.n_rows), dtype=dtype)
+            for i, c in enumerate(names):
+                block[i] = df[c].values
+                packed[c] = block[i]
+
+        for c, values in arrays:
+            self.columns[c] = packed.get(c, values)
+        self.groups[group] = [c for c, _ in arrays]
+
+
+    def get_column_names(self, groups):
+        return [c for g in groups for c in self.groups[g]]
+
+
+    def get_frame(self, groups, mask=None):
+        names = self.get_column_names(groups)
+        if mask is None:
+            return frame_from_columns(OrderedDict((c, self.columns[c]) for c in names))
+        return frame_from_columns(OrderedDict((c, self.columns[c][mask]) for c in names))
+
+
+    def nbytes(self):
+        return sum(getattr(values, 'nbytes', 0) for values in self.columns.values())
@@ -9,3 +9,18 @@ METRICS = {
     'ABSOLUTE': 'absolute'
 }
 
+# optional <feature name -> [min, max]> value ranges used for feature distributions, instead of percentiles
+RANGE_FILTER = {}
+# how segment membership is sent along with the performance of segments
+DATA_IDS_ENCODING = {
+    # list of the uuids of the segment
+    'LIST': 'list',
+    # base64 int32 [start, length, start, length, ...] runs of consecutive row indices
+    'RLE': 'rle',
+    # base64 bitmap over all row indices, one bit per row, least significant bit first
+    'BITMAP': 'bitmap',
+    # whichever of rle and bitmap is smaller, per segment
+    'AUTO': 'auto',
+    # no membership, uuids are fetched by pages with get_segment_data_ids
+    'NONE': 'none'
+}
@@ -1,7 +1,11 @@
+import copy
 import pandas as pd
 import numpy as np
-from sklearn.metrics import log_loss, mean_squared_log_error
-from .utils import compute_filter
+from .readers import read_dataset
+from .column_store import ColumnStore
+from .mask_cache import FilterMaskCache, DEFAULT_MASK_CACHE_BYTES, filter_hash
+from .loss import compute_loss_array
+from .instrumentation import span
 
 
 DUMMY_PREFIX_SEP = '--'
@@ -19,6 +23,24 @@ TARGET_COL_OUT = lambda m: 'groundTruth_{}'.format(m)
 
 UUID_COL = 'uuid'
 
+# column groups of the column store, which are also the frames kept in the session cache
+STORE_GROUPS = ['pred', 'target', 'loss', 'feature']
+FEATURE_GROUPS = ['feature', 'target']
+MODELS_META_JSON = 'models_meta'
+
+
+is_pred_col = lambda c: c.startswith(PRED_PREFIX)
+is_feature_col = lambda c: not c.startswith(PRED_PREFIX)
+
+
+# prediction probabilities are parsed as floats directly, instead of letting the csv parser infer them;
+# PRED_COL_IN holds predicted labels if there are class columns, it is only cast in the regression case,
+# see compute_pred_df
+def pred_col_dtype(c):
+    if c in [PRED_INDEX, TARGET_INDEX, PRED_COL_IN, TARGET_COL_IN] or c.startswith(INDEXED_FEATURE_PREFIX):
+        return None
+    return np.float64
+
 
 def compute_models_meta_data(pred_dfs):
     n_models = len(pred_dfs)
@@ -60,30 +82,22 @@ def compute_target_df(pred_dfs, n_models, use_same_target=True):
     return pd.concat(target_cols, axis=1)
 
 
-def compute_log_loss_per_data(pred_df, target_df, n_models, n_classes):
-    loss_list = []
-    if n_classes > 1:
-        # classification
-        log_loss_single = lambda x: log_loss([x[0]], [x[1:]], labels=list(range(n_classes)))
-    else:
-        # regression
-        log_loss_single = lambda x: mean_squared_log_error([x[0]], [x[1:]])
-
+def compute_log_loss_per_data(pred_df, target_df, n_models, n_classes, loss_name=None):
+    target_cols = []
     for model in range(n_models):
         try:
-            ground_truth = target_df[TARGET_COL_OUT(model)].values
+            target_cols.append(target_df[TARGET_COL_OUT(model)].values)
         except KeyError:
-            ground_truth = target_df[TARGET_COL_OUT(0)].values
+            target_cols.append(target_df[TARGET_COL_OUT(0)].values)
 
-        eval_array = np.hstack([np.expand_dims(ground_truth, axis=1),
-                                pred_df.iloc[:, model * n_classes: (model + 1) * n_classes]])
-        loss_array = np.apply_along_axis(log_loss_single, 1, eval_array)
-        loss_list += [np.expand_dims(loss_array, 1)]
-    return np.hstack(loss_list)
+    # losses of all models are computed at once, on a (rows x models x classes) array
+    pred_array = pred_df.values.reshape(len(pred_df), n_models, n_classes)
+    target_array = np.column_stack(target_cols)
+    return compute_loss_array(pred_array, target_array, loss_name=loss_name)
 
 
-def compute_loss_df(pred_df, target_df, n_models, n_classes):
-    loss_array = compute_log_loss_per_data(pred_df, target_df, n_models, n_classes)
+def compute_loss_df(pred_df, target_df, n_models, n_classes, loss_name=None):
+    loss_array = compute_log_loss_per_data(pred_df, target_df, n_models, n_classes, loss_name=loss_name)
     return pd.DataFrame(loss_array, columns=['model_' + str(i) for i in range(n_models)])
 
 
@@ -91,40 +105,174 @@ def compute_pred_df(pred_dfs, n_models, n_classes, class_labels):
     pred_cols_for_classes = [PRED_PREFIX + str(c) for c in class_labels] if class_labels is not None else [PRED_COL_IN]
     pred_df = pd.concat([df[pred_cols_for_classes] for df in pred_dfs], axis=1)
     pred_df.columns = compute_pred_col_names(n_models, n_classes)
+    if class_labels is None:
+        # regression predictions, not parsed as floats by pred_col_dtype
+        pred_df = pred_df.astype(np.float64, copy=False)
     return pred_df
 
 
 class DataManager(object):
 
-    def __init__(self, feature_dataset, pred_datasets, use_same_target=True):
+    def __init__(self, feature_dataset, pred_datasets, use_same_target=True, loss_name=None,
+                 mask_cache_bytes=DEFAULT_MASK_CACHE_BYTES, session_cache=None):
         self.filters = None
-        self.pred_dfs, self.feature_df = self.read_datasets(feature_dataset, pred_datasets)
-        self.n_models, self.n_classes, self.class_labels = compute_models_meta_data(self.pred_dfs)
+        # key of the filters of the selected rows, None if all rows are selected
+        self.filter_key = None
+        self.mask_cache = FilterMaskCache(max_bytes=mask_cache_bytes)
+        self.pred_datasets = pred_datasets
+        self.pred_dfs = None
+
+        # precomputed columns are memory mapped from the session cache if the same datasets were loaded before
+        self.cache_entry = None
+        if session_cache is not None:
+            self.cache_entry = session_cache.get_entry(
+                feature_dataset, pred_datasets, use_same_target=use_same_target, loss_name=loss_name)
+        if self.cache_entry is not None and all(self.cache_entry.has_frame(g) for g in STORE_GROUPS) \
+                and self.cache_entry.has_json(MODELS_META_JSON):
+            self.load_from_cache()
+            return
+
+        with span('read') as s:
+            pred_dfs, feature_df = self.read_datasets(feature_dataset, pred_datasets)
+            s.rows = len(feature_df)
+        self.init_datasets(pred_dfs, feature_df, use_same_target=use_same_target, loss_name=loss_name)
+        if self.cache_entry is not None:
+            self.write_to_cache()
+
+
+    @classmethod
+    def from_frames(cls, pred_df, target_df, loss_df, feature_df, models_meta,
+                    mask_cache_bytes=DEFAULT_MASK_CACHE_BYTES):
+        # DataManager on frames read and computed elsewhere, e.g. by benchmarks timing these stages separately
+        data_manager = cls.__new__(cls)
+        data_manager.filters = None
+        data_manager.filter_key = None
+        data_manager.mask_cache = FilterMaskCache(max_bytes=mask_cache_bytes)
+        data_manager.pred_datasets = None
+        data_manager.pred_dfs = None
+        data_manager.cache_entry = None
+        data_manager.n_models, data_manager.n_classes, data_manager.class_labels = models_meta
+        data_manager.init_store(pred_df, target_df, loss_df, feature_df)
+        return data_manager
 
-        self.pred_df = compute_pred_df(self.pred_dfs, self.n_models, self.n_classes, self.class_labels)
-        self.target_df = compute_target_df(self.pred_dfs, self.n_models, use_same_target=use_same_target)
-        self.loss_df = compute_loss_df(self.pred_df, self.target_df, self.n_models, self.n_classes)
 
-        self.feature_df = self.feature_df[[c for c in self.feature_df.columns if not c.startswith(PRED_PREFIX)]]
+    @classmethod
+    def from_datasets(cls, feature_df, pred_dfs, use_same_target=True, loss_name=None,
+                      mask_cache_bytes=DEFAULT_MASK_CACHE_BYTES):
+        """
+        DataManager on datasets already in memory, e.g. data frames of a notebook
+        :param feature_df: DataFrame in the format of the feature dataset, with a uuid column
+        :param pred_dfs: list of DataFrames in the format of the prediction datasets, one per model
+        """
+        data_manager = cls.__new__(cls)
+        data_manager.filters = None
+        data_manager.filter_key = None
+        data_manager.mask_cache = FilterMaskCache(max_bytes=mask_cache_bytes)
+        data_manager.pred_datasets = None
+        # kept, as there are no files to re-read them from
+        data_manager.pred_dfs = [df[[c for c in df.columns if is_pred_col(c)]] for df in pred_dfs]
+        data_manager.cache_entry = None
+        feature_df = feature_df[[c for c in feature_df.columns if is_feature_col(c)]]
+        data_manager.init_datasets(data_manager.pred_dfs, feature_df, use_same_target=use_same_target,
+                                   loss_name=loss_name)
+        return data_manager
+
+
+    def init_datasets(self, pred_dfs, feature_df, use_same_target=True, loss_name=None):
+        self.n_models, self.n_classes, self.class_labels = compute_models_meta_data(pred_dfs)
+
+        with span('loss', rows=len(feature_df)) as s:
+            pred_df = compute_pred_df(pred_dfs, self.n_models, self.n_classes, self.class_labels)
+            target_df = compute_target_df(pred_dfs, self.n_models, use_same_target=use_same_target)
+            loss_df = compute_loss_df(pred_df, target_df, self.n_models, self.n_classes, loss_name=loss_name)
+            s.result_bytes = int(loss_df.values.nbytes)
+
+        self.init_store(pred_df, target_df, loss_df, feature_df)
+
+
+    def init_store(self, pred_df, target_df, loss_df, feature_df):
+        # all data is kept once, in the column store; raw prediction datasets are re-read if ever needed
+        with span('store', rows=len(pred_df)) as s:
+            self.store = ColumnStore(len(pred_df))
+            for group, df in zip(STORE_GROUPS, [pred_df, target_df, loss_df, feature_df]):
+                self.store.add_frame(group, df)
+            self.init_views()
+            s.result_bytes = self.store.nbytes()
+
+
+    def init_views(self):
+        # unfiltered frames, sharing the memory of the column store
+        self.pred_df = self.store.get_frame(['pred'])
+        self.target_df = self.store.get_frame(['target'])
+        self.loss_df = self.store.get_frame(['loss'])
         # We think of target as a special feature
-        self.feature_df = pd.concat([self.feature_df, self.target_df], axis=1)
+        self.feature_df = self.store.get_frame(FEATURE_GROUPS)
+        # all columns a filter can refer to
+        self.full_df = self.store.get_frame(['pred', 'loss'] + FEATURE_GROUPS)
+
+
+    def load_from_cache(self):
+        models_meta = self.cache_entry.read_json(MODELS_META_JSON)
+        self.n_models = models_meta['nModels']
+        self.n_classes = models_meta['nClasses']
+        self.class_labels = models_meta['classLabels']
+
+        with span('read_cache') as s:
+            frames = [self.cache_entry.read_frame(g) for g in STORE_GROUPS]
+            self.store = ColumnStore(len(frames[0]))
+            for group, df in zip(STORE_GROUPS, frames):
+                self.store.add_frame(group, df)
+            self.init_views()
+            s.rows = len(frames[0])
+
+
+    def write_to_cache(self):
+        self.cache_entry.write_json(MODELS_META_JSON, self.get_models_meta_data())
+        for g in STORE_GROUPS:
+            self.cache_entry.write_frame(g, self.store.get_frame([g]))
 
 
     @classmethod
     def read_datasets(self, feature_dataset, pred_datasets):
-        pred_dfs = []
-        for d in pred_datasets:
-            pred_dfs.append(pd.read_csv(d))
-        feature_df = pd.read_csv(feature_dataset)
+        # only prediction columns are read from prediction datasets, and only features from the feature dataset
+        pred_dfs = self.read_pred_datasets(pred_datasets)
+        feature_df = read_dataset(feature_dataset, usecols=is_feature_col)
         return pred_dfs, feature_df
 
 
+    @classmethod
+    def read_pred_datasets(self, pred_datasets):
+        return [read_dataset(d, usecols=is_pred_col, dtype=pred_col_dtype) for d in pred_datasets]
+
+
+    # DataManager sharing the data and caches of this one, with filters of its own
+    def view(self):
+        data_manager = copy.copy(self)
+        data_manager.filters = None
+        data_manager.filter_key = None
+        return data_manager
+
+
+    def get_full_df(self):
+        return self.full_df
+
+
+    # returns whether the set of selected rows changed
     def set_filters(self, filters=None):
+        prev_filters = self.filters
         if not filters:
             self.filters = None
         else:
-            full_df = pd.concat([self.pred_df, self.loss_df, self.feature_df], axis=1)
-            self.filters = compute_filter(filters, full_df)
+            with span('filter', rows=len(self.get_full_df())) as s:
+                self.filters = self.mask_cache.compute_filter(filters, self.get_full_df())
+                s.result_bytes = self.filters.nbytes
+            if self.filters.all():
+                self.filters = None
+        self.filter_key = None if self.filters is None else filter_hash(filters)
+
+        if prev_filters is None or self.filters is None:
+            return prev_filters is not self.filters
+        return not np.array_equal(prev_filters, self.filters)
 
 
     def get_models_meta_data(self):
@@ -136,22 +284,19 @@ class DataManager(object):
 
 
     def get_pred_dfs(self):
+        # not kept when loaded from the session cache, read on demand
+        if self.pred_dfs is None:
+            self.pred_dfs = self.read_pred_datasets(self.pred_datasets)
         return self.pred_dfs
 
 
     def get_pred_df(self):
-        if self.filters is None:
-            return self.pred_df
-        return self.pred_df[self.filters].reset_index(drop=True)
+        return self.store.get_frame(['pred'], mask=self.filters)
 
 
     def get_loss_df(self):
-        if self.filters is None:
-            return self.loss_df
-        return self.loss_df[self.filters].reset_index(drop=True)
+        return self.store.get_frame(['loss'], mask=self.filters)
 
 
     def get_feature_df(self):
-        if self.filters is None:
-            return self.feature_df
-        return self.feature_df[self.filters].reset_index(drop=True)
+        return self.store.get_frame(FEATURE_GROUPS, mask=self.filters)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from numpy.linalg import LinAlgError
+from scipy.signal import fftconvolve
+from scipy.stats import gaussian_kde
+
+
+DENSITY_METHOD = {
+    # data binned on a fine grid and smoothed with a gaussian kernel, O(n + grid size)
+    'BINNED': 'binned',
+    # scipy's gaussian_kde evaluated on every point, O(n * number of points); kept for validation
+    'EXACT': 'exact'
+}
+density_settings = {'method': DENSITY_METHOD['BINNED']}
+
+# grid of the binned estimate: points per bandwidth, and bounds on the number of points
+GRID_POINTS_PER_BANDWIDTH = 8
+MIN_GRID_SIZE = 512
+MAX_GRID_SIZE = 2 ** 16
+# the gaussian kernel is truncated at this many bandwidths
+KERNEL_TRUNCATE = 5
+
+
+def set_density_method(method):
+    if method not in DENSITY_METHOD.values():
+        raise ValueError('Unknown density method "{}"'.format(method))
+    density_settings['method'] = method
+
+
+# index of nearest element in array to value
+nearest_index = lambda arr, val: (np.abs(arr - val)).argmin()
+# get a distribution where all densities are 0 except for the position of unique value (=1)
+def get_single_value_distribution(domain, raw_values):
+    unique_value = pd.Series(raw_values).unique()[0]
+    distribution = np.zeros(domain.shape)
+    distribution[nearest_index(domain, unique_value)] = 1.
+    return distribution
+
+
+# bandwidth factor of gaussian_kde for 1-d data: a scalar, or the name of a rule
+def bandwidth_factor(n, bw_method=None):
+    if bw_method is None or bw_method == 'scott':
+        return n ** (-1. / 5)
+    if bw_method == 'silverman':
+        return (n * 3. / 4) ** (-1. / 5)
+    return float(bw_method)
+
+
+def binned_kde(values, x, bw_method=None, weights=None):
+    """
+    :param weights: optional number of occurrences of every value, e.g. counts of the bins of a histogram
+        at their centers; the bandwidth is that of the values repeated as many times
+    """
+    is_kept = ~np.isnan(values)
+    if weights is not None:
+        is_kept &= weights > 0
+        weights = np.asarray(weights, dtype=np.float64)[is_kept]
+    values = values[is_kept]
+    n = len(values) if weights is None else weights.sum()
+    if n == 0:
+        return np.zeros(len(x))
+    if weights is None:
+        std = values.std(ddof=1) if n > 1 else 0.
+    else:
+        mean = np.average(values, weights=weights)
+        std = np.sqrt((weights * (values - mean) ** 2).sum() / (n - 1)) if n > 1 else 0.
+    if not std > 0:
+        distribution = np.zeros(len(x))
+        distribution[nearest_index(x, values[0])] = 1.
+        return distribution
+
+    bandwidth = bandwidth_factor(n, bw_method) * std
+    lo = min(values.min(), x.min()) - KERNEL_TRUNCATE * bandwidth
+    hi = max(values.max(), x.max()) + KERNEL_TRUNCATE * bandwidth
+    grid_size = int(np.clip((hi - lo) * GRID_POINTS_PER_BANDWIDTH / bandwidth, MIN_GRID_SIZE, MAX_GRID_SIZE))
+    delta = (hi - lo) / (grid_size - 1)
+
+    # linear binning: every value is split between its two neighbouring grid points
+    position = (values - lo) / delta
+    left = np.minimum(position.astype(np.int64), grid_size - 2)
+    weight = position - left
+    if weights is not None:
+        counts = np.bincount(left, weights=(1 - weight) * weights, minlength=grid_size) + \
+            np.bincount(left + 1, weights=weight * weights, minlength=grid_size)
+    else:
+        counts = np.bincount(left, weights=1 - weight, minlength=grid_size) + \
+            np.bincount(left + 1, weights=weight, minlength=grid_size)
+
+    half_width = int(min(grid_size - 1, np.ceil(KERNEL_TRUNCATE * bandwidth / delta)))
+    offsets = np.arange(-half_width, half_width + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (n * bandwidth * np.sqrt(2 * np.pi))
+    density = np.maximum(fftconvolve(counts, kernel, mode='same'), 0)
+    return np.interp(x, lo + np.arange(grid_size) * delta, density)
+
+
+def exact_kde(values, x, bw_method=None):
+    try:
+        return gaussian_kde(values, bw_method=bw_method)(x)
+    except LinAlgError:
+        return get_single_value_distribution(x, values)
+
+
+def kde(col, x, bw_method=None, method=None):
+    """
+    Gaussian kernel density estimate of a column, with the same bandwidth rules as scipy's gaussian_kde.
+    Constant columns get a distribution with all the mass at the point of x nearest to the value.
+    :param col: pd.Series of values
+    :param x: points the density is evaluated at
+    :param bw_method: None (Scott's rule), 'scott', 'silverman', or a scalar bandwidth factor
+    :param method: one of DENSITY_METHOD, the current default if None
+    """
+    method = method or density_settings['method']
+    x = np.asarray(x, dtype=np.float64)
+    if method == DENSITY_METHOD['EXACT']:
+        return exact_kde(col, x, bw_method=bw_method)
+    return binned_kde(np.asarray(col, dtype=np.float64), x, bw_method=bw_method)
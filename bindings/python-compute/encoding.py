@@ -0,0 +1,84 @@
+import base64
+import numpy as np
+from .constants import DATA_IDS_ENCODING
+
+
+DEFAULT_PAGE_SIZE = 10000
+
+
+def encode_array(arr, dtype=np.int32):
+    # little endian, as typed arrays on the frontend side
+    return base64.b64encode(np.ascontiguousarray(arr, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii')
+
+
+def decode_array(data, dtype=np.int32):
+    return np.frombuffer(base64.b64decode(data), dtype=np.dtype(dtype).newbyteorder('<'))
+
+
+# runs of consecutive values of sorted row indices, as (starts, lengths)
+def run_lengths(row_indices):
+    row_indices = np.asarray(row_indices, dtype=np.int64)
+    if len(row_indices) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(row_indices) != 1) + 1
+    starts = row_indices[np.concatenate([[0], breaks])]
+    lengths = np.diff(np.concatenate([[0], breaks, [len(row_indices)]]))
+    return starts, lengths
+
+
+def encode_rle(row_indices):
+    starts, lengths = run_lengths(row_indices)
+    return encode_array(np.column_stack([starts, lengths]).ravel())
+
+
+def encode_bitmap(row_indices, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[row_indices] = True
+    return base64.b64encode(np.packbits(mask, bitorder='little').tobytes()).decode('ascii')
+
+
+def decode_rows(encoded, n_rows=None):
+    """
+    Sorted row indices of an encoded segment membership
+    :param encoded: {'encoding': 'rle' or 'bitmap', 'data': base64 string}
+    :param n_rows: total number of rows, for bitmaps
+    """
+    if encoded['encoding'] == DATA_IDS_ENCODING['RLE']:
+        runs = decode_array(encoded['data']).reshape(-1, 2)
+        if len(runs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, start + length) for start, length in runs])
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(encoded['data']), dtype=np.uint8), bitorder='little')
+    return np.flatnonzero(bits[:n_rows])
+
+
+def encode_rows(row_indices, n_rows, encoding):
+    """
+    Compact membership of a segment, over the row indices of the data
+    :param row_indices: sorted row indices of the segment
+    :param n_rows: total number of rows
+    :param encoding: one of rle, bitmap or auto of DATA_IDS_ENCODING
+    :return: {'encoding': 'rle' or 'bitmap', 'data': base64 string}
+    """
+    if encoding == DATA_IDS_ENCODING['AUTO']:
+        # like roaring bitmaps, a bitmap for dense segments and runs for sparse or contiguous ones
+        n_runs = len(run_lengths(row_indices)[0])
+        encoding = DATA_IDS_ENCODING['RLE'] if n_runs * 8 <= (n_rows + 7) // 8 else DATA_IDS_ENCODING['BITMAP']
+    if encoding == DATA_IDS_ENCODING['RLE']:
+        return {'encoding': encoding, 'data': encode_rle(row_indices)}
+    if encoding == DATA_IDS_ENCODING['BITMAP']:
+        return {'encoding': encoding, 'data': encode_bitmap(row_indices, n_rows)}
+    raise ValueError('Unknown data ids encoding "{}"'.format(encoding))
+
+
+# segment index from either an index or a 'segment_<index>' id
+def parse_segment_id(segment_id):
+    if isinstance(segment_id, str):
+        return int(segment_id.rsplit('_', 1)[-1])
+    return int(segment_id)
+
+
+def get_page(items, offset=0, limit=DEFAULT_PAGE_SIZE):
+    offset = max(int(offset), 0)
+    end = len(items) if limit is None else min(offset + int(limit), len(items))
+    return items[offset: end]
@@ -1,107 +1,282 @@
+import threading
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-from scipy.stats.kde import gaussian_kde
 from scipy.stats import entropy
-from numpy.linalg import LinAlgError
 
 from .data_manager import DUMMY_PREFIX_SEP
 from .constants import RANGE_FILTER
+from .density import kde
+from .parallel import CancelToken, parallel_map
+from .instrumentation import span
 
 CLUSTER_COL = 'clusters'
 GROUP_ID_COL = 'clusterGroupId'
+CAT_DICT_JSON = 'cat_dict'
+FEATURES_META_DATA_JSON = 'features_meta_data'
 NUMERICAL_DOMAIN_INTERVAL = 100
-# index of nearest element in array to value
-nearest_index = lambda arr, val: (np.abs(arr - val)).argmin()
-# get a distribution where all densities are 0 except for the position of unique value (=1)
-def get_single_value_distribution(domain, raw_values):
-    unique_value = raw_values.unique()[0]
-    distribution = np.zeros(domain.shape)
-    distribution[nearest_index(domain, unique_value)] = 1.
-    return distribution
+NO_CATEGORY = 'NO_CATEGORY'
+OTHER_CATEGORY = 'OTHER_CATEGORY'
+# segment group of rows in neither of the two compared groups
+NO_GROUP = 2
+# maximum number of (row, feature) keys counted by a single bincount
+MAX_BINCOUNT_KEYS = 2 ** 24
+# numbers with fewer unique values than this are categorical
+CATEGORICAL_MAX_UNIQUE = 7
+UNIQUE_COUNT_BLOCK_ROWS = 65536
+MAX_META_DATA_ENTRIES = 100000
+# top k ranking: features are first ranked on histograms of this many bins, over a sample of this many rows
+PREFILTER_BINS = 32
+PREFILTER_SAMPLE_SIZE = 200000
+# number of candidates whose full distributions are computed, as a fraction of k and at least a minimum,
+# as the coarse ranking is approximate
+PREFILTER_MARGIN = 0.5
+MIN_PREFILTER_MARGIN = 10
+
+
+# group of every row from its segment id: 0 or 1 for the compared groups, NO_GROUP otherwise
+def compute_segment_groups(segment_ids, segment_group_0, segment_group_1):
+    segment_ids = np.asarray(segment_ids).astype(np.int64)
+    groups = [np.asarray(g, dtype=np.int64) for g in (segment_group_0, segment_group_1)]
+    n_ids = max([segment_ids.max() + 1 if len(segment_ids) else 0] + [g.max() + 1 for g in groups if len(g)])
+    lookup = np.full(n_ids, NO_GROUP, dtype=np.int8)
+    # rows of segments in both groups belong to group 0
+    lookup[groups[1]] = 1
+    lookup[groups[0]] = 0
+    return lookup[segment_ids]
+
+
+# integer codes of the categories of a column, and the category of every code; missing values are NO_CATEGORY
+def factorize_categories(col):
+    codes, uniques = pd.factorize(col)
+    labels = np.asarray(uniques)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels = np.append(labels.astype(object), NO_CATEGORY)
+    return codes, labels
+
+
+# divergence of the distributions of two segment groups, from (bins x groups) counts
+def count_divergence(counts, buffer):
+    counts = counts[:, :2].astype(np.float64)
+    ratios = counts / np.maximum(counts.sum(axis=0), 1)
+    return entropy(ratios[:, 0] + buffer, ratios[:, 1] + buffer)
+
+
+# coarse histogram of a numerical column, as (bins x 3) counts of rows per segment group
+def coarse_split_count(values, target, n_bins=PREFILTER_BINS):
+    values = np.asarray(values, dtype=np.float64)
+    is_valid = np.isfinite(values)
+    values, target = values[is_valid], target[is_valid]
+    if len(values) == 0:
+        return np.zeros((n_bins, 3), dtype=np.int64)
+    lo, hi = values.min(), values.max()
+    bins = np.zeros(len(values), dtype=np.int64) if hi <= lo else \
+        np.minimum(((values - lo) * (n_bins / (hi - lo))).astype(np.int64), n_bins - 1)
+    return np.bincount(bins * 3 + target, minlength=n_bins * 3).reshape(-1, 3)
+
+
+def count_unique_capped(values, cap, block_rows=UNIQUE_COUNT_BLOCK_ROWS):
+    # number of distinct values, counted block by block until there are cap of them; missing values count as one
+    seen = None
+    for start in range(0, len(values), block_rows):
+        block = pd.unique(values[start: start + block_rows])
+        seen = block if seen is None else pd.unique(np.concatenate([seen, block]))
+        if len(seen) >= cap:
+            return cap
+    return 0 if seen is None else len(seen)
+
+
+def is_categorical_col(col):
+    # if data type is non-number or has small number of unique values
+    if not pd.api.types.is_numeric_dtype(col.dtype):
+        return True
+    return count_unique_capped(col.values, CATEGORICAL_MAX_UNIQUE) < CATEGORICAL_MAX_UNIQUE
+
+
+def compute_categorical_features_dict(categorical_features):
+    cat_dict = {}
+    # create a dict of list, dict fields are categorical parent features,
+    # and list elements are parent feature names suffixed with category names
+    for c in categorical_features:
+        # in case of features are already one-hot encoded
+        c_split = c.split(DUMMY_PREFIX_SEP)
+        try:
+            cat_dict[c_split[0]]
+        except:
+            cat_dict[c_split[0]] = []
+        cat_dict[c_split[0]] += [c]
+    return cat_dict
+
+
+# meta data of a feature: its type and the distribution of its values; None for features not worth showing
+def compute_feature_meta_data(col, is_categorical):
+    if is_categorical:
+        value_counts = col.value_counts(dropna=False)
+        distribution = np.stack([value_counts.index.values, value_counts.values]).tolist()
+    else:
+        x = np.linspace(np.min(col), np.max(col), num=NUMERICAL_DOMAIN_INTERVAL)
+        distribution = np.stack([x, 10000*kde(col, x, bw_method=0.1)]).tolist()
+
+    if len(distribution[0]) <= 1 or \
+        len(distribution[0]) > max(len(col) / 10., 100):
+        return None
+
+    return {
+        'name': col.name,
+        'type': 'categorical' if is_categorical else 'numerical',
+        'distribution': distribution
+    }
+
+
+class FeaturesMetaCache(object):
+    """
+    Features meta data of a dataset, shared by the FeatureDifferentiation instances built on (filtered) rows of it.
+    Categorical features are detected once, on all rows. Meta data of a feature is computed when it is first
+    requested, and kept per (filter key, feature name); the meta data of all rows is also kept in the session
+    cache entry of the dataset, if any.
+    :param feature_df: all rows of the features
+    :param max_entries: maximum number of (filter key, feature name) entries, least recently used ones are evicted
+    """
+
+    def __init__(self, feature_df, categorical_features=None, cache_entry=None, max_entries=MAX_META_DATA_ENTRIES):
+        self.feature_df = feature_df
+        self.categorical_features = categorical_features
+        # only detected categorical features are stored in the session cache
+        self.cache_entry = cache_entry if categorical_features is None else None
+        self.max_entries = max_entries
+        self.cat_dict = None
+        self.lock = threading.Lock()
+        self.meta_data = OrderedDict()
+
+        if self.cache_entry is not None and self.cache_entry.has_json(CAT_DICT_JSON):
+            self.cat_dict = self.cache_entry.read_json(CAT_DICT_JSON)
+            self.categorical_features = [c for cc in self.cat_dict.values() for c in cc]
+        if self.cache_entry is not None and self.cache_entry.has_json(FEATURES_META_DATA_JSON):
+            features_list = {d['name']: d for d in self.cache_entry.read_json(FEATURES_META_DATA_JSON)}
+            for c in self.feature_df.columns:
+                self.meta_data[(None, c)] = features_list.get(c)
+
+
+    def get_cat_dict(self):
+        if self.cat_dict is None:
+            if self.categorical_features is None:
+                self.categorical_features = [c for c in self.feature_df.columns
+                                             if is_categorical_col(self.feature_df[c])]
+            self.cat_dict = compute_categorical_features_dict(self.categorical_features)
+            if self.cache_entry is not None:
+                self.cache_entry.write_json(CAT_DICT_JSON, self.cat_dict)
+        return self.cat_dict
+
+
+    def get_feature_meta_data(self, filter_key, col):
+        """
+        :param filter_key: key of the filter the rows of col are selected with, None for all rows
+        :param col: (filtered) values of the feature
+        """
+        key = (filter_key, col.name)
+        with self.lock:
+            if key in self.meta_data:
+                self.meta_data.move_to_end(key)
+                return self.meta_data[key]
+
+        meta_data = compute_feature_meta_data(col, col.name in self.get_cat_dict())
+        with self.lock:
+            self.meta_data[key] = meta_data
+            while len(self.meta_data) > self.max_entries:
+                self.meta_data.popitem(last=False)
+        return meta_data
+
+
+    def get_features_meta_data(self, filter_key, feature_df):
+        with span('features_meta_data', rows=len(feature_df)):
+            features_list = [self.get_feature_meta_data(filter_key, feature_df[c]) for c in feature_df.columns]
+        features_list = [d for d in features_list if d is not None]
+        if filter_key is None and self.cache_entry is not None \
+                and not self.cache_entry.has_json(FEATURES_META_DATA_JSON):
+            self.cache_entry.write_json(FEATURES_META_DATA_JSON, features_list)
+        return features_list
 
 
 class FeatureDifferentiation(object):
 
-    def __init__(self, feature_df, categorical_features=None):
-        self.feature_df = feature_df.copy()
-        self.categorical_features = categorical_features
-        self.cat_dict = self.compute_categorical_features_dict()
-        self.features_meta_data = self.compute_features_meta_data()
+    # cache_entry is a session cache entry of the (unfiltered) feature_df, to reuse features meta data across sessions
+    # n_workers: number of threads feature distributions are computed on, DEFAULT_N_WORKERS if None
+    # meta_cache: FeaturesMetaCache of the dataset feature_df is (filtered) rows of, to share features meta data
+    #   with other instances on the same dataset; filter_key is the key of the filter of these rows, None if unfiltered
+    def __init__(self, feature_df, categorical_features=None, cache_entry=None, n_workers=None,
+                 meta_cache=None, filter_key=None):
+        self.feature_df = feature_df
+        self.n_workers = n_workers
+        # cancellation of the computation of distributions of the last segment groups
+        self.cancel_token = CancelToken()
+        self.target = None
+        # <feature name -> (codes, labels)> of categorical features, computed on demand
+        self.category_codes = {}
+        # <feature name -> (labels, (categories x 3) counts of rows per segment group)>, for the current target
+        self.split_cat_counts = None
+        if meta_cache is None:
+            meta_cache = FeaturesMetaCache(feature_df, categorical_features=categorical_features,
+                                           cache_entry=cache_entry)
+        self.meta_cache = meta_cache
+        self.filter_key = filter_key
+        self.cat_dict = meta_cache.get_cat_dict()
+        self.categorical_features = meta_cache.categorical_features
 
 
     def set_params(self, segment_group_0, segment_group_1, segment_ids):
-        self.target = pd.Series([0 if i in segment_group_0 else (1 if i in segment_group_1 else 2)
-                                 for i in segment_ids])
-
-
-    def compute_categorical_features_dict(self):
-        if self.categorical_features is None:
-            # if data type is non-number or has small number of unique values
-            self.categorical_features = [c for c in self.feature_df.columns
-                            if len(self.feature_df[c].unique()) < 7 or self.feature_df.dtypes[c] == 'object']
-        cat_dict = {}
-        # create a dict of list, dict fields are categorical parent features,
-        # and list elements are parent feature names suffixed with category names
-        for c in self.categorical_features:
-            # in case of features are already one-hot encoded
-            c_split = c.split(DUMMY_PREFIX_SEP)
-            try:
-                cat_dict[c_split[0]]
-            except:
-                cat_dict[c_split[0]] = []
-            cat_dict[c_split[0]] += [c]
-        return cat_dict
-
-
-    # todo: merge histogram computation in compute_features_meta_data, compute_split_cat_count, compute_split_kde
-    def compute_features_meta_data(self):
-        features_list = []
-        for feature_name in self.feature_df.columns:
-            col = self.feature_df[feature_name]
-
-            if feature_name in self.cat_dict:
-                type = 'categorical'
-                value_counts = col.value_counts(dropna=False)
-                distribution = np.stack([value_counts.index.values, value_counts.values]).tolist()
-            else:
-                x = np.linspace(np.min(col), np.max(col), num=NUMERICAL_DOMAIN_INTERVAL)
-                try:
-                    kde = gaussian_kde(col, bw_method=0.1)
-                except LinAlgError:
-                    kde = lambda x: get_single_value_distribution(x, col)
-                distribution = np.stack([x, 10000*kde(x)]).tolist()
-
-            if len(distribution[0]) <= 1 or \
-                len(distribution[0]) > max(len(col) / 10., 100):
-                continue
-
-            feature_dict = {
-                'name': feature_name,
-                'type': 'categorical' if feature_name in self.cat_dict else 'numerical',
-                'distribution': distribution
-            }
-            features_list.append(feature_dict)
-        return features_list
-
+        # distributions of previous segment groups still being computed are not needed anymore
+        self.cancel()
+        self.cancel_token = CancelToken()
+        self.target = compute_segment_groups(segment_ids, segment_group_0, segment_group_1)
+        self.split_cat_counts = None
+
+
+    def get_category_codes(self, feature_name):
+        if feature_name not in self.category_codes:
+            self.category_codes[feature_name] = factorize_categories(self.feature_df[feature_name])
+        return self.category_codes[feature_name]
+
+
+    def compute_split_cat_counts(self):
+        # counts of (category, segment group) pairs of all categorical features, categories of every feature
+        # are offset to their own range of keys so that features are counted together by one bincount
+        names = [c for c in self.cat_dict if c in self.feature_df.columns]
+        target = self.target
+        n_rows = len(target)
+        block_size = max(MAX_BINCOUNT_KEYS // max(n_rows, 1), 1)
+        split_cat_counts = {}
+        for block_start in range(0, len(names), block_size):
+            block = names[block_start: block_start + block_size]
+            offsets = np.cumsum([0] + [len(self.get_category_codes(c)[1]) for c in block])
+            keys = np.concatenate([(self.get_category_codes(c)[0] + offsets[i]) * 3 + target
+                                   for i, c in enumerate(block)])
+            counts = np.bincount(keys, minlength=offsets[-1] * 3).reshape(-1, 3)
+            for i, c in enumerate(block):
+                split_cat_counts[c] = (self.get_category_codes(c)[1], counts[offsets[i]: offsets[i + 1]])
+        return split_cat_counts
+
+
+    def compute_split_cat_count(self, feature_name, exclude_outlier=False):
+        if self.split_cat_counts is None:
+            self.split_cat_counts = self.compute_split_cat_counts()
+        labels, counts = self.split_cat_counts[feature_name]
 
-    def compute_split_cat_count(self, col, exclude_outlier=False):
         if exclude_outlier:
-            cc = col.value_counts()
-            mask = col.isin(cc.index[cc < len(col) * .005])
-            col.loc[mask] = 'OTHER_CATEGORY'
+            # categories with less than 0.5% of the rows are merged into one
+            is_outlier = counts.sum(axis=1) < len(self.target) * .005
+            if is_outlier.any():
+                labels = np.append(labels[~is_outlier].astype(object), OTHER_CATEGORY)
+                counts = np.vstack([counts[~is_outlier], counts[is_outlier].sum(axis=0)])
 
-        cc0 = col[self.target == 0].value_counts(normalize=True, dropna=False)
-        cc1 = col[self.target == 1].value_counts(normalize=True, dropna=False)
-
-        count_df = pd.concat([cc0, cc1], axis=1).fillna(0)
-        count_df.columns = [0, 1]
-        count_df.index = count_df.index.fillna('NO_CATEGORY')
+        # only categories present in either group
+        present = (counts[:, 0] + counts[:, 1]) > 0
+        labels, counts = labels[present], counts[present, :2].astype(np.float64)
+        ratios = counts / np.maximum(counts.sum(axis=0), 1)
 
         buffer = 1. / float(len(self.target))
-        count_df['ratio'] = count_df.apply(lambda row: (row[0] + buffer) / (row[1] + buffer), axis=1)
-        count_df.sort_values('ratio', inplace=True)
-
-        return np.stack((count_df.index.values, 10000*count_df[0].values, 10000*count_df[1].values))
+        order = np.argsort((ratios[:, 0] + buffer) / (ratios[:, 1] + buffer), kind='stable')
+        return np.stack((labels[order], 10000*ratios[order, 0], 10000*ratios[order, 1]))
 
 
     def compute_split_kde(self, col, exclude_outlier=True):
@@ -109,27 +284,25 @@ class FeatureDifferentiation(object):
             col_value_range = RANGE_FILTER[col.name]
         except:
             if exclude_outlier:
-                col_value_range = [np.percentile(col, 1), np.percentile(col, 99)]
+                col_value_range = np.percentile(col, [1, 99])
             else:
                 col_value_range = [np.min(col), np.max(col)]
 
         x = np.linspace(col_value_range[0], col_value_range[1], num=NUMERICAL_DOMAIN_INTERVAL)
-        # could also use pd.Series.value_counts, (use bins)
-        # if unique values in array <=1, kde will have exception
-        try:
-            kde0 = gaussian_kde(col[self.target == 0], bw_method=0.1)
-        except LinAlgError:
-            kde0 = lambda x: get_single_value_distribution(x, col[self.target == 0])
-        try:
-            kde1 = gaussian_kde(col[self.target == 1], bw_method=0.1)
-        except LinAlgError:
-            kde1 = lambda x: get_single_value_distribution(x, col[self.target == 1])
+        # plain arrays, boolean selection of numpy arrays is much cheaper than of series
+        values, target = col.values, self.target
+        kde0 = kde(values[target == 0], x, bw_method=0.1)
+        kde1 = kde(values[target == 1], x, bw_method=0.1)
+        return np.stack((x, 10000*kde0, 10000*kde1))
 
-        return np.stack((x, 10000*kde0(x), 10000*kde1(x)))
 
+    def get_feature_meta_data(self, feature_name):
+        return self.meta_cache.get_feature_meta_data(self.filter_key, self.feature_df[feature_name])
 
+
+    # todo: merge histogram computation in features meta data, compute_split_cat_count, compute_split_kde
     def get_features_meta_data(self):
-        return self.features_meta_data
+        return self.meta_cache.get_features_meta_data(self.filter_key, self.feature_df)
 
 
     def get_feature_distribution_by_segment_group(self, feature_name):
@@ -137,7 +310,7 @@ class FeatureDifferentiation(object):
         main_name = feature_name.split(DUMMY_PREFIX_SEP)[0]
         distribution_dict['name'] = main_name
         if main_name in self.cat_dict:
-            distribution_dict['distribution'] = self.compute_split_cat_count(self.feature_df[main_name]).tolist()
+            distribution_dict['distribution'] = self.compute_split_cat_count(main_name).tolist()
             distribution_dict['type'] = 'categorical'
         else:
             distribution_dict['distribution'] = self.compute_split_kde(self.feature_df[main_name]).tolist()
@@ -145,21 +318,78 @@ class FeatureDifferentiation(object):
         return distribution_dict
 
 
-    def get_features_distribution_by_segment_group(self):
-        distribution_list = []
+    def cancel(self):
+        self.cancel_token.cancel()
+
+
+    def compute_coarse_divergences(self, feature_names, cancel_token):
+        # cheap divergence scores, from the exact counts of categorical features and coarse histograms
+        # of a sample of rows of numerical ones
+        n_rows = len(self.target)
+        rows = None
+        if n_rows > PREFILTER_SAMPLE_SIZE:
+            rows = np.sort(np.random.RandomState(0).choice(n_rows, PREFILTER_SAMPLE_SIZE, replace=False))
+        target = self.target if rows is None else self.target[rows]
+        buffer = 1. / float(len(target))
+
+        def compute_score(feature_name):
+            main_name = feature_name.split(DUMMY_PREFIX_SEP)[0]
+            if main_name in self.cat_dict:
+                counts = self.split_cat_counts[main_name][1]
+                n_categories = ((counts[:, 0] + counts[:, 1]) > 0).sum()
+                # features the full ranking ignores
+                if n_categories <= 1 or n_categories > max(n_rows / 10., 100):
+                    return -np.inf
+            else:
+                values = self.feature_df[main_name].values
+                counts = coarse_split_count(values if rows is None else values[rows], target)
+            return count_divergence(counts, buffer)
+
+        return np.array(parallel_map(compute_score, feature_names, n_workers=self.n_workers,
+                                     cancel_token=cancel_token))
+
+
+    def get_features_distribution_by_segment_group(self, top_k=None):
+        """
+        Distributions of features in the two segment groups, sorted by decreasing divergence.
+        Features are computed in parallel; concurrent.futures.CancelledError is raised if set_params
+        or cancel is called before they are all computed.
+        :param top_k: only return the k features of largest divergence; features are first ranked on coarse
+            histograms, and full distributions are only computed for the best candidates
+        """
+        cancel_token = self.cancel_token
         buffer = 1. / float(len(self.target))
-
-        for feature_name in self.feature_df.columns:
+        if self.split_cat_counts is None:
+            with span('split_cat_counts', rows=len(self.target)):
+                self.split_cat_counts = self.compute_split_cat_counts()
+
+        feature_names = list(self.feature_df.columns)
+        if top_k is not None:
+            n_candidates = top_k + max(int(np.ceil(top_k * PREFILTER_MARGIN)), MIN_PREFILTER_MARGIN)
+            if n_candidates < len(feature_names):
+                with span('coarse_ranking', rows=len(self.target)):
+                    scores = self.compute_coarse_divergences(feature_names, cancel_token)
+                candidates = np.sort(np.argsort(-scores, kind='stable')[:n_candidates])
+                feature_names = [feature_names[i] for i in candidates if scores[i] > -np.inf]
+
+        def compute_feature(feature_name):
             distribution_dict = self.get_feature_distribution_by_segment_group(feature_name)
 
             # ignore features with too may categories, like uuid; ignore features with only one category
             if len(distribution_dict['distribution'][0]) <= 1 or \
                 len(distribution_dict['distribution'][0]) > max(len(self.target) / 10., 100):
-                continue
+                return None
 
             distribution_dict['divergence'] =  entropy(
                 np.array(distribution_dict['distribution'][1]) + buffer,
                 np.array(distribution_dict['distribution'][2]) + buffer
             )
-            distribution_list.append(distribution_dict)
-        return sorted(distribution_list, key=lambda x: x['divergence'], reverse=True)
+            return distribution_dict
+
+        with span('feature_distributions', rows=len(self.target)):
+            distribution_list = parallel_map(compute_feature, feature_names,
+                                             n_workers=self.n_workers, cancel_token=cancel_token)
+        cancel_token.raise_if_cancelled()
+        # the sort is stable, features of equal divergence stay in column order
+        distribution_list = [d for d in distribution_list if d is not None]
+        return sorted(distribution_list, key=lambda x: x['divergence'], reverse=True)[:top_k]
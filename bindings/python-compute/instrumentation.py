@@ -0,0 +1,211 @@
+import io
+import time
+import functools
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+PROMETHEUS_PREFIX = 'manifold_span'
+
+# sinks every finished span is sent to; spans are only timed, and not sent anywhere, while there is none
+sinks = []
+local = threading.local()
+
+
+class Span(object):
+    """
+    A timed stage of a computation. Spans opened within another span on the same thread are its children,
+    their path is the path of the parent followed by their name, e.g. 'load_data/read'.
+    :param rows: number of rows processed, set by the instrumented code if known
+    :param result_bytes: size in bytes of the result of the stage, e.g. a mask or a response body, set by the
+        instrumented code if known; it is not the memory allocated by the stage, see profile for that
+    """
+
+    def __init__(self, name, parent=None, rows=None, result_bytes=None):
+        self.name = name
+        self.path = name if parent is None else parent.path + '/' + name
+        self.rows = rows
+        self.result_bytes = result_bytes
+        self.seconds = None
+        self.error = None
+
+
+    def to_dict(self):
+        return OrderedDict([
+            ('span', self.path),
+            ('seconds', self.seconds),
+            ('rows', self.rows),
+            ('resultBytes', self.result_bytes),
+            ('error', self.error)
+        ])
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    sinks.remove(sink)
+
+
+@contextmanager
+def span(name, rows=None, result_bytes=None):
+    """
+    Times the enclosed block, e.g.
+        with span('cluster', rows=len(df)) as s:
+            ...
+            s.result_bytes = labels.nbytes
+    """
+    stack = getattr(local, 'stack', None)
+    if stack is None:
+        stack = local.stack = []
+    current = Span(name, parent=stack[-1] if stack else None, rows=rows, result_bytes=result_bytes)
+    stack.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start
+        stack.pop()
+        for sink in list(sinks):
+            sink(current)
+
+
+# runs the decorated function in a span
+def instrumented(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LoggingSink(object):
+    # logs every span as one line
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+
+
+    def __call__(self, s):
+        self.logger.log(self.level, 'span %s: %.3fs rows=%s result_bytes=%s%s', s.path, s.seconds, s.rows,
+                        s.result_bytes, '' if s.error is None else ' error=' + s.error)
+
+
+class CallbackSink(object):
+    # calls a function with the dict of every span, e.g. to forward them to a metrics client
+    def __init__(self, callback):
+        self.callback = callback
+
+
+    def __call__(self, s):
+        self.callback(s.to_dict())
+
+
+class PrometheusSink(object):
+    """
+    Totals of the spans by path, rendered in the Prometheus text exposition format, e.g. by a /metrics handler
+    """
+
+    def __init__(self, prefix=PROMETHEUS_PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        # <path -> [calls, errors, seconds, rows, result bytes]>
+        self.totals = OrderedDict()
+
+
+    def __call__(self, s):
+        with self.lock:
+            totals = self.totals.setdefault(s.path, [0, 0, 0., 0, 0])
+            totals[0] += 1
+            totals[1] += s.error is not None
+            totals[2] += s.seconds
+            totals[3] += s.rows or 0
+            totals[4] += s.result_bytes or 0
+
+
+    def render(self):
+        metrics = [
+            ('calls_total', 'counter', 'Number of spans'),
+            ('errors_total', 'counter', 'Number of spans that raised an exception'),
+            ('seconds_total', 'counter', 'Total wall time of spans in seconds'),
+            ('rows_total', 'counter', 'Total number of rows processed by spans'),
+            ('result_bytes_total', 'counter', 'Total size in bytes of the results of spans'),
+        ]
+        with self.lock:
+            items = [(path, list(totals)) for path, totals in self.totals.items()]
+        lines = []
+        for i, (name, metric_type, help_text) in enumerate(metrics):
+            metric = '{}_{}'.format(self.prefix, name)
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} {}'.format(metric, metric_type))
+            for path, totals in items:
+                lines.append('{}{{span="{}"}} {}'.format(metric, path.replace('"', '\\"'), totals[i]))
+        return '\n'.join(lines) + '\n'
+
+
+class Profile(object):
+    """
+    cProfile statistics and tracemalloc allocations of a block of code, see profile
+    """
+
+    def __init__(self):
+        self.stats_text = None
+        self.peak_bytes = None
+        self.top_allocations = None
+        self.spans = []
+
+
+    def to_dict(self):
+        return {
+            'stats': self.stats_text,
+            'peakBytes': self.peak_bytes,
+            'topAllocations': self.top_allocations,
+            'spans': [s.to_dict() for s in self.spans]
+        }
+
+
+@contextmanager
+def profile(sort='cumulative', n_functions=40, trace_memory=True, n_allocations=20):
+    """
+    Profiles the enclosed block, e.g. a single request:
+        with profile() as p:
+            session.get_models_performance_by_segment(...)
+        print(p.stats_text)
+    Both cProfile and tracemalloc slow down the code, they are meant for one-off captures.
+    cProfile only profiles the calling thread; spans of all threads are collected.
+    """
+    result = Profile()
+    profiler = cProfile.Profile()
+    spans_sink = add_sink(result.spans.append)
+    was_tracing = tracemalloc.is_tracing()
+    if trace_memory and not was_tracing:
+        tracemalloc.start()
+    elif trace_memory and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        remove_sink(spans_sink)
+        if trace_memory:
+            _, result.peak_bytes = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            result.top_allocations = [str(stat) for stat in snapshot.statistics('lineno')[:n_allocations]]
+            if not was_tracing:
+                tracemalloc.stop()
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(n_functions)
+        result.stats_text = stream.getvalue()
@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .main import ServiceSession
+
+
+JOB_KIND = {
+    'LOAD_DATA': 'load_data',
+    'PERFORMANCE': 'performance',
+    'FEATURES': 'features',
+    'META_DATA': 'meta_data',
+    'DATA_IDS': 'data_ids'
+}
+# kinds of jobs whose results a job depends on; a job is obsolete once any of them is superseded
+JOB_DEPENDENCIES = {
+    JOB_KIND['LOAD_DATA']: [],
+    JOB_KIND['PERFORMANCE']: [JOB_KIND['LOAD_DATA']],
+    JOB_KIND['FEATURES']: [JOB_KIND['LOAD_DATA'], JOB_KIND['PERFORMANCE']],
+    JOB_KIND['META_DATA']: [JOB_KIND['LOAD_DATA']],
+    JOB_KIND['DATA_IDS']: [JOB_KIND['LOAD_DATA'], JOB_KIND['PERFORMANCE']]
+}
+
+
+class JobQueue(object):
+    """
+    Jobs of a session, run one after another on a single worker thread, in the order they are submitted,
+    so that a job sees the state left by the jobs it depends on. Submitting a job supersedes the previous
+    job of the same kind: it is cancelled if it hasn't started, or asked to stop with its on_cancel callback
+    if it is running; pending jobs depending on a superseded kind are cancelled as well.
+    Results are concurrent.futures.Future; wrap them with asyncio.wrap_future to await them.
+    """
+
+    def __init__(self, dependencies=JOB_DEPENDENCIES):
+        self.dependencies = dependencies
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        # <kind -> (future, on_cancel)> of the last job of every kind
+        self.jobs = {}
+
+
+    def supersede(self, kind):
+        future, on_cancel = self.jobs.get(kind, (None, None))
+        if future is not None and not future.done() and not future.cancel() and on_cancel is not None:
+            on_cancel()
+        for k, deps in self.dependencies.items():
+            if kind in deps:
+                future, _ = self.jobs.get(k, (None, None))
+                # only jobs which haven't started are obsolete, running ones already saw the new state
+                if future is not None:
+                    future.cancel()
+
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        :param kind: kind of the job, a key of the dependencies
+        :param func: function run by the job with args and kwargs
+        :param on_cancel: optional keyword argument, called to stop the job if it is superseded while running
+        :param supersede: optional keyword argument, False for jobs that don't supersede the previous ones of
+            their kind, e.g. fetching different pages of a result
+        :return: future of the result of func
+        """
+        on_cancel = kwargs.pop('on_cancel', None)
+        supersede = kwargs.pop('supersede', True)
+        with self.lock:
+            if supersede:
+                self.supersede(kind)
+            future = self.executor.submit(func, *args, **kwargs)
+            self.jobs[kind] = (future, on_cancel)
+        return future
+
+
+    # finalizer: optional function run once the running job is done, e.g. to release resources it uses
+    def shutdown(self, wait=True, finalizer=None):
+        with self.lock:
+            for future, _ in self.jobs.values():
+                future.cancel()
+            if finalizer is not None:
+                self.executor.submit(finalizer)
+        self.executor.shutdown(wait=wait)
+
+
+class AsyncServiceSession(object):
+    """
+    ServiceSession whose methods return futures. Jobs run in the order of the requests, e.g. feature
+    distributions of segment groups after the segmentation they refer to, and a newer request supersedes
+    an older one of the same kind, so that requests fired while e.g. dragging a slider don't pile up.
+    Superseded requests resolve with concurrent.futures.CancelledError.
+    """
+
+    def __init__(self, service_session=None, **kwargs):
+        self.service_session = service_session if service_session is not None else ServiceSession(**kwargs)
+        self.job_queue = JobQueue()
+
+
+    def cancel_features(self):
+        if self.service_session.feature_differentiation is not None:
+            self.service_session.feature_differentiation.cancel()
+
+
+    def load_data(self, feature_dataset=None, pred_datasets=None, data_filter=None):
+        return self.job_queue.submit(JOB_KIND['LOAD_DATA'], self.service_session.load_data,
+                                     feature_dataset, pred_datasets, data_filter)
+
+
+    def load_frames(self, feature_df, pred_dfs, data_filter=None):
+        return self.job_queue.submit(JOB_KIND['LOAD_DATA'], self.service_session.load_frames,
+                                     feature_df, pred_dfs, data_filter)
+
+
+    def get_meta_data(self):
+        return self.job_queue.submit(JOB_KIND['META_DATA'], self.service_session.get_meta_data)
+
+
+    def get_models_performance_by_segment(self, n_clusters, metric, base_models, segment_filters, **kwargs):
+        return self.job_queue.submit(JOB_KIND['PERFORMANCE'], self.service_session.get_models_performance_by_segment,
+                                     n_clusters, metric, base_models, segment_filters, **kwargs)
+
+
+    def get_features_distribution_by_segment_group(self, segment_group_0, segment_group_1, **kwargs):
+        return self.job_queue.submit(JOB_KIND['FEATURES'],
+                                     self.service_session.get_features_distribution_by_segment_group,
+                                     segment_group_0, segment_group_1, on_cancel=self.cancel_features, **kwargs)
+
+
+    def get_segment_data_ids(self, segment_id, **kwargs):
+        return self.job_queue.submit(JOB_KIND['DATA_IDS'], self.service_session.get_segment_data_ids,
+                                     segment_id, supersede=False, **kwargs)
+
+
+    def get_encoded_segment_ids(self):
+        return self.job_queue.submit(JOB_KIND['DATA_IDS'], self.service_session.get_encoded_segment_ids,
+                                     supersede=False)
+
+
+    # cancels pending jobs, and closes the session once the running one is done
+    def shutdown(self, wait=True):
+        self.cancel_features()
+        self.job_queue.shutdown(wait=wait, finalizer=self.service_session.close)
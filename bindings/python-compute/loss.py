@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# smallest probability used when taking logs of predicted probabilities, the float64 machine epsilon sklearn's log_loss clips to
+PROB_CLIP_EPS = np.finfo(np.float64).eps
+
+CLASSIFICATION_LOSS = 'log_loss'
+REGRESSION_LOSS = 'squared_log_error'
+
+# registry of per-instance loss functions, <loss name -> function>
+# every function takes a (rows x models x classes) prediction array and a (rows x models) target array,
+# and returns a (rows x models) loss array. For regression the class axis has length 1.
+LOSS_FUNCS = {}
+
+
+def register_loss_func(name, func):
+    LOSS_FUNCS[name] = func
+    return func
+
+
+def get_loss_func(name):
+    try:
+        return LOSS_FUNCS[name]
+    except KeyError:
+        raise ValueError('Unknown loss function "{}", available ones are: {}'.format(
+            name, ', '.join(sorted(LOSS_FUNCS))))
+
+
+def default_loss_name(n_classes):
+    return CLASSIFICATION_LOSS if n_classes > 1 else REGRESSION_LOSS
+
+
+# probability assigned to the true class of each row, for each model
+def gather_true_class_prob(pred_array, target_array):
+    n_classes = pred_array.shape[2]
+    labels = target_array.astype(np.int64)
+    if np.any((labels < 0) | (labels >= n_classes)) or np.any(labels != target_array):
+        raise ValueError('Target labels must be integers in range [0, {})'.format(n_classes))
+    return np.take_along_axis(pred_array, labels[:, :, np.newaxis], axis=2)[:, :, 0]
+
+
+def one_hot_targets(target_array, n_classes):
+    return (target_array[:, :, np.newaxis] == np.arange(n_classes)).astype(np.float64)
+
+
+def cross_entropy(pred_array, target_array):
+    # clip, then re-normalize each row so that unnormalized predictions are read as probabilities. This matches
+    # sklearn's log_loss for normalized predictions only: recent sklearn versions clip without re-normalizing
+    probs = np.clip(pred_array, PROB_CLIP_EPS, 1 - PROB_CLIP_EPS)
+    probs = probs / probs.sum(axis=2, keepdims=True)
+    return -np.log(gather_true_class_prob(probs, target_array))
+
+
+def squared_log_error(pred_array, target_array):
+    pred = pred_array[:, :, 0]
+    if np.any(pred < 0) or np.any(target_array < 0):
+        raise ValueError('Mean Squared Logarithmic Error cannot be used when targets contain negative values.')
+    return (np.log1p(target_array) - np.log1p(pred)) ** 2
+
+
+def absolute_error(pred_array, target_array):
+    if pred_array.shape[2] > 1:
+        # for classification, distance between the true class probability and certainty
+        return 1 - gather_true_class_prob(pred_array, target_array)
+    return np.abs(target_array - pred_array[:, :, 0])
+
+
+def hinge(pred_array, target_array):
+    if pred_array.shape[2] > 1:
+        # multi-class hinge loss (Crammer-Singer), margin between true class and best other class
+        true_prob = gather_true_class_prob(pred_array, target_array)
+        others = np.where(one_hot_targets(target_array, pred_array.shape[2]) > 0, -np.inf, pred_array)
+        margin = true_prob - others.max(axis=2)
+    else:
+        # binary hinge loss, {0, 1} targets are mapped to {-1, 1}
+        margin = np.where(target_array > 0, 1., -1.) * pred_array[:, :, 0]
+    return np.maximum(0, 1 - margin)
+
+
+def brier(pred_array, target_array):
+    if pred_array.shape[2] > 1:
+        return ((pred_array - one_hot_targets(target_array, pred_array.shape[2])) ** 2).sum(axis=2)
+    return (pred_array[:, :, 0] - target_array) ** 2
+
+
+register_loss_func(CLASSIFICATION_LOSS, cross_entropy)
+register_loss_func(REGRESSION_LOSS, squared_log_error)
+register_loss_func('absolute_error', absolute_error)
+register_loss_func('hinge', hinge)
+register_loss_func('brier', brier)
+
+
+def compute_loss_array(pred_array, target_array, loss_name=None):
+    if loss_name is None:
+        loss_name = default_loss_name(pred_array.shape[2])
+    pred_array = np.asarray(pred_array, dtype=np.float64)
+    target_array = np.asarray(target_array, dtype=np.float64)
+    return get_loss_func(loss_name)(pred_array, target_array)
@@ -1,10 +1,27 @@
-from performance_comparison import PerformanceComparison
-from feature_differentiation import FeatureDifferentiation
-from data_manager import DataManager, UUID_COL
+from .performance_comparison import PerformanceComparison
+from .feature_differentiation import FeatureDifferentiation, FeaturesMetaCache
+from .data_manager import DataManager, UUID_COL
+from .constants import DATA_IDS_ENCODING
+from .encoding import DEFAULT_PAGE_SIZE
+from .instrumentation import instrumented, profile
+from .streaming import StreamingDataManager, StreamingPerformanceComparison, StreamingFeatureDifferentiation
 
 
 class ServiceSession(object):
-    def __init__(self):
+    # session_cache: optional SessionCache, to reuse data precomputed by earlier sessions on the same datasets
+    # streaming: stream datasets in blocks of rows instead of loading them, for datasets larger than memory
+    # clustering_config: ClusteringConfig of the segmentation, e.g. ClusteringConfig.from_preset('fast')
+    # n_workers: number of threads features are compared on, DEFAULT_N_WORKERS if None
+    # dataset_registry: optional DatasetRegistry, to share loaded datasets with the sessions of other clients
+    def __init__(self, session_cache=None, streaming=False, clustering_config=None, n_workers=None,
+                 dataset_registry=None):
+        self.session_cache = session_cache
+        self.streaming = streaming
+        self.clustering_config = clustering_config
+        self.n_workers = n_workers
+        self.dataset_registry = dataset_registry
+        # SharedDataset of the registry this session holds a reference to
+        self.shared_dataset = None
         self.data_sets = {
             'feature_dataset': None,
             'pred_datasets': None
@@ -13,41 +30,115 @@ class ServiceSession(object):
         self.data_manager = None
         self.performance_comparison = None
         self.feature_differentiation = None
+        # features meta data of the loaded datasets, shared by FeatureDifferentiation of any filter
+        self.features_meta_cache = None
 
 
+    @instrumented('load_data')
     def load_data(self, feature_dataset=None, pred_datasets=None, data_filter=None):
         if not self.should_reload_data(feature_dataset, pred_datasets) \
             and not self.should_reapply_filter(data_filter):
             return
 
         # rebuild DataManager if data sources change
-        if self.should_reload_data(feature_dataset, pred_datasets):
+        is_reloaded = self.should_reload_data(feature_dataset, pred_datasets)
+        if is_reloaded:
             self.data_sets = {
                 'feature_dataset': feature_dataset,
                 'pred_datasets': pred_datasets
             }
-            self.data_manager = DataManager(feature_dataset, pred_datasets)
+            if self.streaming:
+                self.data_manager = StreamingDataManager(feature_dataset, pred_datasets)
+            elif self.dataset_registry is not None:
+                self.release_data()
+                self.shared_dataset = self.dataset_registry.acquire(feature_dataset, pred_datasets)
+                # filters are per session, data and caches are shared
+                self.data_manager = self.shared_dataset.data_manager.view()
+                self.features_meta_cache = self.shared_dataset.features_meta_cache
+            else:
+                self.data_manager = DataManager(feature_dataset, pred_datasets, session_cache=self.session_cache)
+                self.features_meta_cache = FeaturesMetaCache(
+                    self.data_manager.feature_df, cache_entry=self.data_manager.cache_entry)
+        self.apply_filter(data_filter, is_reloaded=is_reloaded)
+
+
+    @instrumented('load_frames')
+    def load_frames(self, feature_df, pred_dfs, data_filter=None):
+        """
+        Loads datasets already in memory instead of files, e.g. data frames of a notebook
+        :param feature_df: DataFrame in the format of the feature dataset, with a uuid column
+        :param pred_dfs: list of DataFrames in the format of the prediction datasets, one per model
+        """
+        if self.streaming:
+            raise ValueError('Only datasets read from files can be streamed')
+        self.release_data()
+        # the next load_data with datasets reloads them
+        self.data_sets = {
+            'feature_dataset': None,
+            'pred_datasets': None
+        }
+        self.data_manager = DataManager.from_datasets(feature_df, pred_dfs)
+        self.features_meta_cache = FeaturesMetaCache(self.data_manager.feature_df)
+        self.apply_filter(data_filter, is_reloaded=True)
 
+
+    # rebuild PerformanceComparison and FeatureDifferentiation if data sources or filtered rows change
+    def apply_filter(self, data_filter, is_reloaded=False):
         if self.data_manager is None:
             return
 
-        # rebuild PerformanceComparison and FeatureDifferentiation if data sources or filters change
         self.data_filter = data_filter
-        self.data_manager.set_filters(filters=data_filter)
+        is_filter_changed = self.data_manager.set_filters(filters=data_filter)
+        if not is_reloaded and not is_filter_changed and self.performance_comparison is not None:
+            return
+        # todo: allow users to set model names
+        n_models = self.data_manager.get_models_meta_data()['nModels']
+        model_meta = {'model_' + str(i): 'model_' + str(i) for i in range(n_models)}
+
+        if self.feature_differentiation is not None:
+            self.feature_differentiation.cancel()
+        if self.streaming:
+            self.performance_comparison = StreamingPerformanceComparison(self.data_manager, model_meta=model_meta)
+            self.feature_differentiation = StreamingFeatureDifferentiation(self.data_manager)
+            return
+
         pred_df = self.data_manager.get_pred_df()
         loss_df = self.data_manager.get_loss_df()
         feature_df = self.data_manager.get_feature_df()
-        # todo: allow users to set model names
-        n_models = self.data_manager.get_models_meta_data()['nModels']
 
         self.performance_comparison = PerformanceComparison(
             pred_df,
             loss_df,
             feature_df,
             uuid=feature_df[UUID_COL].values,
-            model_meta={'model_' + str(i): 'model_' + str(i) for i in range(n_models)}
+            model_meta=model_meta,
+            clustering_config=self.clustering_config
         )
-        self.feature_differentiation = FeatureDifferentiation(feature_df)
+        self.feature_differentiation = FeatureDifferentiation(
+            feature_df, n_workers=self.n_workers,
+            meta_cache=self.features_meta_cache, filter_key=self.data_manager.filter_key)
+
+
+    # release the reference to the shared dataset, if any
+    def release_data(self):
+        if self.shared_dataset is not None:
+            self.dataset_registry.release(self.shared_dataset)
+            self.shared_dataset = None
+
+
+    def close(self):
+        if self.feature_differentiation is not None:
+            self.feature_differentiation.cancel()
+        self.release_data()
+        self.data_manager = None
+        self.performance_comparison = None
+        self.feature_differentiation = None
+        self.features_meta_cache = None
+        self.data_filter = None
+        self.data_sets = {
+            'feature_dataset': None,
+            'pred_datasets': None
+        }
 
 
     def should_reload_data(self, feature_dataset, pred_datasets):
@@ -65,6 +156,7 @@ class ServiceSession(object):
         return self.data_filter != data_filter
 
 
+    @instrumented('get_meta_data')
     def get_meta_data(self):
         if self.data_manager is None or self.feature_differentiation is None:
             return None
@@ -74,7 +166,10 @@ class ServiceSession(object):
         }
 
 
-    def get_models_performance_by_segment(self, n_clusters, metric, base_models, segment_filters):
+    # data_ids_encoding: one of DATA_IDS_ENCODING, how the membership of segments is sent
+    @instrumented('get_models_performance_by_segment')
+    def get_models_performance_by_segment(self, n_clusters, metric, base_models, segment_filters,
+                                          data_ids_encoding=DATA_IDS_ENCODING['LIST']):
         if self.performance_comparison is None:
             return None
 
@@ -84,16 +179,31 @@ class ServiceSession(object):
             base_models=base_models,
             segment_filters=segment_filters
         )
-        return self.performance_comparison.get_models_performance_by_segment()
+        return self.performance_comparison.get_models_performance_by_segment(data_ids_encoding=data_ids_encoding)
+
+
+    def get_segment_data_ids(self, segment_id, offset=0, limit=DEFAULT_PAGE_SIZE):
+        if self.performance_comparison is None or self.performance_comparison.get_segment_ids() is None:
+            return None
+        return self.performance_comparison.get_segment_data_ids(segment_id, offset=offset, limit=limit)
+
+
+    # segment id of every row as a base64 int32 vector, the most compact membership for many segments
+    def get_encoded_segment_ids(self):
+        if self.performance_comparison is None or self.performance_comparison.get_segment_ids() is None:
+            return None
+        return self.performance_comparison.get_encoded_segment_ids()
 
 
-    def get_features_distribution_by_segment_group(self, segment_group_0, segment_group_1):
+    # top_k: only return the k most differentiating features, all of them if None
+    @instrumented('get_features_distribution_by_segment_group')
+    def get_features_distribution_by_segment_group(self, segment_group_0, segment_group_1, top_k=None):
         if self.performance_comparison is None or self.feature_differentiation is None:
             return None
 
         segment_ids = self.performance_comparison.get_segment_ids()
 
-        # use async to wait for computation to finish
+        # segments are not computed yet; AsyncServiceSession runs this after the segmentation requested before it
         if segment_ids is None:
             return None
 
@@ -102,4 +212,15 @@ class ServiceSession(object):
             segment_group_1=segment_group_1,
             segment_ids=segment_ids
         )
-        return self.feature_differentiation.get_features_distribution_by_segment_group()
\ No newline at end of file
+        return self.feature_differentiation.get_features_distribution_by_segment_group(top_k=top_k)
+
+
+    def profile(self, method, *args, **kwargs):
+        """
+        Runs a single request with cProfile and tracemalloc
+        :param method: name of the method of the request, e.g. 'get_models_performance_by_segment'
+        :return: (result of the method, instrumentation.Profile)
+        """
+        with profile() as p:
+            result = getattr(self, method)(*args, **kwargs)
+        return result, p
@@ -0,0 +1,67 @@
+import json
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from .utils import compute_filter_mask
+
+
+DEFAULT_MASK_CACHE_BYTES = 256 * 1024 * 1024
+
+
+# canonical hash of a filter dict, independent of key order
+def filter_hash(f):
+    return hashlib.sha1(json.dumps(f, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+class FilterMaskCache(object):
+    """
+    LRU cache of boolean masks, one per filter dict, bounded by the total bytes of the cached masks.
+    Changing one filter of a filter list only computes the mask of that filter,
+    the masks of the other filters are taken from the cache.
+    The cache may be shared by the sessions of several clients on the same data, it is thread safe.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MASK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get_mask(self, f, full_df):
+        key = filter_hash(f)
+        with self.lock:
+            if key in self.masks:
+                self.masks.move_to_end(key)
+                return self.masks[key]
+
+        # computed outside of the lock, other filters are not blocked meanwhile
+        mask = compute_filter_mask(f, full_df)
+        mask.setflags(write=False)
+        with self.lock:
+            if key not in self.masks:
+                self.masks[key] = mask
+                self.n_bytes += mask.nbytes
+                self.evict()
+        return mask
+
+
+    def compute_filter(self, filters, full_df):
+        result = np.ones(len(full_df), dtype=bool)
+        for f in filters:
+            result &= self.get_mask(f, full_df)
+        return result
+
+
+    def evict(self):
+        # always keep the most recently used mask, even if it alone exceeds the limit
+        while self.n_bytes > self.max_bytes and len(self.masks) > 1:
+            _, mask = self.masks.popitem(last=False)
+            self.n_bytes -= mask.nbytes
+
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+            self.n_bytes = 0
@@ -0,0 +1,59 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+# numpy releases the GIL in most of the per-feature work (sorting, binning, convolutions), so threads
+# run it concurrently while sharing the column store, without copying columns to worker processes
+DEFAULT_N_WORKERS = min(8, os.cpu_count() or 1)
+
+
+class CancelToken(object):
+    """
+    Cancellation flag of a computation, checked by the computation between units of work
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+    def cancel(self):
+        self.event.set()
+
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise CancelledError()
+
+
+def parallel_map(func, items, n_workers=None, cancel_token=None):
+    """
+    Results of func on every item, in the order of the items whatever the order they are computed in
+    :param n_workers: number of worker threads, DEFAULT_N_WORKERS if None; items are mapped in the calling
+        thread if 1
+    :param cancel_token: CancelToken checked before every item; CancelledError is raised once it is cancelled
+    """
+    items = list(items)
+    n_workers = DEFAULT_N_WORKERS if n_workers is None else n_workers
+
+    def run(item):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        return func(item)
+
+    if n_workers <= 1 or len(items) <= 1:
+        return [run(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(n_workers, len(items))) as executor:
+        futures = [executor.submit(run, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            # don't start the remaining items, e.g. once cancelled
+            for future in futures:
+                future.cancel()
+            raise
@@ -1,18 +1,28 @@
 import numpy as np
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering, KMeans
-from scipy.stats.kde import gaussian_kde
 from .utils import compute_filter
+from .column_store import join_frames
+from .density import kde
+from .instrumentation import span
+from .constants import DATA_IDS_ENCODING
+from .encoding import DEFAULT_PAGE_SIZE, encode_array, encode_rows, get_page, parse_segment_id
+from .clustering import ClusteringConfig, HierarchicalClustering, CLUSTERING_METHOD, compute_clusters
 
 
 percentile_list = [1, 10, 25, 50, 75, 90, 99]
-percentiles_func = lambda x: [np.percentile(x, p) for p in percentile_list]
+
+
+# row order grouping rows by segment, and offsets of the segments in that order
+def group_by_segment(segment_ids, n_segments):
+    segment_ids = np.asarray(segment_ids).astype(np.int64)
+    order = np.argsort(segment_ids, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(segment_ids, minlength=n_segments)[:n_segments])])
+    return order, offsets
 
 
 def density_func(col):
     x = np.linspace(np.min(col), np.max(col), num=100)
-    kde = gaussian_kde(col)
-    return [x.tolist(), kde(x).tolist()]
+    return [x.tolist(), kde(col, x).tolist()]
 
 
 # get a list of prediction probability columns which are independent with each other
@@ -35,9 +45,27 @@ def get_independent_preds(df_columns, models=None):
     return indep_cols_all
 
 
+# metric values used for segmentation: per-data losses, or independent prediction columns, named model_<modelId>
+def compute_metric_df(metric, pred_df, loss_df):
+    metric_df = loss_df.copy() if metric == 'performance' else pred_df.copy()
+    ipd = get_independent_preds(metric_df.columns)
+
+    # todo: consider cases with more than one class
+    return metric_df[ipd].rename(columns={cc: 'model_' + cc.split('_')[1] for cc in ipd}), ipd
+
+
+# segment ids from a list of filter lists, one per segment; data matching none of them falls into segment 0
+def compute_explicit_segment_ids(segment_filters, full_df):
+    segment_ids = np.zeros(full_df.shape[0])
+    for i, filters in enumerate(segment_filters):
+        filter_for_segment = compute_filter(filters, full_df)
+        segment_ids[filter_for_segment] = i
+    return segment_ids
+
+
 class PerformanceComparison(object):
 
-    def __init__(self, pred_df, loss_df, feature_df, uuid, model_meta):
+    def __init__(self, pred_df, loss_df, feature_df, uuid, model_meta, clustering_config=None):
         self.feature_df = feature_df
         self.pred_df = pred_df
         self.loss_df = loss_df
@@ -50,6 +78,14 @@ class PerformanceComparison(object):
         self.segment_ids = None
         self.clustering_columns = None
         self.segment_filters = None
+        self.full_df = None
+        self.clustering_config = clustering_config if clustering_config is not None else ClusteringConfig()
+        # unsorted labels of the last clustering on the current metric, to warm start the next one from
+        self.cluster_labels = None
+        # merge trees of hierarchical clustering, <(metric, base models) -> HierarchicalClustering>
+        self.hierarchies = {}
+        # (order, offsets) of group_by_segment for the current segment ids, computed on demand
+        self.segment_order = None
 
 
     def set_params(self, n_clusters=None, metric='performance', base_models=None, segment_filters=None):
@@ -58,24 +94,22 @@ class PerformanceComparison(object):
 
         if should_compute_metric:
             self.metric = metric
-
-            metric_df = self.loss_df.copy() if self.metric == 'performance' else self.pred_df.copy()
-            self.ipd = get_independent_preds(metric_df.columns)
-
-            # todo: consider cases with more than one class
-            self.metric_df = metric_df[self.ipd].rename(columns={cc: 'model_' + cc.split('_')[1] for cc in self.ipd})
+            with span('metric', rows=len(self.pred_df)):
+                self.metric_df, self.ipd = compute_metric_df(self.metric, self.pred_df, self.loss_df)
+            self.cluster_labels = None
 
         if not is_manual:
             self.n_clusters = n_clusters
             self.n_segments = n_clusters
             self.clustering_columns = get_independent_preds(self.metric_df.columns, base_models)
-            # todo: no need to compute each time. just need to get children_ property of the clustering model
-            self.compute_clusters()
+            with span('cluster', rows=len(self.metric_df)):
+                self.compute_clusters()
 
         else:
             self.segment_filters = segment_filters
             self.n_segments = len(segment_filters)
-            self.compute_explicit_segments()
+            with span('explicit_segments', rows=len(self.pred_df)):
+                self.compute_explicit_segments()
 
 
     def should_compute_metric(self, metric):
@@ -85,56 +119,109 @@ class PerformanceComparison(object):
 
 
     def compute_clusters(self):
-        # self.clustering_model = AgglomerativeClustering(
-        #     n_clusters=self.n_clusters, affinity='euclidean', linkage='ward', compute_full_tree=True)
-        self.clustering_model = KMeans(n_clusters=self.n_clusters, precompute_distances=True, random_state=0)
-        segment_ids = self.clustering_model.fit_predict(self.metric_df[self.clustering_columns])
-
-        self.metric_df['clusters'] = segment_ids
-        gb = self.metric_df.groupby('clusters')
+        if self.clustering_config.method == CLUSTERING_METHOD['WARD_TREE']:
+            # the merge tree only depends on the clustered columns, any number of clusters is read off it
+            key = (self.metric, tuple(self.clustering_columns))
+            if key not in self.hierarchies:
+                self.hierarchies[key] = HierarchicalClustering(
+                    self.metric_df[self.clustering_columns].values, self.clustering_config)
+            self.cluster_labels = self.hierarchies[key].get_labels(self.n_clusters)
+        else:
+            self.cluster_labels, _ = compute_clusters(
+                self.metric_df[self.clustering_columns].values, self.n_clusters, self.clustering_config,
+                prev_labels=self.cluster_labels)
 
         # sorting clusters based on model_0 median performance
-        mean_df = gb.aggregate(np.median).rename(columns={cc: 'model_' + cc.split('_')[1] for cc in self.ipd})
-        sorted_ind = mean_df['model_0'].sort_values(ascending=True, inplace=False).index
-        cluster_id_map = {v: k for (k, v) in enumerate(list(sorted_ind))}
+        medians = self.metric_df['model_0'].groupby(self.cluster_labels).median()
+        cluster_id_map = np.zeros(self.n_clusters, dtype=int)
+        cluster_id_map[medians.sort_values(ascending=True).index.values] = np.arange(len(medians))
 
-        self.metric_df['clusters'] = self.metric_df['clusters'].apply(lambda x: cluster_id_map[x])
+        self.metric_df['clusters'] = cluster_id_map[self.cluster_labels]
         self.segment_ids = self.metric_df['clusters']
+        self.segment_order = None
 
 
     def compute_explicit_segments(self):
-        full_df = pd.concat([self.pred_df, self.loss_df, self.feature_df], axis=1)
-        self.segment_ids = np.zeros(full_df.shape[0])
-
-        for i, filters in enumerate(self.segment_filters):
-            filter_for_segment = compute_filter(filters, full_df)
-            self.segment_ids[filter_for_segment] = i
+        # columns are shared with pred_df, loss_df and feature_df, not copied
+        if self.full_df is None:
+            self.full_df = join_frames([self.pred_df, self.loss_df, self.feature_df])
+        self.segment_ids = compute_explicit_segment_ids(self.segment_filters, self.full_df)
+        self.segment_order = None
 
 
     def get_segment_ids(self):
         return self.segment_ids
 
 
-    def get_models_performance_by_segment(self):
+    def get_segment_order(self):
+        if self.segment_order is None:
+            self.segment_order = group_by_segment(self.segment_ids, self.n_segments)
+        return self.segment_order
+
+
+    def get_encoded_segment_ids(self):
+        # segment id of every row, in the order of uuid
+        return {
+            'encoding': 'int32',
+            'numDataPoints': len(self.segment_ids),
+            'data': encode_array(self.segment_ids)
+        }
+
+
+    def get_segment_data_ids(self, segment_id, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        A page of the uuids of a segment, in row order
+        :param segment_id: index of the segment, or its 'segment_<index>' id
+        :param offset: index of the first uuid of the page within the segment
+        :param limit: maximum number of uuids of the page, all the remaining ones if None
+        """
+        s = parse_segment_id(segment_id)
+        order, offsets = self.get_segment_order()
+        rows = get_page(order[offsets[s]: offsets[s + 1]], offset, limit)
+        return {
+            'segmentId': 'segment_' + str(s),
+            'numDataPoints': int(offsets[s + 1] - offsets[s]),
+            'offset': offset,
+            'dataIds': self.uuid[rows].tolist()
+        }
+
+
+    def get_models_performance_by_segment(self, data_ids_encoding=DATA_IDS_ENCODING['LIST']):
+        """
+        :param data_ids_encoding: one of DATA_IDS_ENCODING, how 'dataIds' of every segment are sent;
+            row indices of the compact encodings are positions in uuid, i.e. in the (filtered) data
+        """
+        # rows are sorted by segment once, every segment is then a contiguous slice
+        with span('group_by_segment', rows=len(self.segment_ids)):
+            order, offsets = self.get_segment_order()
+        model_cols = [c for c in self.metric_df.columns if c.startswith('model_')]
+        values = self.metric_df[model_cols].values[order]
+        n_rows = len(order)
+
         segments_list = []
         for s in range(self.n_segments):
-            segment_mask = (self.segment_ids == s)
+            start, end = offsets[s], offsets[s + 1]
             segment_dict = {
                 'segmentId': 'segment_' + str(s),
-                'numDataPoints': segment_mask.sum(),
-                'dataIds': self.uuid[segment_mask].tolist()
-                # 'dataIds': np.where(self.segment_ids == c)[0].tolist()
+                'numDataPoints': int(end - start)
             }
-            models_list = []
-            models_df = self.metric_df.loc[segment_mask]
-            models_df = models_df[[c for c in models_df.columns if c.startswith('model_')]]
+            if data_ids_encoding == DATA_IDS_ENCODING['LIST']:
+                segment_dict['dataIds'] = self.uuid[order[start: end]].tolist()
+            elif data_ids_encoding != DATA_IDS_ENCODING['NONE']:
+                # order is stable, so row indices of a segment are sorted
+                segment_dict['dataIds'] = encode_rows(order[start: end], n_rows, data_ids_encoding)
+            segment_values = values[start: end]
+            # all percentiles of all models in one call
+            percentiles = np.percentile(segment_values, percentile_list, axis=0) if end > start \
+                else np.full((len(percentile_list), len(model_cols)), np.nan)
 
-            for m in models_df.columns:
+            models_list = []
+            for i, m in enumerate(model_cols):
                 model_dict = {
                     'modelId': m,
                     'modelName': self.model_meta[m],
-                    'percentiles': percentiles_func(models_df[m]),
-                    'density': density_func(models_df[m])
+                    'percentiles': percentiles[:, i].tolist(),
+                    'density': density_func(segment_values[:, i]) if end > start else [[], []]
                 }
                 models_list.append(model_dict)
 
@@ -0,0 +1,249 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .column_store import frame_from_columns
+
+
+FORMAT = {
+    'CSV': 'csv',
+    'PARQUET': 'parquet',
+    'FEATHER': 'feather',
+    'NPY': 'npy',
+    'NPZ': 'npz'
+}
+# file signatures of the binary formats, checked before falling back to file extensions
+MAGIC_BYTES = [
+    (b'PAR1', FORMAT['PARQUET']),
+    (b'ARROW1', FORMAT['FEATHER']),
+    (b'\x93NUMPY', FORMAT['NPY']),
+    (b'PK\x03\x04', FORMAT['NPZ']),
+]
+EXTENSIONS = {
+    '.parquet': FORMAT['PARQUET'],
+    '.pq': FORMAT['PARQUET'],
+    '.feather': FORMAT['FEATHER'],
+    '.arrow': FORMAT['FEATHER'],
+    '.ipc': FORMAT['FEATHER'],
+    '.npy': FORMAT['NPY'],
+    '.npz': FORMAT['NPZ'],
+}
+CSV_CHUNK_ROWS = 1000000
+
+
+def sniff_format(dataset):
+    # file-like objects and urls are handed to pandas as csv
+    if not isinstance(dataset, str):
+        return FORMAT['CSV']
+    try:
+        with open(dataset, 'rb') as f:
+            head = f.read(8)
+    except (IOError, OSError):
+        return FORMAT['CSV']
+    for magic, data_format in MAGIC_BYTES:
+        if head.startswith(magic):
+            if data_format == FORMAT['NPZ'] and not dataset.endswith('.npz'):
+                # zip signature is shared with zipped csv files
+                continue
+            return data_format
+    for ext, data_format in EXTENSIONS.items():
+        if dataset.lower().endswith(ext):
+            return data_format
+    return FORMAT['CSV']
+
+
+# resolve a column selector (None, list of names, or predicate on names) against the available columns
+def select_columns(names, usecols):
+    if usecols is None:
+        return list(names)
+    if callable(usecols):
+        return [c for c in names if usecols(c)]
+    return [c for c in names if c in set(usecols)]
+
+
+# resolve a dtype spec (None, dict, or function from column name to dtype/None) into a dict
+def resolve_dtypes(names, dtype):
+    if dtype is None:
+        return None
+    if callable(dtype):
+        return {c: dtype(c) for c in names if dtype(c) is not None}
+    return {c: t for (c, t) in dtype.items() if c in names}
+
+
+def read_csv_header(dataset):
+    """
+    :return: the column names of a csv path or file object, or None if the header can't be read without
+        consuming the rows, i.e. from a file object which can't seek back
+    """
+    if isinstance(dataset, str):
+        return list(pd.read_csv(dataset, nrows=0).columns)
+    if not (hasattr(dataset, 'seekable') and dataset.seekable()):
+        return None
+    position = dataset.tell()
+    names = list(pd.read_csv(dataset, nrows=0).columns)
+    dataset.seek(position)
+    return names
+
+
+def iter_csv_chunks(dataset, usecols=None, dtype=None, chunksize=CSV_CHUNK_ROWS):
+    cast = None
+    if callable(dtype):
+        # dtype functions need the column names, which are read from the header first
+        names = read_csv_header(dataset)
+        if names is None:
+            # the chunks are cast once read instead
+            cast, dtype = dtype, None
+        else:
+            dtype = resolve_dtypes(select_columns(names, usecols), dtype)
+    reader = pd.read_csv(dataset, usecols=usecols, dtype=dtype, chunksize=chunksize, engine='c')
+    for chunk in reader:
+        if cast is not None:
+            dtypes = resolve_dtypes(chunk.columns, cast)
+            chunk = chunk.astype(dtypes) if dtypes else chunk
+        yield chunk
+
+
+def read_csv(dataset, usecols=None, dtype=None, chunksize=CSV_CHUNK_ROWS):
+    chunks = iter_csv_chunks(dataset, usecols=usecols, dtype=dtype, chunksize=chunksize)
+    first_chunk = next(chunks)
+    # <column name -> chunks of the column>; chunks are split into columns owning their memory as they are read,
+    # and columns are concatenated one at a time, so that memory peaks at the data and one column, rather than
+    # twice the data as with a concatenation of whole chunks
+    column_chunks = None
+    for chunk in chunks:
+        if column_chunks is None:
+            column_chunks = OrderedDict((c, [first_chunk[c].copy()]) for c in first_chunk.columns)
+            first_chunk = None
+        for c in chunk.columns:
+            column_chunks[c].append(chunk[c].copy())
+    if column_chunks is None:
+        return first_chunk
+
+    columns = OrderedDict()
+    for c in list(column_chunks.keys()):
+        columns[c] = pd.concat(column_chunks.pop(c), ignore_index=True).values
+    return frame_from_columns(columns)
+
+
+def read_columnar_schema(dataset, data_format):
+    if data_format == FORMAT['PARQUET']:
+        import pyarrow.parquet as pq
+        return pq.read_schema(dataset).names
+    import pyarrow.ipc as ipc
+    with ipc.open_file(dataset) as reader:
+        return reader.schema.names
+
+
+def read_parquet_or_feather(dataset, data_format, usecols=None):
+    try:
+        names = read_columnar_schema(dataset, data_format)
+    except ImportError:
+        raise ImportError('pyarrow is required to read {} files'.format(data_format))
+    columns = select_columns(names, usecols)
+    if data_format == FORMAT['PARQUET']:
+        return pd.read_parquet(dataset, columns=columns)
+    return pd.read_feather(dataset, columns=columns)
+
+
+def read_npy(dataset, usecols=None):
+    # only structured arrays carry column names; the file is memory mapped so unused fields are not read
+    array = np.load(dataset, mmap_mode='r', allow_pickle=False)
+    if array.dtype.names is None:
+        raise ValueError('{} must contain a structured array with named fields'.format(dataset))
+    columns = select_columns(array.dtype.names, usecols)
+    return pd.DataFrame({c: np.asarray(array[c]) for c in columns}, columns=columns)
+
+
+def read_npz(dataset, usecols=None):
+    # every array in the archive is a column, arrays are only decompressed when accessed
+    with np.load(dataset, allow_pickle=False) as archive:
+        columns = select_columns(archive.files, usecols)
+        return pd.DataFrame({c: archive[c] for c in columns}, columns=columns)
+
+
+def read_dataset(dataset, usecols=None, dtype=None):
+    """
+    Read a dataset into a DataFrame, detecting the file format from its content.
+    :param dataset: path of a Parquet, Feather/Arrow IPC, .npy (structured array), .npz or CSV file;
+        anything else pandas can read as csv, e.g. a file object, is read as CSV
+    :param usecols: list of column names, or a predicate on column names, of the columns to read
+    :param dtype: dict, or function of column name, of the column dtypes; CSV columns are parsed into them directly
+    :return: a DataFrame with the selected columns, in file order
+    """
+    data_format = sniff_format(dataset)
+    if data_format in [FORMAT['PARQUET'], FORMAT['FEATHER']]:
+        df = read_parquet_or_feather(dataset, data_format, usecols=usecols)
+    elif data_format == FORMAT['NPY']:
+        df = read_npy(dataset, usecols=usecols)
+    elif data_format == FORMAT['NPZ']:
+        df = read_npz(dataset, usecols=usecols)
+    else:
+        return read_csv(dataset, usecols=usecols, dtype=dtype)
+
+    dtypes = resolve_dtypes(df.columns, dtype)
+    return df.astype(dtypes) if dtypes else df
+
+
+def iter_dataset(dataset, usecols=None, dtype=None, chunksize=CSV_CHUNK_ROWS):
+    """
+    Read a dataset in blocks of rows, with the same column selection and dtypes as read_dataset.
+    Parquet files are read by batches, Arrow IPC files by record batches, .npy files through a memory map;
+    .npz archives can't be read partially and are loaded once, then split into blocks.
+    """
+    data_format = sniff_format(dataset)
+    if data_format == FORMAT['CSV']:
+        for chunk in iter_csv_chunks(dataset, usecols=usecols, dtype=dtype, chunksize=chunksize):
+            yield chunk
+        return
+
+    if data_format == FORMAT['PARQUET']:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(dataset)
+        columns = select_columns(parquet_file.schema_arrow.names, usecols)
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns))
+    elif data_format == FORMAT['FEATHER']:
+        chunks = iter_ipc_batches(dataset, usecols)
+    elif data_format == FORMAT['NPY']:
+        array = np.load(dataset, mmap_mode='r', allow_pickle=False)
+        if array.dtype.names is None:
+            raise ValueError('{} must contain a structured array with named fields'.format(dataset))
+        columns = select_columns(array.dtype.names, usecols)
+        chunks = (pd.DataFrame({c: np.asarray(array[c][start: start + chunksize]) for c in columns}, columns=columns)
+                  for start in range(0, len(array), chunksize))
+    else:
+        df = read_npz(dataset, usecols=usecols)
+        chunks = (df.iloc[start: start + chunksize] for start in range(0, len(df), chunksize))
+
+    for chunk in chunks:
+        dtypes = resolve_dtypes(chunk.columns, dtype)
+        yield chunk.astype(dtypes) if dtypes else chunk
+
+
+def iter_ipc_batches(dataset, usecols=None):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    with pa.memory_map(dataset) as source:
+        reader = ipc.open_file(source)
+        columns = select_columns(reader.schema.names, usecols)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).select(columns).to_pandas()
+
+
+# blocks of the same rows from several datasets, e.g. a feature dataset and its prediction datasets
+def iter_aligned_chunks(iterators, chunksize):
+    pending = [None] * len(iterators)
+    while True:
+        for i, it in enumerate(iterators):
+            while pending[i] is None or len(pending[i]) < chunksize:
+                try:
+                    chunk = next(it)
+                except StopIteration:
+                    break
+                pending[i] = chunk if pending[i] is None else pd.concat([pending[i], chunk], ignore_index=True)
+
+        n_rows = min(0 if p is None else len(p) for p in pending)
+        if n_rows == 0:
+            if any(p is not None and len(p) > 0 for p in pending):
+                raise ValueError('Datasets must have the same number of rows')
+            return
+        yield [p.iloc[:n_rows].reset_index(drop=True) for p in pending]
+        pending = [p.iloc[n_rows:] for p in pending]
@@ -0,0 +1,138 @@
+import json
+import logging
+import numpy as np
+from concurrent.futures import CancelledError
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from .sessions import SessionManager
+from .instrumentation import span
+
+
+API_PREFIX = '/api/'
+METRICS_PATH = '/metrics'
+CLIENT_ID_HEADER = 'X-Client-Id'
+DEFAULT_PORT = 8010
+# seconds a request waits for its job to finish
+DEFAULT_TIMEOUT = 600
+# ServiceSession methods dispatched by the front controller, all of them run as jobs of AsyncServiceSession
+METHODS = [
+    'load_data',
+    'get_meta_data',
+    'get_models_performance_by_segment',
+    'get_features_distribution_by_segment_group',
+    'get_segment_data_ids',
+    'get_encoded_segment_ids'
+]
+
+logger = logging.getLogger(__name__)
+
+
+def to_json(obj):
+    return json.dumps(obj, default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
+
+
+class FrontController(object):
+    """
+    Dispatches requests of clients to their sessions. A request is the name of a ServiceSession method
+    and a dict of its keyword arguments; the result is an (http status, response dict) pair, with the
+    result of the method under 'result', or an 'error'. Requests superseded by newer ones of the same client
+    get status 409.
+    :param metrics_sink: optional instrumentation.PrometheusSink, served on GET /metrics
+    """
+
+    def __init__(self, session_manager=None, timeout=DEFAULT_TIMEOUT, metrics_sink=None):
+        self.session_manager = session_manager if session_manager is not None else SessionManager()
+        self.timeout = timeout
+        self.metrics_sink = metrics_sink
+
+
+    def dispatch(self, client_id, method, params=None):
+        if method == 'close_session':
+            return 200, {'result': self.session_manager.close_session(client_id)}
+        if method not in METHODS:
+            return 404, {'error': 'Unknown method "{}"'.format(method)}
+
+        session = self.session_manager.get_session(client_id)
+        try:
+            future = getattr(session, method)(**(params or {}))
+        except TypeError as e:
+            # wrong arguments
+            return 400, {'error': str(e)}
+        try:
+            return 200, {'result': future.result(timeout=self.timeout)}
+        except CancelledError:
+            return 409, {'error': 'Request superseded by a newer one'}
+        except Exception as e:
+            logger.exception('Request %s of client %s failed', method, client_id)
+            return 500, {'error': str(e)}
+
+
+def make_handler(controller):
+
+    class Handler(BaseHTTPRequestHandler):
+        # POST /api/<method> with a json object of keyword arguments; the client is identified by a header
+
+        def do_GET(self):
+            if self.path != METRICS_PATH or controller.metrics_sink is None:
+                return self.respond(404, {'error': 'Not found'})
+            body = controller.metrics_sink.render().encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def do_POST(self):
+            if not self.path.startswith(API_PREFIX):
+                return self.respond(404, {'error': 'Not found'})
+            client_id = self.headers.get(CLIENT_ID_HEADER)
+            if not client_id:
+                return self.respond(400, {'error': 'Missing {} header'.format(CLIENT_ID_HEADER)})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                params = json.loads(self.rfile.read(length).decode('utf8')) if length > 0 else {}
+            except ValueError as e:
+                return self.respond(400, {'error': 'Invalid json: {}'.format(e)})
+            status, response = controller.dispatch(client_id, self.path[len(API_PREFIX):], params)
+            self.respond(status, response)
+
+
+        def respond(self, status, response):
+            with span('serialize') as s:
+                body = to_json(response).encode('utf8')
+                s.result_bytes = len(body)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, format, *args):
+            # requests are frequent, e.g. while dragging sliders, only errors are logged
+            pass
+
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(controller=None, host='127.0.0.1', port=DEFAULT_PORT):
+    """
+    :param port: 0 to pick a free port, e.g. in local tests; the port is then server.server_address[1]
+    """
+    controller = controller if controller is not None else FrontController()
+    return ThreadingHTTPServer((host, port), make_handler(controller))
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT, **session_kwargs):
+    controller = FrontController(SessionManager(**session_kwargs))
+    server = make_server(controller, host=host, port=port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        controller.session_manager.close()
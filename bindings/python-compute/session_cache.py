@@ -0,0 +1,199 @@
+import os
+import json
+import re
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+# bump when the content or layout of cached artifacts changes, entries of other versions are discarded
+CACHE_VERSION = 2
+DEFAULT_CACHE_BYTES = 10 * 1024 * 1024 * 1024
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_SAMPLE_BYTES = 64 * 1024
+
+VERSION_FILE = 'VERSION'
+COLUMNS_FILE = 'columns.json'
+CATEGORIES_SUFFIX = '.categories.json'
+ENTRY_NAME = re.compile(r'^[0-9a-f]{40}$')
+
+
+# fingerprint of a file from its size, mtime and a hash of evenly spaced samples of its content
+def file_fingerprint(path, n_samples=FINGERPRINT_SAMPLES, sample_bytes=FINGERPRINT_SAMPLE_BYTES):
+    stat = os.stat(path)
+    digest = hashlib.sha1('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode('utf8'))
+    step = max(stat.st_size // n_samples, sample_bytes)
+    with open(path, 'rb') as f:
+        for offset in range(0, stat.st_size, step):
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+        # the tail of the file is always sampled, appended rows change it
+        f.seek(max(stat.st_size - sample_bytes, 0))
+        digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(feature_dataset, pred_datasets, **options):
+    key = {
+        'version': CACHE_VERSION,
+        'feature_dataset': file_fingerprint(feature_dataset),
+        'pred_datasets': [file_fingerprint(d) for d in pred_datasets],
+        'options': options
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+    return size
+
+
+class CacheEntry(object):
+    """
+    Precomputed artifacts of one dataset fingerprint. DataFrames are stored as one .npy file per column,
+    and are memory mapped when read; non-numeric columns are stored as categorical codes plus a json category list.
+    """
+
+    def __init__(self, path, on_write=None):
+        self.path = path
+        self.on_write = on_write
+
+
+    def has_frame(self, name):
+        return os.path.exists(os.path.join(self.path, name, COLUMNS_FILE))
+
+
+    def has_json(self, name):
+        return os.path.exists(os.path.join(self.path, name + '.json'))
+
+
+    def read_frame(self, name):
+        frame_dir = os.path.join(self.path, name)
+        with open(os.path.join(frame_dir, COLUMNS_FILE)) as f:
+            columns = json.load(f)
+
+        data = {}
+        for i, c in enumerate(columns):
+            values = np.load(os.path.join(frame_dir, '{}.npy'.format(i)), mmap_mode='r')
+            categories_path = os.path.join(frame_dir, '{}{}'.format(i, CATEGORIES_SUFFIX))
+            if os.path.exists(categories_path):
+                with open(categories_path) as f:
+                    categories = json.load(f)
+                values = pd.Series(pd.Categorical.from_codes(values, categories['categories'])) \
+                    .astype(categories['dtype']).values
+            data[c] = values
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+
+    def write_frame(self, name, df):
+        # written into a temporary directory which is renamed, so readers never see partial frames
+        frame_dir = os.path.join(self.path, name)
+        tmp_dir = '{}.tmp{}'.format(frame_dir, os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for i, c in enumerate(df.columns):
+            col = df[c]
+            if not pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+                categorical = pd.Categorical(col)
+                with open(os.path.join(tmp_dir, '{}{}'.format(i, CATEGORIES_SUFFIX)), 'w') as f:
+                    json.dump({'dtype': str(col.dtype), 'categories': categorical.categories.tolist()}, f, default=str)
+                values = categorical.codes
+            else:
+                values = col.values
+            np.save(os.path.join(tmp_dir, '{}.npy'.format(i)), np.ascontiguousarray(values), allow_pickle=False)
+        with open(os.path.join(tmp_dir, COLUMNS_FILE), 'w') as f:
+            json.dump([str(c) for c in df.columns], f)
+        shutil.rmtree(frame_dir, ignore_errors=True)
+        os.rename(tmp_dir, frame_dir)
+        self.written()
+
+
+    def read_json(self, name):
+        with open(os.path.join(self.path, name + '.json')) as f:
+            return json.load(f)
+
+
+    def write_json(self, name, obj):
+        tmp_path = os.path.join(self.path, '{}.json.tmp{}'.format(name, os.getpid()))
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f, default=lambda x: x.item() if isinstance(x, np.generic) else str(x))
+        os.rename(tmp_path, os.path.join(self.path, name + '.json'))
+        self.written()
+
+
+    def written(self):
+        if self.on_write is not None:
+            self.on_write(self)
+
+
+class SessionCache(object):
+    """
+    Directory of precomputed session artifacts, one sub directory per dataset fingerprint.
+    Least recently used entries are removed when the directory grows over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.check_version()
+
+
+    def check_version(self):
+        version_path = os.path.join(self.cache_dir, VERSION_FILE)
+        try:
+            with open(version_path) as f:
+                version = int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            version = None
+
+        if version != CACHE_VERSION:
+            self.remove_entries()
+            with open(version_path, 'w') as f:
+                f.write(str(CACHE_VERSION))
+
+
+    def remove_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        for name in os.listdir(self.cache_dir):
+            if ENTRY_NAME.match(name):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+    def get_entry(self, feature_dataset, pred_datasets, **options):
+        key = dataset_fingerprint(feature_dataset, pred_datasets, **options)
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # mtime of the entry directory records when it was last used
+        os.utime(path, None)
+        return CacheEntry(path, on_write=self.evict)
+
+
+    def list_entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if ENTRY_NAME.match(name) and os.path.isdir(path):
+                entries.append((os.path.getmtime(path), path, dir_size(path)))
+        return sorted(entries)
+
+
+    def evict(self, current_entry=None):
+        entries = self.list_entries()
+        total = sum(size for (_, _, size) in entries)
+        for (_, path, size) in entries:
+            if total <= self.max_bytes:
+                break
+            if current_entry is not None and path == current_entry.path:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+    def clear(self):
+        self.remove_entries()
@@ -0,0 +1,145 @@
+import time
+import threading
+from collections import OrderedDict
+from .data_manager import DataManager
+from .feature_differentiation import FeaturesMetaCache
+from .session_cache import dataset_fingerprint
+from .jobs import AsyncServiceSession
+from .main import ServiceSession
+
+
+DEFAULT_REGISTRY_BYTES = 8 * 1024 * 1024 * 1024
+DEFAULT_IDLE_SECONDS = 30 * 60
+
+
+class SharedDataset(object):
+    """
+    A loaded dataset, shared by the sessions holding a reference to it
+    """
+
+    def __init__(self, key, data_manager, features_meta_cache):
+        self.key = key
+        self.data_manager = data_manager
+        self.features_meta_cache = features_meta_cache
+        self.n_bytes = data_manager.store.nbytes()
+        self.ref_count = 0
+        self.last_used = time.time()
+
+
+class DatasetRegistry(object):
+    """
+    Loaded datasets, one DataManager per dataset fingerprint, shared by the sessions of all clients.
+    Datasets are reference counted; unreferenced ones are evicted once idle for idle_timeout seconds,
+    or least recently used first when the loaded datasets take more than max_bytes.
+    Referenced datasets are never evicted, max_bytes may be exceeded while they are in use.
+    :param session_cache: optional SessionCache datasets are loaded with
+    """
+
+    def __init__(self, session_cache=None, max_bytes=DEFAULT_REGISTRY_BYTES, idle_timeout=DEFAULT_IDLE_SECONDS):
+        self.session_cache = session_cache
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.datasets = OrderedDict()
+        self.lock = threading.Lock()
+        # <key -> lock> of datasets being loaded, so that a dataset requested by several clients is loaded once
+        self.loading_locks = {}
+
+
+    def acquire(self, feature_dataset, pred_datasets):
+        # same options as the DataManager it is loaded into
+        key = dataset_fingerprint(feature_dataset, pred_datasets, use_same_target=True, loss_name=None)
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+
+        with loading_lock:
+            with self.lock:
+                dataset = self.datasets.get(key)
+            if dataset is None:
+                data_manager = DataManager(feature_dataset, pred_datasets, session_cache=self.session_cache)
+                features_meta_cache = FeaturesMetaCache(data_manager.feature_df, cache_entry=data_manager.cache_entry)
+                dataset = SharedDataset(key, data_manager, features_meta_cache)
+
+            with self.lock:
+                self.datasets[key] = dataset
+                self.datasets.move_to_end(key)
+                dataset.ref_count += 1
+                dataset.last_used = time.time()
+                self.loading_locks.pop(key, None)
+        self.evict()
+        return dataset
+
+
+    def release(self, dataset):
+        with self.lock:
+            dataset.ref_count -= 1
+            dataset.last_used = time.time()
+        self.evict()
+
+
+    def n_bytes(self):
+        with self.lock:
+            return sum(d.n_bytes for d in self.datasets.values())
+
+
+    def evict(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            total = sum(d.n_bytes for d in self.datasets.values())
+            # least recently acquired first
+            for key, dataset in list(self.datasets.items()):
+                if dataset.ref_count > 0:
+                    continue
+                if total > self.max_bytes or now - dataset.last_used > self.idle_timeout:
+                    del self.datasets[key]
+                    total -= dataset.n_bytes
+
+
+class SessionManager(object):
+    """
+    Sessions of clients, identified by client id. Every client has its own AsyncServiceSession
+    (filters, segments and parameters), on datasets shared through a DatasetRegistry.
+    Sessions idle for idle_timeout seconds are closed, releasing their datasets.
+    :param session_kwargs: keyword arguments of the ServiceSession of every client
+    """
+
+    def __init__(self, dataset_registry=None, idle_timeout=DEFAULT_IDLE_SECONDS, **session_kwargs):
+        self.dataset_registry = dataset_registry if dataset_registry is not None else DatasetRegistry()
+        self.idle_timeout = idle_timeout
+        self.session_kwargs = session_kwargs
+        self.sessions = OrderedDict()
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+
+    def get_session(self, client_id):
+        self.evict_idle()
+        with self.lock:
+            if client_id not in self.sessions:
+                service_session = ServiceSession(dataset_registry=self.dataset_registry, **self.session_kwargs)
+                self.sessions[client_id] = AsyncServiceSession(service_session)
+            self.sessions.move_to_end(client_id)
+            self.last_used[client_id] = time.time()
+            return self.sessions[client_id]
+
+
+    def close_session(self, client_id):
+        with self.lock:
+            session = self.sessions.pop(client_id, None)
+            self.last_used.pop(client_id, None)
+        if session is not None:
+            session.shutdown(wait=False)
+        return session is not None
+
+
+    def evict_idle(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            idle = [c for c, t in self.last_used.items() if now - t > self.idle_timeout]
+        for client_id in idle:
+            self.close_session(client_id)
+        self.dataset_registry.evict(now=now)
+
+
+    def close(self):
+        for client_id in list(self.sessions):
+            self.close_session(client_id)
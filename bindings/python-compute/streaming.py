@@ -0,0 +1,554 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy.stats import entropy
+from sklearn.cluster import MiniBatchKMeans
+
+from .readers import iter_dataset, iter_aligned_chunks
+from .column_store import join_frames
+from .utils import compute_filter
+from .constants import DATA_IDS_ENCODING
+from .encoding import DEFAULT_PAGE_SIZE, get_page, parse_segment_id
+from .data_manager import compute_models_meta_data, compute_pred_df, compute_target_df, compute_loss_df, \
+    is_pred_col, is_feature_col, pred_col_dtype, UUID_COL
+from .performance_comparison import compute_metric_df, compute_explicit_segment_ids, get_independent_preds, \
+    percentile_list
+from .feature_differentiation import NUMERICAL_DOMAIN_INTERVAL, CATEGORICAL_MAX_UNIQUE
+from .density import binned_kde
+from .parallel import CancelToken
+
+
+DEFAULT_CHUNK_ROWS = 500000
+# resolution of the histograms percentiles and densities are computed from
+SKETCH_BINS = 2048
+FEATURE_SKETCH_BINS = 1000
+# number of uuids sampled per segment
+RESERVOIR_SIZE = 10000
+# categorical features with more categories than this are not tracked
+MAX_CATEGORIES = 1000
+
+
+class HistogramSketch(object):
+    """
+    Fixed-bin histogram over a known value range, from which percentiles (within one bin width)
+    and densities are computed. Sketches with the same range can be merged.
+    Densities are binned gaussian kernel estimates of the counts, as those of the in-memory mode of the rows;
+    raw counts of fine bins are too noisy to compare distributions with.
+    """
+
+    def __init__(self, lo, hi, n_bins=SKETCH_BINS):
+        self.lo = float(lo)
+        self.hi = float(hi) if hi > lo else float(lo) + 1.
+        self.edges = np.linspace(self.lo, self.hi, n_bins + 1)
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        n_bins = len(self.counts)
+        bins = np.clip(((values - self.lo) * (n_bins / (self.hi - self.lo))).astype(np.int64), 0, n_bins - 1)
+        self.counts += np.bincount(bins, minlength=n_bins)
+
+
+    def merge(self, other):
+        merged = HistogramSketch(self.lo, self.hi, len(self.counts))
+        merged.counts = self.counts + other.counts
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        return merged
+
+
+    def count(self):
+        return int(self.counts.sum())
+
+
+    def percentiles(self, percentiles):
+        if self.count() == 0:
+            return [np.nan] * len(percentiles)
+        cdf = np.concatenate([[0.], np.cumsum(self.counts) / float(self.count())])
+        values = np.interp(np.asarray(percentiles) / 100., cdf, self.edges)
+        return np.clip(values, self.min, self.max).tolist()
+
+
+    # bw_method: bandwidth rule of density.kde, the same as the in-memory mode uses on the rows
+    def density(self, x, bw_method=None):
+        if self.count() == 0:
+            return np.zeros(len(x))
+        # all values in one bin, e.g. a constant column: a spike at the nearest point of x
+        if np.count_nonzero(self.counts) == 1:
+            distribution = np.zeros(len(x))
+            distribution[np.abs(np.asarray(x) - self.min).argmin()] = 1.
+            return distribution
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        return binned_kde(centers, np.asarray(x, dtype=np.float64), bw_method=bw_method, weights=self.counts)
+
+
+class Reservoir(object):
+    """
+    Uniform sample of at most `size` values out of a stream of blocks (algorithm R, vectorized per block).
+    """
+
+    def __init__(self, size=RESERVOIR_SIZE, seed=0):
+        self.size = size
+        self.items = None
+        self.n_seen = 0
+        self.random_state = np.random.RandomState(seed)
+
+
+    def add(self, values):
+        values = np.asarray(values)
+        if self.items is None:
+            self.items = values[:0].copy()
+        n_fill = max(0, min(self.size - len(self.items), len(values)))
+        if n_fill > 0:
+            self.items = np.concatenate([self.items, values[:n_fill]])
+
+        rest = values[n_fill:]
+        if len(rest) > 0:
+            # the i-th value of the stream replaces a random item with probability size / (i + 1)
+            positions = self.n_seen + n_fill + np.arange(len(rest))
+            slots = (self.random_state.random_sample(len(rest)) * (positions + 1)).astype(np.int64)
+            keep = slots < self.size
+            self.items[slots[keep]] = rest[keep]
+        self.n_seen += len(values)
+
+
+    def get_items(self):
+        return [] if self.items is None else self.items.tolist()
+
+
+class ValueRanges(object):
+    """
+    Per-column min/max, and unique values up to a cap, gathered over a stream of blocks.
+    """
+
+    def __init__(self):
+        self.min = {}
+        self.max = {}
+        self.is_numeric = {}
+        self.uniques = {}
+
+
+    def add(self, df):
+        for c in df.columns:
+            col = df[c]
+            if c not in self.is_numeric:
+                self.is_numeric[c] = pd.api.types.is_numeric_dtype(col)
+                self.uniques[c] = set()
+            cap = CATEGORICAL_MAX_UNIQUE if self.is_numeric[c] else MAX_CATEGORIES
+            if self.uniques[c] is not None:
+                self.uniques[c].update(col.dropna().unique()[:cap + 1].tolist())
+                if len(self.uniques[c]) > cap:
+                    self.uniques[c] = None
+            if self.is_numeric[c] and col.notnull().any():
+                self.min[c] = min(self.min.get(c, np.inf), col.min())
+                self.max[c] = max(self.max.get(c, -np.inf), col.max())
+
+
+    def is_categorical(self, c):
+        if self.is_numeric[c]:
+            return self.uniques[c] is not None and len(self.uniques[c]) < CATEGORICAL_MAX_UNIQUE
+        return True
+
+
+    def get_range(self, c):
+        return self.min.get(c, 0.), self.max.get(c, 0.)
+
+
+class SegmentAggregates(object):
+    """
+    Everything the views need to know about each segment, computed in one pass over the data:
+    row counts, histogram sketches of model metrics and numerical features,
+    category counts of categorical features, and a reservoir sample of uuids.
+    """
+
+    # model_ranges: <metric column -> (min, max)>
+    def __init__(self, n_segments, value_ranges, model_ranges, reservoir_size=RESERVOIR_SIZE):
+        self.n_segments = n_segments
+        self.value_ranges = value_ranges
+        self.model_cols = list(model_ranges.keys())
+        self.counts = np.zeros(n_segments, dtype=np.int64)
+        self.model_sketches = [{m: HistogramSketch(*model_ranges[m]) for m in self.model_cols}
+                               for _ in range(n_segments)]
+        self.feature_sketches = [{} for _ in range(n_segments)]
+        self.category_counts = [{} for _ in range(n_segments)]
+        self.reservoirs = [Reservoir(reservoir_size, seed=s) for s in range(n_segments)]
+
+
+    def add(self, segment_ids, metric_df, feature_df, uuid):
+        for s in np.unique(segment_ids).astype(int):
+            mask = segment_ids == s
+            self.counts[s] += mask.sum()
+            self.reservoirs[s].add(uuid[mask])
+            for m in self.model_cols:
+                self.model_sketches[s][m].add(metric_df[m].values[mask])
+            for c in feature_df.columns:
+                self.add_feature(s, c, feature_df[c][mask])
+
+
+    def add_feature(self, s, c, col):
+        if self.value_ranges.is_categorical(c):
+            if self.value_ranges.uniques[c] is None:
+                return
+            counts = self.category_counts[s].setdefault(c, {})
+            for (value, count) in col.value_counts(dropna=False).items():
+                counts[value] = counts.get(value, 0) + count
+        else:
+            if c not in self.feature_sketches[s]:
+                self.feature_sketches[s][c] = HistogramSketch(*self.value_ranges.get_range(c),
+                                                              n_bins=FEATURE_SKETCH_BINS)
+            self.feature_sketches[s][c].add(col.values)
+
+
+    def sort_segments(self, model_col):
+        # re-label segments by ascending median of one model, as PerformanceComparison does for clusters
+        medians = [self.model_sketches[s][model_col].percentiles([50])[0] for s in range(self.n_segments)]
+        order = np.argsort(medians, kind='stable')
+        for attr in ['model_sketches', 'feature_sketches', 'category_counts', 'reservoirs']:
+            values = getattr(self, attr)
+            setattr(self, attr, [values[s] for s in order])
+        self.counts = self.counts[order]
+        return order
+
+
+    def merged_sketch(self, c, segments):
+        sketches = [self.feature_sketches[s][c] for s in segments if c in self.feature_sketches[s]]
+        if len(sketches) == 0:
+            return None
+        merged = sketches[0]
+        for sketch in sketches[1:]:
+            merged = merged.merge(sketch)
+        return merged
+
+
+    def merged_category_counts(self, c, segments):
+        merged = {}
+        for s in segments:
+            for (value, count) in self.category_counts[s].get(c, {}).items():
+                merged[value] = merged.get(value, 0) + count
+        return pd.Series(merged, dtype=np.float64) if merged else pd.Series([], dtype=np.float64)
+
+
+class StreamingDataManager(object):
+    """
+    Out-of-core counterpart of DataManager: the feature and prediction datasets are streamed in blocks
+    of rows, and losses and filter masks are computed block by block. Only aggregates are kept.
+    """
+
+    def __init__(self, feature_dataset, pred_datasets, use_same_target=True, loss_name=None,
+                 chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.feature_dataset = feature_dataset
+        self.pred_datasets = pred_datasets
+        self.use_same_target = use_same_target
+        self.loss_name = loss_name
+        self.chunk_rows = chunk_rows
+        self.filters = None
+        self.value_ranges = None
+
+        heads = [next(iter_dataset(d, usecols=is_pred_col, dtype=pred_col_dtype, chunksize=1))
+                 for d in pred_datasets]
+        self.n_models, self.n_classes, self.class_labels = compute_models_meta_data(heads)
+
+
+    # returns whether the filters changed, rows can't be compared without a pass over the data
+    def set_filters(self, filters=None):
+        filters = filters or None
+        is_changed = filters != self.filters
+        self.filters = filters
+        if is_changed:
+            self.value_ranges = None
+        return is_changed
+
+
+    def get_models_meta_data(self):
+        return {
+            'nModels': self.n_models,
+            'nClasses': self.n_classes,
+            'classLabels': self.class_labels
+        }
+
+
+    def iter_blocks(self):
+        """
+        :return: an iterator of (pred_df, loss_df, feature_df) blocks of filtered rows, indexed from 0
+        """
+        iterators = [iter_dataset(self.feature_dataset, usecols=is_feature_col, chunksize=self.chunk_rows)] + \
+                    [iter_dataset(d, usecols=is_pred_col, dtype=pred_col_dtype, chunksize=self.chunk_rows)
+                     for d in self.pred_datasets]
+        for chunks in iter_aligned_chunks(iterators, self.chunk_rows):
+            feature_df, pred_dfs = chunks[0], chunks[1:]
+            pred_df = compute_pred_df(pred_dfs, self.n_models, self.n_classes, self.class_labels)
+            target_df = compute_target_df(pred_dfs, self.n_models, use_same_target=self.use_same_target)
+            loss_df = compute_loss_df(pred_df, target_df, self.n_models, self.n_classes, loss_name=self.loss_name)
+            # We think of target as a special feature
+            feature_df = join_frames([feature_df, target_df])
+
+            if self.filters:
+                mask = compute_filter(self.filters, join_frames([pred_df, loss_df, feature_df]))
+                if not mask.any():
+                    continue
+                pred_df, loss_df, feature_df = [df[mask].reset_index(drop=True)
+                                                for df in [pred_df, loss_df, feature_df]]
+            yield pred_df, loss_df, feature_df
+
+
+    def get_value_ranges(self):
+        # value ranges of all columns of the filtered data, used as histogram ranges by the aggregates
+        if self.value_ranges is None:
+            value_ranges = ValueRanges()
+            for pred_df, loss_df, feature_df in self.iter_blocks():
+                value_ranges.add(join_frames([pred_df, loss_df, feature_df]))
+            self.value_ranges = value_ranges
+        return self.value_ranges
+
+
+    def aggregate(self, n_segments, compute_segment_ids, metric='performance'):
+        """
+        One pass over the data, aggregating rows by segment.
+        :param compute_segment_ids: function of (metric_df, pred_df, loss_df, feature_df) blocks to segment ids
+        """
+        value_ranges = self.get_value_ranges()
+        aggregates = None
+        for pred_df, loss_df, feature_df in self.iter_blocks():
+            metric_df, ipd = compute_metric_df(metric, pred_df, loss_df)
+            if aggregates is None:
+                # metric columns are renamed from prediction/loss columns, their ranges are the same
+                model_ranges = OrderedDict((m, value_ranges.get_range(cc)) for (cc, m) in zip(ipd, metric_df.columns))
+                aggregates = SegmentAggregates(n_segments, value_ranges, model_ranges)
+            segment_ids = compute_segment_ids(metric_df, pred_df, loss_df, feature_df)
+            aggregates.add(segment_ids, metric_df, feature_df, feature_df[UUID_COL].values)
+        if aggregates is None:
+            # filters removed every row: empty segments, with the metric columns compute_metric_df names
+            model_ranges = OrderedDict(('model_' + str(i), (0., 0.)) for i in range(self.n_models))
+            aggregates = SegmentAggregates(n_segments, value_ranges, model_ranges)
+        return aggregates
+
+
+class StreamingPerformanceComparison(object):
+    """
+    PerformanceComparison over a StreamingDataManager. Clusters are fit with MiniBatchKMeans in a first pass,
+    and segments are aggregated in a second one; segment ids of individual rows are not kept.
+    """
+
+    def __init__(self, data_manager, model_meta, random_state=0):
+        self.data_manager = data_manager
+        self.model_meta = model_meta
+        self.random_state = random_state
+        self.n_segments = None
+        self.segment_aggregates = None
+
+
+    def set_params(self, n_clusters=None, metric='performance', base_models=None, segment_filters=None):
+        if segment_filters:
+            self.n_segments = len(segment_filters)
+            compute_segment_ids = lambda metric_df, pred_df, loss_df, feature_df: compute_explicit_segment_ids(
+                segment_filters, join_frames([pred_df, loss_df, feature_df]))
+            self.segment_aggregates = self.data_manager.aggregate(self.n_segments, compute_segment_ids, metric)
+            return
+
+        self.n_segments = n_clusters
+        clustering_model = MiniBatchKMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=3)
+        clustering_columns = None
+        # rows of blocks smaller than n_clusters, e.g. after filtering, are fit on together
+        pending = []
+        is_fitted = False
+        for pred_df, loss_df, _ in self.data_manager.iter_blocks():
+            metric_df, _ = compute_metric_df(metric, pred_df, loss_df)
+            clustering_columns = get_independent_preds(metric_df.columns, base_models)
+            pending.append(metric_df[clustering_columns].values)
+            if sum(len(p) for p in pending) >= n_clusters:
+                clustering_model.partial_fit(np.concatenate(pending))
+                pending = []
+                is_fitted = True
+        if pending and not is_fitted:
+            # a single fit on all the rows, which raises if there are fewer rows than clusters
+            clustering_model.fit(np.concatenate(pending))
+
+        compute_segment_ids = lambda metric_df, pred_df, loss_df, feature_df: \
+            clustering_model.predict(metric_df[clustering_columns].values)
+        self.segment_aggregates = self.data_manager.aggregate(self.n_segments, compute_segment_ids, metric)
+        # sorting clusters based on model_0 median performance
+        self.segment_aggregates.sort_segments('model_0')
+
+
+    def get_segment_ids(self):
+        # rows are not kept, feature differentiation works from the segment aggregates instead
+        return self.segment_aggregates
+
+
+    def get_encoded_segment_ids(self):
+        # segment ids of individual rows are not kept
+        return None
+
+
+    def get_segment_data_ids(self, segment_id, offset=0, limit=DEFAULT_PAGE_SIZE):
+        # rows are not kept, pages are taken from the uniform sample of the uuids of the segment
+        s = parse_segment_id(segment_id)
+        return {
+            'segmentId': 'segment_' + str(s),
+            'numDataPoints': int(self.segment_aggregates.counts[s]),
+            'offset': offset,
+            'dataIds': get_page(self.segment_aggregates.reservoirs[s].get_items(), offset, limit)
+        }
+
+
+    def get_models_performance_by_segment(self, data_ids_encoding=DATA_IDS_ENCODING['LIST']):
+        # the sample of uuids is small already; compact encodings of rows don't apply, as rows are not kept
+        aggregates = self.segment_aggregates
+        segments_list = []
+        for s in range(self.n_segments):
+            models_list = []
+            for m in aggregates.model_cols:
+                sketch = aggregates.model_sketches[s][m]
+                x = np.linspace(sketch.min, sketch.max, num=100) if sketch.count() > 0 else np.zeros(0)
+                models_list.append({
+                    'modelId': m,
+                    'modelName': self.model_meta[m],
+                    'percentiles': sketch.percentiles(percentile_list),
+                    'density': [x.tolist(), sketch.density(x).tolist()]
+                })
+            segment_dict = {
+                'segmentId': 'segment_' + str(s),
+                'numDataPoints': int(aggregates.counts[s]),
+                'modelsPerformance': models_list
+            }
+            if data_ids_encoding != DATA_IDS_ENCODING['NONE']:
+                # a uniform sample of the uuids of the segment
+                segment_dict['dataIds'] = aggregates.reservoirs[s].get_items()
+            segments_list.append(segment_dict)
+        return segments_list
+
+
+class StreamingFeatureDifferentiation(object):
+    """
+    FeatureDifferentiation over segment aggregates: feature distributions of a segment group are
+    merged from the histograms and category counts of its segments.
+    """
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.segment_aggregates = None
+        self.segment_groups = None
+        # cancellation of the computation of distributions of the last segment groups
+        self.cancel_token = CancelToken()
+        # the whole data as a single segment, for features meta data
+        self.data_aggregates = data_manager.aggregate(1, lambda metric_df, *dfs: np.zeros(len(metric_df)))
+        self.features_meta_data = self.compute_features_meta_data()
+
+
+    def set_params(self, segment_group_0, segment_group_1, segment_ids):
+        # distributions of previous segment groups still being computed are not needed anymore
+        self.cancel()
+        self.cancel_token = CancelToken()
+        self.segment_aggregates = segment_ids
+        self.segment_groups = [list(segment_group_0), list(segment_group_1)]
+
+
+    def cancel(self):
+        self.cancel_token.cancel()
+
+
+    def get_feature_names(self):
+        value_ranges = self.data_manager.get_value_ranges()
+        return [c for c in value_ranges.is_numeric
+                if c in self.data_aggregates.feature_sketches[0] or c in self.data_aggregates.category_counts[0]]
+
+
+    def compute_features_meta_data(self):
+        features_list = []
+        n_rows = self.data_aggregates.counts[0]
+        for feature_name in self.get_feature_names():
+            if feature_name in self.data_aggregates.category_counts[0]:
+                feature_type = 'categorical'
+                value_counts = self.data_aggregates.merged_category_counts(feature_name, [0]) \
+                    .sort_values(ascending=False)
+                distribution = np.stack([value_counts.index.values, value_counts.values]).tolist()
+            else:
+                feature_type = 'numerical'
+                sketch = self.data_aggregates.feature_sketches[0][feature_name]
+                x = np.linspace(sketch.min, sketch.max, num=NUMERICAL_DOMAIN_INTERVAL)
+                distribution = np.stack([x, 10000 * sketch.density(x, bw_method=0.1)]).tolist()
+
+            if len(distribution[0]) <= 1 or \
+                len(distribution[0]) > max(n_rows / 10., 100):
+                continue
+            features_list.append({
+                'name': feature_name,
+                'type': feature_type,
+                'distribution': distribution
+            })
+        return features_list
+
+
+    def get_features_meta_data(self):
+        return self.features_meta_data
+
+
+    def compute_split_cat_count(self, feature_name):
+        aggregates = self.segment_aggregates
+        cc0 = aggregates.merged_category_counts(feature_name, self.segment_groups[0])
+        cc1 = aggregates.merged_category_counts(feature_name, self.segment_groups[1])
+        count_df = pd.concat([cc0 / max(cc0.sum(), 1), cc1 / max(cc1.sum(), 1)], axis=1).fillna(0)
+        count_df.columns = [0, 1]
+        count_df.index = count_df.index.fillna('NO_CATEGORY')
+
+        buffer = 1. / float(aggregates.counts.sum())
+        ratio = (count_df[0].values + buffer) / (count_df[1].values + buffer)
+        count_df = count_df.iloc[np.argsort(ratio, kind='stable')]
+        return np.stack((count_df.index.values, 10000 * count_df[0].values, 10000 * count_df[1].values))
+
+
+    def compute_split_kde(self, feature_name):
+        aggregates = self.segment_aggregates
+        all_segments = list(range(aggregates.n_segments))
+        col_value_range = aggregates.merged_sketch(feature_name, all_segments).percentiles([1, 99])
+        x = np.linspace(col_value_range[0], col_value_range[1], num=NUMERICAL_DOMAIN_INTERVAL)
+        densities = []
+        for group in self.segment_groups:
+            sketch = aggregates.merged_sketch(feature_name, group)
+            densities.append(np.zeros(len(x)) if sketch is None else sketch.density(x, bw_method=0.1))
+        return np.stack((x, 10000 * densities[0], 10000 * densities[1]))
+
+
+    # distributions come from the aggregates, they are cheap enough to be computed for all features before top_k;
+    # concurrent.futures.CancelledError is raised if set_params or cancel is called before they are all computed
+    def get_features_distribution_by_segment_group(self, top_k=None):
+        cancel_token = self.cancel_token
+        distribution_list = []
+        n_rows = self.segment_aggregates.counts.sum()
+        buffer = 1. / float(max(n_rows, 1))
+
+        for feature_name in self.get_feature_names():
+            cancel_token.raise_if_cancelled()
+            if feature_name in self.data_aggregates.category_counts[0]:
+                distribution_dict = {
+                    'name': feature_name,
+                    'type': 'categorical',
+                    'distribution': self.compute_split_cat_count(feature_name).tolist()
+                }
+            else:
+                distribution_dict = {
+                    'name': feature_name,
+                    'type': 'numerical',
+                    'distribution': self.compute_split_kde(feature_name).tolist()
+                }
+
+            # ignore features with too may categories, like uuid; ignore features with only one category
+            if len(distribution_dict['distribution'][0]) <= 1 or \
+                len(distribution_dict['distribution'][0]) > max(n_rows / 10., 100):
+                continue
+
+            distribution_dict['divergence'] = entropy(
+                np.array(distribution_dict['distribution'][1]) + buffer,
+                np.array(distribution_dict['distribution'][2]) + buffer
+            )
+            distribution_list.append(distribution_dict)
+        cancel_token.raise_if_cancelled()
+        return sorted(distribution_list, key=lambda x: x['divergence'], reverse=True)[:top_k]
@@ -1,31 +1,186 @@
+import ast
+import numbers
+import operator
+import re
 import numpy as np
+import pandas as pd
 from .constants import FILTER_TYPE
 
 
-# transform a dict of <column name -> value range> mappings into a mask
-def compute_filter(filters, full_df):
-    masks = []
+# no ast.Pow, as filter expressions may come from a client and e.g. 9**9**9**9 never returns; operands
+# are numbers or numerical columns only, see is_numeric_operand
+BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+}
+UNARY_OPS = {
+    ast.Not: operator.invert,
+    ast.Invert: operator.invert,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a.isin(b) if isinstance(a, pd.Series) else a in b,
+    ast.NotIn: lambda a, b: ~a.isin(b) if isinstance(a, pd.Series) else a not in b,
+}
+# column methods which can be called from a FUNC filter expression
+ALLOWED_METHODS = {'isin', 'isna', 'notna', 'isnull', 'notnull', 'between', 'abs'}
+BACKTICK_NAME = re.compile(r'`([^`]*)`')
 
-    for f in filters:
-        filter_func = lambda x: True
-        if f['key'] in full_df.columns:
-            if f['type'] == FILTER_TYPE['INCLUDE'] :
-                filter_func = lambda x: x[f['key']] in f['value']
 
-            elif f['type'] == FILTER_TYPE['EXCLUDE']:
-                filter_func = lambda x: x[f['key']] not in f['value']
+# operands arithmetic applies to; sequences and strings are left out, as e.g. 'a' * 10**9 allocates
+# gigabytes, and so does a string column times a large number
+def is_numeric_operand(value):
+    if isinstance(value, pd.Series):
+        return pd.api.types.is_numeric_dtype(value) or pd.api.types.is_bool_dtype(value)
+    return isinstance(value, numbers.Number)
+
+
+def values_with_nulls(values):
+    non_null = [v for v in values if not pd.isnull(v)]
+    return non_null, len(non_null) != len(values)
+
+
+def isin_mask(col, values):
+    non_null, has_null = values_with_nulls(list(values))
+    # owned copy, pandas may return read-only views
+    mask = col.isin(non_null).to_numpy(copy=True)
+    if has_null:
+        mask |= col.isnull().to_numpy()
+    return mask
+
+
+def range_mask(col, value_range):
+    mask = np.ones(len(col), dtype=bool)
+    if value_range[0] is not None:
+        mask &= (col >= value_range[0]).values
+    if value_range[1] is not None:
+        mask &= (col <= value_range[1]).values
+    return mask
+
+
+class FilterExpression(object):
+    """
+    Column-wise evaluator for FUNC filters. Only comparisons, arithmetic/boolean operators, literals,
+    column references and a few column methods are allowed, anything else is rejected.
+    Columns can be referred to by name, by `backtick quoted name`, or through the argument of a
+    legacy row lambda, e.g. "lambda x: x['age'] > 30".
+    """
+
+    def __init__(self, expression):
+        names = []
+
+        def quote(match):
+            names.append(match.group(1))
+            return '__col_{}'.format(len(names) - 1)
 
-            elif f['type'] == FILTER_TYPE['RANGE']:
-                filter_func = lambda x: (f['value'][0] is None or x[f['key']] >= f['value'][0]) and \
-                                        (f['value'][1] is None or x[f['key']] <= f['value'][1])
+        self.quoted_names = names
+        try:
+            self.tree = ast.parse(BACKTICK_NAME.sub(quote, expression.strip()), mode='eval').body
+        except SyntaxError:
+            raise ValueError('Invalid filter expression: {}'.format(expression))
+        self.arg_name = None
+        if isinstance(self.tree, ast.Lambda):
+            if len(self.tree.args.args) != 1:
+                raise ValueError('Filter lambda must take exactly one argument')
+            self.arg_name = self.tree.args.args[0].arg
+            self.tree = self.tree.body
 
-        elif f['type'] == FILTER_TYPE['FUNC']:
-            filter_func = eval(f['value'])
 
-        masks.append(full_df.apply(filter_func, axis=1).values)
+    def evaluate(self, df):
+        result = self.eval_node(self.tree, df)
+        if isinstance(result, pd.Series):
+            return result.fillna(False).values.astype(bool)
+        return np.full(len(df), bool(result))
 
-    if len(masks) == 0:
-        return np.ones(len(full_df), dtype=bool)
-    if len(masks) == 1:
-        return masks[0]
-    return np.all(np.column_stack(masks), axis=1)
\ No newline at end of file
+
+    def eval_column(self, name, df):
+        if name not in df.columns:
+            raise ValueError('Unknown column in filter expression: {}'.format(name))
+        return df[name]
+
+
+    def eval_node(self, node, df):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return [self.eval_node(e, df) for e in node.elts]
+        if isinstance(node, ast.Name):
+            if node.id.startswith('__col_'):
+                return self.eval_column(self.quoted_names[int(node.id[len('__col_'):])], df)
+            return self.eval_column(node.id, df)
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == self.arg_name:
+            return self.eval_column(self.eval_node(node.slice, df), df)
+        if isinstance(node, ast.BoolOp):
+            values = [self.eval_node(v, df) for v in node.values]
+            combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+            result = values[0]
+            for v in values[1:]:
+                result = combine(result, v)
+            return result
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+            operand = self.eval_node(node.operand, df)
+            if isinstance(node.op, ast.Not) and not isinstance(operand, pd.Series):
+                return not operand
+            return UNARY_OPS[type(node.op)](operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in BIN_OPS:
+            left = self.eval_node(node.left, df)
+            right = self.eval_node(node.right, df)
+            if not is_numeric_operand(left) or not is_numeric_operand(right):
+                raise ValueError('Operator {} only applies to numbers and numerical columns'.format(
+                    type(node.op).__name__))
+            return BIN_OPS[type(node.op)](left, right)
+        if isinstance(node, ast.Compare) and all(type(op) in COMPARE_OPS for op in node.ops):
+            result = None
+            left = self.eval_node(node.left, df)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.eval_node(comparator, df)
+                mask = COMPARE_OPS[type(op)](left, right)
+                result = mask if result is None else result & mask
+                left = right
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                and node.func.attr in ALLOWED_METHODS and not node.keywords:
+            target = self.eval_node(node.func.value, df)
+            if not isinstance(target, pd.Series):
+                raise ValueError('Method {} can only be called on a column'.format(node.func.attr))
+            return getattr(target, node.func.attr)(*[self.eval_node(a, df) for a in node.args])
+        raise ValueError('Unsupported syntax in filter expression: {}'.format(type(node).__name__))
+
+
+# transform a single filter dict into a mask, using column operations only
+def compute_filter_mask(f, full_df):
+    if f['key'] in full_df.columns:
+        col = full_df[f['key']]
+        if f['type'] == FILTER_TYPE['INCLUDE']:
+            return isin_mask(col, f['value'])
+        elif f['type'] == FILTER_TYPE['EXCLUDE']:
+            return ~isin_mask(col, f['value'])
+        elif f['type'] == FILTER_TYPE['RANGE']:
+            return range_mask(col, f['value'])
+
+    elif f['type'] == FILTER_TYPE['FUNC']:
+        return FilterExpression(f['value']).evaluate(full_df)
+
+    return np.ones(len(full_df), dtype=bool)
+
+
+# transform a dict of <column name -> value range> mappings into a mask
+def compute_filter(filters, full_df):
+    mask = np.ones(len(full_df), dtype=bool)
+    for f in filters:
+        mask &= compute_filter_mask(f, full_df)
+    return mask
@@ -26,6 +26,7 @@ import {
 } from '../actions';
 import {
   getHasBackend,
+  getIsKernelMode,
   getIsManualSegmentation,
   getMetric,
   getIsModelsComparisonLoading,
@@ -53,6 +54,7 @@ const mapDispatchToProps = {
 const mapStateToProps = (state, props) => {
   return {
     hasBackend: getHasBackend(state),
+    isKernelMode: getIsKernelMode(state),
     modelsMeta: getModelsMeta(state),
     columnDefs: getColumnDefs(state),
     metric: getMetric(state),
@@ -74,6 +76,8 @@ class PerformanceComparisonControlContainer extends PureComponent {
     flexDirection: PropTypes.string,
     isModelsComparisonLoading: PropTypes.bool,
     hasBackend: PropTypes.bool,
+    // the segmentation is set in the notebook kernel, see `update_segmentation` of the jupyter widget
+    isKernelMode: PropTypes.bool,
 
     modelsMeta: STATE_DATA_TYPES.modelsMeta,
     metric: STATE_DATA_TYPES.metric,
@@ -91,23 +95,30 @@ class PerformanceComparisonControlContainer extends PureComponent {
     modelComparisonParams: {nClusters: 4},
     isModelsComparisonLoading: false,
     hasBackend: false,
+    isKernelMode: false,
     modelsMeta: {},
     metric: {},
     isManualSegmentation: false,
   };
 
   _renderInputButtons = () => {
-    const {isModelsComparisonLoading, isManualSegmentation} = this.props;
+    const {
+      isModelsComparisonLoading,
+      isManualSegmentation,
+      isKernelMode,
+    } = this.props;
+    const disabled =
+      isModelsComparisonLoading || isManualSegmentation || isKernelMode;
     return (
       <InputButtons>
         <button
-          disabled={isModelsComparisonLoading || isManualSegmentation}
+          disabled={disabled}
           onClick={() => this._onUpdateNClusters({isInc: false})}
         >
           -
         </button>
         <button
-          disabled={isModelsComparisonLoading || isManualSegmentation}
+          disabled={disabled}
           onClick={() => this._onUpdateNClusters({isInc: true})}
         >
           +
@@ -157,6 +168,7 @@ class PerformanceComparisonControlContainer extends PureComponent {
       width,
       flexDirection,
       isModelsComparisonLoading,
+      isKernelMode,
       modelsMeta: {nClasses},
       columnDefs,
       metric,
@@ -185,6 +197,7 @@ class PerformanceComparisonControlContainer extends PureComponent {
           isHidden={isHorizontal && width < WIDTH_LADDER[2]}
         >
           <Select
+            disabled={isKernelMode}
             options={METRIC_OPTIONS[modelType]}
             labelKey="name"
             size={SIZE.compact}
@@ -198,7 +211,7 @@ class PerformanceComparisonControlContainer extends PureComponent {
           isHidden={isHorizontal && width < WIDTH_LADDER[0]}
         >
           <Select
-            disabled={isModelsComparisonLoading}
+            disabled={isModelsComparisonLoading || isKernelMode}
             options={[
               {id: SEGMENTATION_METHOD.AUTO},
               {id: SEGMENTATION_METHOD.MANUAL},
@@ -221,6 +234,7 @@ class PerformanceComparisonControlContainer extends PureComponent {
           isHidden={isHorizontal && width < WIDTH_LADDER[1]}
         >
           <Select
+            disabled={isKernelMode}
             size={SIZE.compact}
             options={columnDefs}
             value={baseCols.map(colId => columnDefs[colId])}
@@ -12,6 +12,10 @@ import get from 'lodash.get';
 export const rootSelector = state => state;
 export const getHasBackend = state =>
   Boolean(get(state, ['_env', 'hasBackend']));
+// in the kernel mode of the jupyter widget, results are computed by the notebook kernel, which sends them in the
+// format of the API responses. Unlike with a backend, nothing is fetched
+export const getIsKernelMode = state =>
+  Boolean(get(state, ['_env', 'isKernelMode']));
 
 export const getModelsComparisonParams = createSelector(
   rootSelector,
@@ -1,5 +1,5 @@
 // @noflow
-import {rootSelector, getHasBackend} from './base';
+import {rootSelector, getHasBackend, getIsKernelMode} from './base';
 import {
   getMetaDataFromRaw,
   getSegmentedCatNumFeatures,
@@ -16,30 +16,37 @@ const getApiMetaData = createSelector(rootSelector, state => state.metaData);
 const getApiModels = createSelector(rootSelector, state => state.models);
 const getApiFeatures = createSelector(rootSelector, state => state.features);
 
+// -- whether results come from the API, i.e. from a backend or from the kernel of the jupyter widget -- //
+const getHasApiResults = createSelector(
+  getHasBackend,
+  getIsKernelMode,
+  (hasBackend, isKernelMode) => hasBackend || isKernelMode
+);
+
 // -- computed data. Either came directly from BE API, or computed in FE -- //
 export const getMetaData = createSelector(
-  getHasBackend,
+  getHasApiResults,
   getApiMetaData,
   getMetaDataFromRaw,
-  (hasBackend, apiMeta = {}, feMeta = []) => {
-    return hasBackend ? apiMeta : feMeta;
+  (hasApiResults, apiMeta = {}, feMeta = []) => {
+    return hasApiResults ? apiMeta : feMeta;
   }
 );
 
 export const getModelsPerformance = createSelector(
-  getHasBackend,
+  getHasApiResults,
   getApiModels,
   getModelPerfHistograms,
-  (hasBackend, apiModels, feModels) => {
-    return hasBackend ? apiModels : feModels;
+  (hasApiResults, apiModels, feModels) => {
+    return hasApiResults ? apiModels : feModels;
   }
 );
 
 export const getFeaturesDistribution = createSelector(
-  getHasBackend,
+  getHasApiResults,
   getApiFeatures,
   getSegmentedCatNumFeatures,
-  (hasBackend, apiFeatures, feFeatures) => {
-    return hasBackend ? apiFeatures : feFeatures;
+  (hasApiResults, apiFeatures, feFeatures) => {
+    return hasApiResults ? apiFeatures : feFeatures;
   }
 );